@@ -0,0 +1 @@
+"""基准测试（模拟模型服务 + 录制/合成数据），见 benchmarks/run.py"""
@@ -0,0 +1,124 @@
+# mock_ollama.py
+"""
+本地模拟 Ollama HTTP 服务（/api/chat），回放录制的模型输出
+
+带图片的请求视为视觉模型调用，返回 fixtures/vision_outputs.jsonl 中的输出；
+其余视为推理模型调用，返回 fixtures/reasoning_outputs.jsonl 中的输出。两类输出各自轮换，
+并可设置固定延迟模拟后端耗时。
+
+单独运行: python -m benchmarks.mock_ollama --port 11500 --vision-latency 0.8
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_outputs(filename):
+    """读取录制的模型输出（每行一个 {"content": ...}）"""
+    with open(os.path.join(FIXTURE_DIR, filename), "r", encoding="utf-8") as f:
+        return [json.loads(line)["content"] for line in f if line.strip()]
+
+
+class MockOllamaServer:
+    """在后台线程中运行的模拟服务"""
+
+    def __init__(self, host="127.0.0.1", port=0, vision_latency=0.0, reasoning_latency=0.0):
+        self.vision_latency = vision_latency
+        self.reasoning_latency = reasoning_latency
+        self._vision = itertools.cycle(load_outputs("vision_outputs.jsonl"))
+        self._reasoning = itertools.cycle(load_outputs("reasoning_outputs.jsonl"))
+        self._lock = threading.Lock()
+        self.requests = {"vision": 0, "reasoning": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_output(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+            return next(self._vision if kind == "vision" else self._reasoning)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, body, status=200):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._reply({"models": [{"name": "qwen3-vl:8b"}, {"name": "deepseek-r1:7b"}]})
+                elif self.path == "/api/version":
+                    self._reply({"version": "mock"})
+                else:
+                    self._reply({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/generate" and not request.get("prompt"):
+                    # 空提示：只加载模型（启动预热）
+                    self._reply({"model": request.get("model", ""), "response": "", "done": True})
+                    return
+                if self.path != "/api/chat":
+                    self._reply({"error": "not found"}, 404)
+                    return
+
+                messages = request.get("messages") or []
+                is_vision = any(message.get("images") for message in messages)
+                kind = "vision" if is_vision else "reasoning"
+                time.sleep(server.vision_latency if is_vision else server.reasoning_latency)
+                content = server.next_output(kind)
+                prompt_chars = sum(len(message.get("content") or "") for message in messages)
+                self._reply({
+                    "model": request.get("model", ""),
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "message": {"role": "assistant", "content": content},
+                    "done": True,
+                    "done_reason": "stop",
+                    "prompt_eval_count": prompt_chars // 2,
+                    "eval_count": len(content) // 2,
+                })
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="Mock-Ollama")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模拟 Ollama 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--vision-latency", type=float, default=0.0)
+    parser.add_argument("--reasoning-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockOllamaServer(args.host, args.port, args.vision_latency, args.reasoning_latency)
+    print(f"模拟 Ollama 服务已启动: {server.url}（设置 OLLAMA_HOST={server.url} 使用）")
+    server.httpd.serve_forever()
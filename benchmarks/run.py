@@ -0,0 +1,386 @@
+# run.py
+"""
+基准测试入口（使用本地模拟 Ollama 服务，不依赖真实模型）
+
+    python -m benchmarks.run                         # 运行全部
+    python -m benchmarks.run --only json_repair,mjpeg
+    python -m benchmarks.run --kb-sizes 1000,10000,100000 --compare benchmarks/results/上次.json
+
+结果保存为 JSON（默认 benchmarks/results/bench_<时间>.json）；指定 --compare 时与之前的结果对比，
+耗时类指标变慢或吞吐类指标下降超过 --threshold 时视为回归，退出码为 1。
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks import synthetic  # noqa: E402
+from benchmarks.mock_ollama import MockOllamaServer, load_outputs  # noqa: E402
+
+
+def _percentiles(samples_seconds):
+    values = np.array(samples_seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+# ---------- 各项基准 ----------
+
+def bench_json_repair(args):
+    """JSONFixer 对各类录制输出（正常/代码块/尾逗号/算式/重复metadata/思考过程）的解析吞吐"""
+    from fix_json_output import JSONFixer
+
+    fixtures = [json.loads(line) for line in open(
+        os.path.join(BENCH_DIR, "fixtures", "reasoning_outputs.jsonl"), encoding="utf-8") if line.strip()]
+    results = {}
+    for fixture in fixtures:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            JSONFixer.safe_parse(fixture["content"])
+        elapsed = time.perf_counter() - start
+        results[fixture["kind"]] = {
+            "parses_per_sec": round(args.iterations / elapsed, 1),
+            "mean_us": round(elapsed / args.iterations * 1e6, 2),
+        }
+    return results
+
+
+def bench_chunking(args):
+    """文档分块吞吐"""
+    from kb.indexing import smart_chunk_text
+
+    texts = synthetic.corpus_texts(args.docs)
+    start = time.perf_counter()
+    chunks = 0
+    for i, text in enumerate(texts):
+        chunks += len(smart_chunk_text(text, f"rule_{i}.md", max_chars=500))
+    elapsed = time.perf_counter() - start
+    return {
+        "docs": len(texts),
+        "chunks": chunks,
+        "docs_per_sec": round(len(texts) / elapsed, 1),
+        "chunks_per_sec": round(chunks / elapsed, 1),
+    }
+
+
+def bench_embedding(args):
+    """向量化吞吐，以及合成语料上完整构建索引的耗时"""
+    from sentence_transformers import SentenceTransformer
+    from kb.indexing import build_index, smart_chunk_text
+
+    model = SentenceTransformer(args.embed_model)
+    texts = []
+    for i, text in enumerate(synthetic.corpus_texts(args.docs)):
+        texts.extend(chunk["text"] for chunk in smart_chunk_text(text, f"rule_{i}.md", max_chars=500))
+
+    start = time.perf_counter()
+    model.encode(texts, batch_size=32, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    encode_elapsed = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic.write_corpus(os.path.join(tmp, "source"), args.docs)
+        start = time.perf_counter()
+        build_index(
+            data_dir=os.path.join(tmp, "source"),
+            index_path=os.path.join(tmp, "index", "faiss.index"),
+            meta_path=os.path.join(tmp, "index", "docs.pkl"),
+            model_name=args.embed_model,
+            include_cases=False
+        )
+        build_elapsed = time.perf_counter() - start
+
+    return {
+        "chunks": len(texts),
+        "chunks_per_sec": round(len(texts) / encode_elapsed, 1),
+        "build_index_seconds": round(build_elapsed, 3),
+    }
+
+
+def bench_retrieval(args):
+    """检索延迟随语料规模的变化（内积索引，随机归一化向量）"""
+    import faiss
+
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in args.kb_sizes:
+        vectors = rng.standard_normal((size, args.dim)).astype("float32")
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = faiss.IndexFlatIP(args.dim)
+        index.add(vectors)
+
+        queries = rng.standard_normal((args.queries, args.dim)).astype("float32")
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query[None, :], 3)
+            samples.append(time.perf_counter() - start)
+        results[str(size)] = _percentiles(samples)
+    return results
+
+
+def bench_mjpeg(args):
+    """MJPEG 推流扇出：多个客户端同时读取同一路画面时的实际帧率和CPU开销"""
+    import config
+    from frames import FrameRing
+    from stream import generate_frames
+
+    camera_id = "bench"
+    ring = FrameRing()
+    config.frame_buffers[camera_id] = ring
+    images = synthetic.synthetic_frames(60)
+    stop = threading.Event()
+    delivered = [0] * args.clients
+
+    def produce():
+        i = 0
+        while not stop.is_set():
+            ring.write(images[i % len(images)], time.time())
+            i += 1
+            time.sleep(1.0 / args.source_fps)
+
+    def consume(slot):
+        for _ in generate_frames(camera_id):
+            delivered[slot] += 1
+            if stop.is_set():
+                break
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=consume, args=(i,), daemon=True) for i in range(args.clients)]
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    del config.frame_buffers[camera_id]
+
+    return {
+        "clients": args.clients,
+        "source_fps": args.source_fps,
+        "client_fps_mean": round(sum(delivered) / len(delivered) / elapsed, 2),
+        "client_fps_min": round(min(delivered) / elapsed, 2),
+        "cpu_seconds_per_sec": round(cpu / elapsed, 3),
+    }
+
+
+def bench_pipeline(args):
+    """采集到决策的端到端延迟（视觉 + 知识库检索 + 推理 + JSON解析 + 报警处理）"""
+    import config
+
+    # 报警图片、事件库、追踪、知识库案例全部写入临时目录
+    workspace = tempfile.mkdtemp(prefix="bench_")
+    config.ALARM_DIR = os.path.join(workspace, "alarms")
+    config.DATA_DIR = os.path.join(workspace, "data")
+    config.EVENT_DB_PATH = os.path.join(config.DATA_DIR, "events.db")
+    config.TRACE_FILE = os.path.join(config.DATA_DIR, "traces.jsonl")
+    os.makedirs(config.ALARM_DIR, exist_ok=True)
+    os.makedirs(config.DATA_DIR, exist_ok=True)
+    # 测量期间写入的报警案例不触发索引重建
+    config.KB_AUTO_REINDEX = False
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        import metrics
+        from frames import FrameRing
+        from kb.indexing import build_index
+        from kb.retriever import load_index, refresh_cache, warmup
+        from model_infer import send_to_model
+        from persistence import writer
+
+        # 在工作目录中用合成语料构建知识库索引，检索走真实的 FAISS 查询（计时前完成并加载）
+        synthetic.write_corpus(os.path.join("kb", "source"), args.docs)
+        build_index(data_dir=os.path.join("kb", "source"), model_name=args.embed_model, include_cases=False)
+        refresh_cache()
+        load_index(model_name=args.embed_model)
+        warmup()
+
+        images = synthetic.synthetic_frames(args.frames) if not args.frames_path else \
+            synthetic.load_frames(args.frames_path, args.frames)
+        ring = FrameRing()
+        samples = []
+        decisions = {}
+        for image in images:
+            frame = ring.write(image, time.time()).detach()
+            output = send_to_model(frame, "bench")
+            samples.append(time.time() - frame.timestamp)
+            level = output["alarm_level"] if output else "失败"
+            decisions[level] = decisions.get(level, 0) + 1
+        writer.flush(timeout=10)
+
+        def mean_ms(histogram):
+            sample = histogram._values.get(())
+            return round(sample[1] / sample[2] * 1000, 3) if sample and sample[2] else None
+
+        result = {
+            "frames": len(images),
+            "kb_docs": args.docs,
+            "vision_latency_s": args.vision_latency,
+            "reasoning_latency_s": args.reasoning_latency,
+            "decisions": decisions,
+            "vision_mean_ms": mean_ms(metrics.VISION_SECONDS),
+            "reasoning_mean_ms": mean_ms(metrics.REASONING_SECONDS),
+            "kb_retrieval_mean_ms": mean_ms(metrics.KB_RETRIEVAL_SECONDS),
+        }
+        result.update(_percentiles(samples))
+        return result
+    finally:
+        os.chdir(cwd)
+        config.KB_AUTO_REINDEX = True
+        from kb.retriever import refresh_cache
+        refresh_cache()
+
+
+BENCHMARKS = {
+    "json_repair": bench_json_repair,
+    "chunking": bench_chunking,
+    "embedding": bench_embedding,
+    "retrieval": bench_retrieval,
+    "mjpeg": bench_mjpeg,
+    "pipeline": bench_pipeline,
+}
+
+
+# ---------- 结果对比 ----------
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(previous, current, threshold):
+    """返回回归列表：耗时类（_ms/_us/_seconds）变大、吞吐类（_per_sec/_fps）变小超过阈值"""
+    regressions = []
+    old = _flatten(previous.get("results", {}))
+    new = _flatten(current.get("results", {}))
+    for name, value in sorted(new.items()):
+        before = old.get(name)
+        if not before:
+            continue
+        change = (value - before) / before
+        metric = name.rsplit(".", 1)[-1]
+        if metric.startswith("cpu_") or metric.endswith(("_ms", "_us", "_seconds")):
+            regressed = change > threshold
+        elif metric.endswith("_per_sec") or metric.startswith("client_fps"):
+            regressed = change < -threshold
+        else:
+            continue
+        if regressed:
+            regressions.append((name, before, value, change))
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基准测试")
+    parser.add_argument("--only", help="逗号分隔的基准名称: " + ",".join(BENCHMARKS))
+    parser.add_argument("--out", help="结果文件路径")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    parser.add_argument("--threshold", type=float, default=0.10, help="回归判定阈值（比例）")
+    parser.add_argument("--iterations", type=int, default=2000, help="JSON解析每类输出的次数")
+    parser.add_argument("--docs", type=int, default=500, help="合成知识库文档数")
+    parser.add_argument("--embed-model", default="BAAI/bge-small-zh-v1.5")
+    parser.add_argument("--kb-sizes", default="1000,10000,100000", help="检索基准的语料规模（向量数）")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8, help="MJPEG 并发客户端数")
+    parser.add_argument("--source-fps", type=float, default=25.0)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--frames", type=int, default=20, help="端到端基准的帧数")
+    parser.add_argument("--frames-path", help="录制的帧（图片目录或视频文件），默认使用合成帧")
+    parser.add_argument("--vision-latency", type=float, default=0.0, help="模拟视觉模型耗时（秒）")
+    parser.add_argument("--reasoning-latency", type=float, default=0.0, help="模拟推理模型耗时（秒）")
+    args = parser.parse_args()
+    args.kb_sizes = [int(size) for size in args.kb_sizes.split(",")]
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基准: {unknown}")
+
+    # ollama 客户端在导入时读取 OLLAMA_HOST，必须在导入推理模块之前启动模拟服务
+    server = None
+    if "pipeline" in names:
+        server = MockOllamaServer(vision_latency=args.vision_latency,
+                                  reasoning_latency=args.reasoning_latency).start()
+        os.environ["OLLAMA_HOST"] = server.url
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+            "fixtures": {
+                "vision_outputs": len(load_outputs("vision_outputs.jsonl")),
+                "reasoning_outputs": len(load_outputs("reasoning_outputs.jsonl")),
+            },
+        },
+        "results": {},
+        "skipped": {},
+    }
+
+    for name in names:
+        print(f"▶ {name} ...", flush=True)
+        try:
+            report["results"][name] = BENCHMARKS[name](args)
+            print(f"  {json.dumps(report['results'][name], ensure_ascii=False)}")
+        except ImportError as e:
+            # 缺少可选依赖（如 faiss / sentence-transformers）时跳过
+            report["skipped"][name] = f"缺少依赖: {e}"
+            print(f"  跳过: {e}")
+
+    if server is not None:
+        server.stop()
+
+    out = args.out or os.path.join(BENCH_DIR, "results", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        regressions = compare(previous, report, args.threshold)
+        if regressions:
+            print(f"发现 {len(regressions)} 项回归（阈值 {args.threshold:.0%}）:")
+            for name, before, after, change in regressions:
+                print(f"  {name}: {before} -> {after} ({change:+.1%})")
+            sys.exit(1)
+        print("未发现回归")
+
+
+if __name__ == "__main__":
+    main()
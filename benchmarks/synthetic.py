@@ -0,0 +1,92 @@
+# synthetic.py
+"""基准测试用的合成数据：视频帧、知识库文档"""
+import glob
+import os
+import random
+
+import cv2
+import numpy as np
+
+_PHRASES = [
+    "人员进入配电室前必须佩戴工牌并登记",
+    "禁区内发现未授权人员时应立即通知安保",
+    "机房温度超过阈值需要检查空调系统",
+    "配电柜附近出现烟雾属于紧急情况",
+    "夜间巡检发现门禁未关闭应记录并上报",
+    "访客需由员工陪同进入办公区域",
+    "消防通道禁止堆放杂物",
+    "电缆裸露或破损属于电气风险",
+    "施工区域人员必须佩戴安全帽",
+    "监控画面无人且设备运行正常时无需报警",
+]
+
+
+def synthetic_frames(count, size=(1280, 720), seed=0):
+    """生成带运动目标和噪声的帧（近似真实画面的编码开销）"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    background = rng.integers(40, 90, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), 8)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        x = int((i * 17) % max(width - 120, 1))
+        y = int(height / 2 + np.sin(i / 5.0) * height / 4)
+        cv2.rectangle(frame, (x, y - 80), (x + 60, y + 80), (30, 30, 200), -1)
+        cv2.putText(frame, f"frame {i}", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+        noise = rng.integers(0, 12, (height, width, 3), dtype=np.uint8)
+        frames.append(cv2.add(frame, noise))
+    return frames
+
+
+def load_frames(path, limit=None):
+    """读取录制的帧：图片目录（按文件名排序）或视频文件"""
+    frames = []
+    if os.path.isdir(path):
+        for filename in sorted(glob.glob(os.path.join(path, "*"))):
+            image = cv2.imread(filename)
+            if image is not None:
+                frames.append(image)
+            if limit and len(frames) >= limit:
+                break
+        return frames
+
+    cap = cv2.VideoCapture(path)
+    while not limit or len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def synthetic_document(index, rng):
+    """生成一篇规则/案例风格的 Markdown 文档"""
+    lines = [f"# 安防规则 {index}", ""]
+    for section in range(rng.randint(2, 4)):
+        lines.append(f"## 条款 {index}.{section + 1}")
+        lines.append("")
+        for _ in range(rng.randint(2, 4)):
+            sentences = rng.sample(_PHRASES, rng.randint(2, 5))
+            lines.append("。".join(sentences) + "。")
+            lines.append("")
+    return "\n".join(lines)
+
+
+def write_corpus(directory, count, seed=0):
+    """在目录下写入 count 篇合成文档，返回文档总字符数"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    total = 0
+    for i in range(count):
+        text = synthetic_document(i, rng)
+        total += len(text)
+        with open(os.path.join(directory, f"rule_{i:05d}.md"), "w", encoding="utf-8") as f:
+            f.write(text)
+    return total
+
+
+def corpus_texts(count, seed=0):
+    rng = random.Random(seed)
+    return [synthetic_document(i, rng) for i in range(count)]
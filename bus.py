@@ -0,0 +1,360 @@
+# bus.py
+"""
+进程间消息总线
+
+采集、推理、API 三种角色之间通过总线传递帧、视觉事实、决策和广播事件，
+角色可以在同一进程内运行（默认，进程内队列，不做序列化），也可以拆分到不同进程/主机：
+
+  inprocess  进程内队列（默认，单进程部署）
+  zmq        ZeroMQ PUB/SUB，经本地代理转发（python bus.py broker）
+  redis      Redis Streams，支持消费组（同组订阅者分摊消息，用于多台推理主机）
+
+消息由 主题、数据（dict）、可选二进制负载（如 JPEG）组成，订阅按主题前缀匹配。
+主题约定：
+  frames.<camera_id>     采集 -> 推理：待推理的帧（负载为模型输入 JPEG）
+  video.<camera_id>      采集 -> API：推流画面（负载为推流 JPEG，API 不在本进程或使用跨进程总线时发布）
+  facts.<camera_id>      推理：视觉模型输出的事实
+  decisions.<camera_id>  推理：每次推理的完整决策（含耗时，采集角色据此调整推理间隔）
+  broadcast.<camera_id>.<level>  推理 -> API：需要推送给前端的消息（level 为 none/normal/severe/critical）
+
+多个 API worker（uvicorn --workers）各自订阅 broadcast.*，每个 worker 都收到全部消息并推送给自己的连接；
+此时需要跨进程的总线（zmq / redis）。
+"""
+import json
+import os
+import queue
+import socket
+import threading
+
+import config
+import metrics
+from logs import get_logger
+
+log = get_logger("bus")
+
+
+def _encode(data):
+    return json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def _decode(raw):
+    return json.loads(raw.decode("utf-8") if isinstance(raw, bytes) else raw)
+
+
+def _category(topic):
+    return topic.split(".", 1)[0]
+
+
+def broadcast_topic(camera_id, level=None):
+    """广播主题：按摄像头、按等级分段，订阅者可只关注部分摄像头或等级"""
+    from incidents import LEVEL_KEYS
+    return f"broadcast.{camera_id}.{LEVEL_KEYS.get(level, 'none')}"
+
+
+class Subscription:
+    """订阅句柄：get() 返回 (主题, 数据, 负载)，超时返回 None"""
+
+    def get(self, timeout=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            message = self.get(timeout=1.0)
+            if message is not None:
+                yield message
+
+
+class MessageBus:
+    """总线接口"""
+
+    backend = None
+
+    def publish(self, topic, data, payload=None):
+        raise NotImplementedError
+
+    def subscribe(self, prefixes, group=None):
+        """
+        订阅一个或多个主题前缀
+        group: 消费组名；同组的订阅者分摊消息（每条只投递给其中一个），为 None 时每个订阅者都收到全部消息
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# ---------- 进程内 ----------
+
+class _QueueSubscription(Subscription):
+    def __init__(self, bus, prefixes, q):
+        self.bus = bus
+        self.prefixes = prefixes
+        self.queue = q
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus._remove(self)
+
+
+class InProcessBus(MessageBus):
+    """进程内总线：直接传递对象（不序列化、不复制），订阅者队列满时丢弃新消息"""
+
+    backend = "inprocess"
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or config.BUS_QUEUE_SIZE
+        self._subscriptions = []
+        self._groups = {}  # 组名 -> 共享队列
+        self._lock = threading.Lock()
+
+    def publish(self, topic, data, payload=None):
+        metrics.BUS_PUBLISHED.inc(topic=_category(topic))
+        delivered = set()
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for sub in subscriptions:
+            # 同一个共享队列（消费组）只投递一次
+            if id(sub.queue) in delivered or not topic.startswith(sub.prefixes):
+                continue
+            delivered.add(id(sub.queue))
+            try:
+                sub.queue.put_nowait((topic, data, payload))
+            except queue.Full:
+                metrics.BUS_DROPPED.inc(topic=_category(topic))
+
+    def subscribe(self, prefixes, group=None):
+        prefixes = (prefixes,) if isinstance(prefixes, str) else tuple(prefixes)
+        with self._lock:
+            if group is not None:
+                q = self._groups.setdefault(group, queue.Queue(maxsize=self.queue_size))
+            else:
+                q = queue.Queue(maxsize=self.queue_size)
+            sub = _QueueSubscription(self, prefixes, q)
+            self._subscriptions.append(sub)
+        return sub
+
+    def _remove(self, sub):
+        with self._lock:
+            if sub in self._subscriptions:
+                self._subscriptions.remove(sub)
+
+
+# ---------- ZeroMQ ----------
+
+class _ZmqSubscription(Subscription):
+    def __init__(self, context, endpoint, prefixes):
+        import zmq
+        self._zmq = zmq
+        self.socket = context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, config.BUS_QUEUE_SIZE)
+        self.socket.connect(endpoint)
+        for prefix in prefixes:
+            self.socket.setsockopt(zmq.SUBSCRIBE, prefix.encode("utf-8"))
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def get(self, timeout=None):
+        # 套接字只在调用 get() 的线程中使用
+        ms = None if timeout is None else int(timeout * 1000)
+        if not self.poller.poll(ms):
+            return None
+        parts = self.socket.recv_multipart()
+        payload = parts[2] if len(parts) > 2 else None
+        return parts[0].decode("utf-8"), _decode(parts[1]), payload
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+class ZmqBus(MessageBus):
+    """
+    ZeroMQ PUB/SUB 总线
+
+    所有发布者连接代理的 XSUB 端，订阅者连接 XPUB 端，各进程之间无需互相知道地址。
+    发送队列满（订阅者处理不过来）时丢弃新消息，发布者从不阻塞。
+    不支持消费组：多台推理主机应通过 INFERENCE_CAMERAS 分配各自负责的摄像头。
+    """
+
+    backend = "zmq"
+
+    def __init__(self, pub_endpoint=None, sub_endpoint=None):
+        import zmq
+        self._zmq = zmq
+        self.context = zmq.Context.instance()
+        self.sub_endpoint = sub_endpoint or config.BUS_ZMQ_SUB
+        self._pub = self.context.socket(zmq.PUB)
+        self._pub.setsockopt(zmq.SNDHWM, config.BUS_QUEUE_SIZE)
+        self._pub.connect(pub_endpoint or config.BUS_ZMQ_PUB)
+        self._lock = threading.Lock()  # ZeroMQ 套接字不是线程安全的
+
+    def publish(self, topic, data, payload=None):
+        parts = [topic.encode("utf-8"), _encode(data)]
+        if payload is not None:
+            parts.append(payload)
+        try:
+            with self._lock:
+                self._pub.send_multipart(parts, flags=self._zmq.NOBLOCK)
+            metrics.BUS_PUBLISHED.inc(topic=_category(topic))
+        except self._zmq.Again:
+            metrics.BUS_DROPPED.inc(topic=_category(topic))
+
+    def subscribe(self, prefixes, group=None):
+        prefixes = (prefixes,) if isinstance(prefixes, str) else tuple(prefixes)
+        if group is not None:
+            log.warning("ZeroMQ 总线不支持消费组，订阅者 %s 将收到全部消息", group)
+        return _ZmqSubscription(self.context, self.sub_endpoint, prefixes)
+
+    def close(self):
+        self._pub.close(linger=0)
+
+
+def run_zmq_broker(frontend=None, backend=None):
+    """ZeroMQ 代理：XSUB（发布者连接）<-> XPUB（订阅者连接）"""
+    import zmq
+    context = zmq.Context.instance()
+    xsub = context.socket(zmq.XSUB)
+    xsub.bind(frontend or config.BUS_ZMQ_PUB)
+    xpub = context.socket(zmq.XPUB)
+    xpub.bind(backend or config.BUS_ZMQ_SUB)
+    print(f"【BUS】ZeroMQ 代理已启动: 发布端 {frontend or config.BUS_ZMQ_PUB}，订阅端 {backend or config.BUS_ZMQ_SUB}")
+    zmq.proxy(xsub, xpub)
+
+
+# ---------- Redis Streams ----------
+
+class _RedisSubscription(Subscription):
+    def __init__(self, bus, prefixes, group=None):
+        self.bus = bus
+        self.prefixes = prefixes
+        self.group = group
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}-{id(self)}"
+        self.streams = {bus.stream_key(_category(prefix)) for prefix in prefixes}
+        self._pending = []
+        if group is None:
+            # 只读取订阅之后的新消息：从订阅时流中最后一条的 ID 开始读
+            # （不用 "$"，否则在两次读取之间发布的消息会被跳过）
+            self.ids = {stream: self._last_id(stream) for stream in self.streams}
+        else:
+            for stream in self.streams:
+                try:
+                    bus.client.xgroup_create(stream, group, id="$", mkstream=True)
+                except Exception as e:
+                    if "BUSYGROUP" not in str(e):
+                        raise
+            self.ids = {stream: ">" for stream in self.streams}
+
+    def _last_id(self, stream):
+        entries = self.bus.client.xrevrange(stream, count=1)
+        return entries[0][0] if entries else "0-0"
+
+    def get(self, timeout=None):
+        while not self._pending:
+            block = 0 if timeout is None else max(int(timeout * 1000), 1)
+            if self.group is None:
+                response = self.bus.client.xread(self.ids, count=64, block=block)
+            else:
+                response = self.bus.client.xreadgroup(
+                    self.group, self.consumer, self.ids, count=64, block=block)
+            if not response:
+                return None
+            for stream, entries in response:
+                stream = stream.decode("utf-8") if isinstance(stream, bytes) else stream
+                matched, filtered = [], []
+                for entry_id, fields in entries:
+                    if self.group is None:
+                        self.ids[stream] = entry_id
+                    topic = fields[b"topic"].decode("utf-8")
+                    if topic.startswith(self.prefixes):
+                        matched.append(entry_id)
+                        self._pending.append((topic, _decode(fields[b"data"]), fields.get(b"payload")))
+                    else:
+                        filtered.append(entry_id)
+                if self.group is not None:
+                    if matched:
+                        # 帧等消息时效性强，读取即确认（最多投递一次）
+                        self.bus.client.xack(stream, self.group, *matched)
+                    if filtered:
+                        # 同组订阅者的主题前缀应相同（见 roles._consume_frames），不匹配的消息不属于本组；
+                        # 单独确认只为清理待确认列表，不交给订阅者、不计为已处理，记录下来以便发现组内前缀不一致
+                        self.bus.client.xack(stream, self.group, *filtered)
+                        log.debug("消费组读到不匹配的消息", extra={"group": self.group, "count": len(filtered)})
+        return self._pending.pop(0)
+
+
+class RedisBus(MessageBus):
+    """
+    Redis Streams 总线
+
+    每类主题（frames / decisions / broadcast ...）一个流，按 BUS_REDIS_MAXLEN 近似截断；
+    订阅者读取对应的流并按主题前缀过滤。指定消费组时同组订阅者分摊消息。
+    """
+
+    backend = "redis"
+
+    def __init__(self, url=None):
+        import redis
+        self.client = redis.Redis.from_url(url or config.BUS_REDIS_URL)
+        self.namespace = config.BUS_REDIS_NAMESPACE
+
+    def stream_key(self, category):
+        return f"{self.namespace}:{category}"
+
+    def publish(self, topic, data, payload=None):
+        fields = {"topic": topic, "data": _encode(data)}
+        if payload is not None:
+            fields["payload"] = payload
+        try:
+            self.client.xadd(self.stream_key(_category(topic)), fields,
+                             maxlen=config.BUS_REDIS_MAXLEN, approximate=True)
+            metrics.BUS_PUBLISHED.inc(topic=_category(topic))
+        except Exception as e:
+            metrics.BUS_DROPPED.inc(topic=_category(topic))
+            log.warning("发布消息失败: %s", e, extra={"topic": topic})
+
+    def subscribe(self, prefixes, group=None):
+        prefixes = (prefixes,) if isinstance(prefixes, str) else tuple(prefixes)
+        return _RedisSubscription(self, prefixes, group)
+
+    def close(self):
+        self.client.close()
+
+
+_BACKENDS = {
+    "inprocess": InProcessBus,
+    "zmq": ZmqBus,
+    "redis": RedisBus,
+}
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    """按 BUS_BACKEND 创建的全局总线（首次使用时创建）"""
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = _BACKENDS[config.BUS_BACKEND]()
+    return _bus
+
+
+def publish(topic, data, payload=None):
+    get_bus().publish(topic, data, payload)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="消息总线工具")
+    parser.add_argument("command", choices=["broker"], help="broker: 运行 ZeroMQ 代理")
+    args = parser.parse_args()
+    if args.command == "broker":
+        run_zmq_broker()
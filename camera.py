@@ -1,32 +1,32 @@
 # camera.py
 import cv2
+import os
 import time
 import threading
 import config  # 改为导入整个模块
-from model_infer import try_infer
+import metrics
+from logs import get_logger
 
+log = get_logger("rtsp")
 
-def create_rtsp_capture(rtsp_url):
+
+_capture_options_lock = threading.Lock()
+
+
+def create_rtsp_capture(rtsp_url, ffmpeg_options=None):
     """创建RTSP捕获对象，配置优化参数"""
     
     # 设置FFmpeg参数
-    ffmpeg_options = {
-        'rtsp_transport': 'tcp',  # 强制使用TCP（更稳定）
-        'buffer_size': '1024000',  # 增加缓冲区
-        'max_delay': '500000',  # 最大延迟500ms
-        'stimeout': '5000000',  # 超时5秒（5000000微秒）
-        'analyzeduration': '10000000',
-        'probesize': '10000000',
-    }
-    
-    # 构建FFmpeg参数字符串
-    options = []
-    for key, value in ffmpeg_options.items():
-        options.append(f'{key}={value}')
-    options_str = ' '.join(options)
-    
-    # 创建VideoCapture对象
-    cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
+    options = dict(config.FFMPEG_CAPTURE_OPTIONS)
+    options.update(ffmpeg_options or {})
+    
+    # 构建FFmpeg参数字符串（OpenCV格式：key;value|key;value）
+    options_str = '|'.join(f'{key};{value}' for key, value in options.items())
+    
+    # 环境变量是进程级的，且只在打开时读取，多路摄像头并发打开时需要加锁
+    with _capture_options_lock:
+        os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = options_str
+        cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
     
     # 尝试设置OpenCV属性
     cap.set(cv2.CAP_PROP_BUFFERSIZE, 3)
@@ -72,9 +72,11 @@ def check_rtsp_health(cap, timeout=3.0):
 class RTSPMonitor:
     """RTSP连接监控器"""
     
-    def __init__(self):
+    def __init__(self, camera_id=None):
+        self.camera_id = camera_id or config.DEFAULT_CAMERA
         self.connection_start_time = None
         self.frames_received = 0
+        self.frames_decoded = 0
         self.connection_errors = 0
         self.last_error_time = None
         self.last_frame_time = None
@@ -82,19 +84,29 @@ class RTSPMonitor:
     def on_connection_start(self):
         self.connection_start_time = time.time()
         self.frames_received = 0
+        self.frames_decoded = 0
         print(f"【MONITOR】连接开始: {time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     def on_frame_received(self):
         self.frames_received += 1
         self.last_frame_time = time.time()
+        metrics.CAPTURE_FRAMES.inc(camera=self.camera_id)
         
-        # 每30秒打印一次统计信息
+        # 每30帧更新一次帧率
         if self.frames_received % 30 == 0:
             uptime = time.time() - self.connection_start_time
             fps = self.frames_received / uptime if uptime > 0 else 0
+            metrics.CAPTURE_FPS.set(round(fps, 2), camera=self.camera_id)
+    
+    def on_frame_decoded(self, decode_seconds=None):
+        self.frames_decoded += 1
+        metrics.CAPTURE_DECODED.inc(camera=self.camera_id)
+        if decode_seconds is not None:
+            metrics.CAPTURE_DECODE_SECONDS.observe(decode_seconds, camera=self.camera_id)
     
     def on_error(self, error_msg):
         self.connection_errors += 1
+        metrics.CAPTURE_ERRORS.inc(camera=self.camera_id)
         self.last_error_time = time.time()
         print(f"【MONITOR】错误 #{self.connection_errors}: {error_msg}")
     
@@ -102,26 +114,97 @@ class RTSPMonitor:
         """获取统计信息"""
         return {
             "frames_received": self.frames_received,
+            "frames_decoded": self.frames_decoded,
             "connection_errors": self.connection_errors,
             "uptime": time.time() - self.connection_start_time if self.connection_start_time else 0,
             "last_error_time": self.last_error_time,
             "last_frame_time": self.last_frame_time
         }
-def capture_rtsp():
+class FrameSampler:
+    """按推流/推理的目标帧率决定哪些帧需要解码"""
+    
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        display_fps = config.camera_setting(camera_id, "display_fps", config.DISPLAY_FPS)
+        self.display_interval = 1.0 / display_fps if display_fps > 0 else None
+        self.next_display_time = 0.0
+        self.next_infer_time = 0.0
+    
+    def infer_interval(self):
+        from scheduler import scheduler
+        return scheduler.interval(self.camera_id)
+    
+    def due(self, now):
+        """当前帧是否需要解码"""
+        due = False
+        
+        if self.display_interval is not None and now >= self.next_display_time:
+            # 按固定节拍推进，落后超过一个周期时重新对齐
+            self.next_display_time += self.display_interval
+            if self.next_display_time < now:
+                self.next_display_time = now + self.display_interval
+            due = True
+        
+        if now >= self.next_infer_time:
+            self.next_infer_time = now + self.infer_interval()
+            due = True
+        
+        return due
+
+
+def infer_gate(camera_id):
+    """生成新帧回调：按自适应推理间隔节流后提交推理（推理在其他进程时发布到消息总线）"""
+    from roles import dispatch_frame, publish_video
+    from scheduler import scheduler
     last_infer_time_ref = [config.last_infer_time]
+    # API 不在本进程，或使用跨进程总线（可能有其他 API worker）时发布推流画面
+    relay_video = not config.has_role("api") or config.BUS_BACKEND != "inprocess"
+    
+    def on_frame(frame):
+        if relay_video:
+            publish_video(frame, camera_id)
+        scheduler.observe_frame(camera_id, frame)
+        current_time = time.time()
+        if current_time - last_infer_time_ref[0] < scheduler.interval(camera_id):
+            return
+        try:
+            # 推理会长时间持有帧，需要复制出独立数据
+            detached = frame.detach()
+        except ValueError as e:
+            metrics.FRAMES_DROPPED.inc(camera=camera_id, reason="stale")
+            log.info("跳过推理: %s", e, extra={"camera_id": camera_id})
+            return
+        dispatch_frame(detached, camera_id, last_infer_time_ref)
+    
+    return on_frame
+
+
+def capture_rtsp(camera_id=None, url=None, ring=None, on_frame=None):
+    """
+    摄像头采集循环（带自动重连）
+    camera_id: 摄像头ID，默认 config.DEFAULT_CAMERA
+    url: 视频源地址，默认取 config.CAMERAS 中的配置
+    ring: 帧写入的环形缓冲，默认 config.frame_buffers[camera_id]
+    on_frame: 新帧回调，默认按推理间隔提交推理
+    """
+    camera_id = camera_id or config.DEFAULT_CAMERA
+    url = url or config.CAMERAS[camera_id]["url"]
+    ring = ring if ring is not None else config.frame_buffers[camera_id]
+    on_frame = on_frame or infer_gate(camera_id)
+    sampler = FrameSampler(camera_id) if config.CAPTURE_MODE == "sample" else None
     frame_skip = 0
     reconnect_delay = 3
     max_reconnect_delay = 60
     
     # 创建监控器
-    monitor = RTSPMonitor()
+    monitor = RTSPMonitor(camera_id)
     
     while True:
         try:
-            print(f"【RTSP】连接摄像头... (第{monitor.connection_errors + 1}次尝试)")
+            print(f"【RTSP】{camera_id} 连接摄像头... (第{monitor.connection_errors + 1}次尝试)")
             
             # 创建连接
-            cap = create_rtsp_capture(config.RTSP_URL)
+            cap = create_rtsp_capture(url, config.camera_setting(camera_id, "ffmpeg_options"))
             
             if not cap.isOpened():
                 monitor.on_error("无法打开摄像头")
@@ -137,38 +220,58 @@ def capture_rtsp():
             last_frame_time = time.time()
             max_frame_interval = 5.0
             
+            # 本地视频文件作为替身流时，按文件帧率节流并循环播放
+            file_frame_time = None
+            if os.path.isfile(url):
+                file_fps = cap.get(cv2.CAP_PROP_FPS) or 15
+                file_frame_time = 1.0 / file_fps
+            
             while True:
                 # 检查连接健康状态
                 if time.time() - last_frame_time > max_frame_interval:
                     monitor.on_error("帧接收超时")
                     break
                 
-                # 尝试读取帧
-                ret, frame = cap.read()
+                # 尝试读取帧（抽样模式下先只取包，不解码）
+                decode_start = time.perf_counter()
+                if sampler is not None:
+                    ret = cap.grab()
+                else:
+                    ret, frame = cap.read()
+                decode_seconds = time.perf_counter() - decode_start
                 
                 if ret:
+                    if file_frame_time is not None:
+                        time.sleep(file_frame_time)
                     monitor.on_frame_received()
                     last_frame_time = time.time()
                     
                     # 处理帧...
-                    frame_skip = (frame_skip + 1) % 2
-                    if frame_skip == 0:
-                        continue
-                    
-                    resized_frame = cv2.resize(frame, (640, 360))
-                    
-                    # 写入缓冲区
-                    config.frame_buffer.write(resized_frame.copy())
-                    config.frame_buffer.swap()
-                    
-                    with config.latest_frame_lock:
-                        config.latest_frame = resized_frame.copy()
+                    if sampler is not None:
+                        # 只有推流或推理需要这一帧时才解码
+                        if not sampler.due(last_frame_time):
+                            metrics.FRAMES_DROPPED.inc(camera=camera_id, reason="not_due")
+                            continue
+                        decode_start = time.perf_counter()
+                        ret, frame = cap.retrieve()
+                        decode_seconds = time.perf_counter() - decode_start
+                        if not ret:
+                            metrics.FRAMES_DROPPED.inc(camera=camera_id, reason="decode_failed")
+                            continue
+                    else:
+                        frame_skip = (frame_skip + 1) % 2
+                        if frame_skip == 0:
+                            metrics.FRAMES_DROPPED.inc(camera=camera_id, reason="skip")
+                            continue
+                    monitor.on_frame_decoded(decode_seconds)
                     
-                    # 推理
-                    current_time = time.time()
-                    if current_time - last_infer_time_ref[0] >= config.INFER_INTERVAL:
-                        try_infer(resized_frame.copy(), last_infer_time_ref)
+                    # 只缩放一次，直接写入环形缓冲的预分配槽位，之后所有读者共享同一只读帧
+                    shared_frame = ring.write(frame, last_frame_time)
+                    on_frame(shared_frame)
                         
+                elif file_frame_time is not None:
+                    # 文件读完，从头循环
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
                 else:
                     # 短暂等待后重试
                     time.sleep(0.05)
@@ -184,7 +287,8 @@ def capture_rtsp():
             
             # 打印统计信息
             stats = monitor.get_stats()
-            print(f"【RTSP】连接断开，统计: 接收{stats['frames_received']}帧，错误{stats['connection_errors']}次")
+            print(f"【RTSP】连接断开，统计: 接收{stats['frames_received']}帧，"
+                  f"解码{stats['frames_decoded']}帧，错误{stats['connection_errors']}次")
             
             # 等待重连
             print(f"【RTSP】{reconnect_delay}秒后重新连接...")
@@ -0,0 +1,173 @@
+# decoder.py
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import config
+import metrics
+from frames import FrameRing
+from logs import get_logger
+
+log = get_logger("decoder")
+
+
+# 本进程启动的解码进程，关闭时统一释放共享内存
+_decoders = []
+
+
+def _attach(shm_name):
+    """
+    子进程附加到主进程创建的共享内存，不登记到资源跟踪器：
+    共享内存由主进程负责释放，子进程登记后退出时可能被跟踪器提前删除或报告泄漏
+    """
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=shm_name)
+    finally:
+        resource_tracker.register = register
+
+
+def _decode_main(camera_id, url, shm_name, slots, size, conn):
+    """解码子进程入口：解码后写入共享内存槽位，只把帧序号通知给主进程"""
+    from camera import capture_rtsp
+
+    shm = _attach(shm_name)
+    ring = FrameRing(slots, size, buffer=shm.buf)
+
+    def on_frame(frame):
+        try:
+            conn.send((frame.seq, frame.timestamp))
+        except (BrokenPipeError, OSError):
+            # 主进程已退出，子进程随之结束
+            os._exit(0)
+
+    capture_rtsp(camera_id, url=url, ring=ring, on_frame=on_frame)
+
+
+class DecoderProcess:
+    """
+    主进程侧的解码进程管理器
+
+    每路摄像头的 FFmpeg 解码在独立子进程中运行，不再与 FastAPI、推理线程争抢GIL；
+    帧数据写入共享内存中的环形缓冲，主进程只做映射，不复制。
+    子进程崩溃或卡死退出后自动重启。
+    """
+
+    def __init__(self, camera_id, url=None, on_frame=None):
+        self.camera_id = camera_id
+        self.url = url or config.CAMERAS[camera_id]["url"]
+        self.on_frame = on_frame
+        self.slots = config.FRAME_RING_SLOTS
+        self.size = config.capture_size(camera_id)
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=FrameRing.buffer_size(self.slots, self.size))
+        self.ring = FrameRing(self.slots, self.size, buffer=self.shm.buf)
+
+        self.process = None
+        self.restarts = 0
+        self._stopped = False
+
+    def start(self):
+        """启动解码子进程及主进程侧的接收线程"""
+        thread = threading.Thread(
+            target=self._supervise,
+            daemon=True,
+            name=f"Decoder-{self.camera_id}"
+        )
+        thread.start()
+        return thread
+
+    def _supervise(self):
+        ctx = multiprocessing.get_context("spawn")
+
+        while not self._stopped:
+            recv_conn, send_conn = ctx.Pipe(duplex=False)
+            self.process = ctx.Process(
+                target=_decode_main,
+                args=(self.camera_id, self.url, self.shm.name,
+                      self.slots, self.size, send_conn),
+                daemon=True,
+                name=f"decoder-{self.camera_id}"
+            )
+            self.process.start()
+            send_conn.close()
+            log.info("解码进程已启动", extra={"camera_id": self.camera_id, "pid": self.process.pid})
+
+            try:
+                while True:
+                    seq, timestamp = recv_conn.recv()
+                    frame = self.ring.commit(seq, timestamp)
+                    metrics.CAPTURE_DECODED.inc(camera=self.camera_id)
+                    if self.on_frame is None:
+                        continue
+                    try:
+                        self.on_frame(frame)
+                    except Exception as e:
+                        log.warning("帧回调异常: %s", e, extra={"camera_id": self.camera_id})
+            except EOFError:
+                pass
+            except Exception as e:
+                log.warning("接收帧异常: %s", e, extra={"camera_id": self.camera_id})
+            finally:
+                recv_conn.close()
+
+            self.process.join(timeout=1)
+            if self.process.is_alive():
+                self.process.terminate()
+            if self._stopped:
+                break
+
+            self.restarts += 1
+            metrics.CAPTURE_ERRORS.inc(camera=self.camera_id)
+            log.warning("解码进程退出，%s秒后重启", config.DECODER_RESTART_DELAY, extra={
+                "camera_id": self.camera_id, "exitcode": self.process.exitcode, "restarts": self.restarts})
+            time.sleep(config.DECODER_RESTART_DELAY)
+
+    def stop(self):
+        """停止解码进程并释放共享内存（可重复调用；已映射的读者在进程退出前仍可访问）"""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=3)
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def stop_all():
+    """停止本进程启动的全部解码进程（应用/角色关闭时调用）"""
+    while _decoders:
+        _decoders.pop().stop()
+
+
+def start_capture(camera_id):
+    """按配置启动一路摄像头的采集（线程内解码或子进程解码）"""
+    from camera import capture_rtsp, infer_gate
+
+    if config.DECODE_IN_SUBPROCESS:
+        decoder = DecoderProcess(camera_id, on_frame=infer_gate(camera_id))
+        # 读者改为映射共享内存中的环形缓冲
+        config.frame_buffers[camera_id] = decoder.ring
+        _decoders.append(decoder)
+        decoder.start()
+        return decoder
+
+    thread = threading.Thread(
+        target=capture_rtsp,
+        args=(camera_id,),
+        daemon=True,
+        name=f"RTSP-Capture-{camera_id}"
+    )
+    thread.start()
+    return thread
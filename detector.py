@@ -0,0 +1,215 @@
+# detector.py
+"""
+本地预检测（可选）
+
+在视觉大模型之前用小型 ONNX 检测模型（YOLOv5 / YOLOv8 导出的人员、烟火模型）在 CPU 上筛查送检帧：
+  - 人员框直接填入 has_person / person_count / person_positions；摄像头配置了禁区时按人员脚底点几何判定是否进入禁区
+  - 没有人员、烟火等相关目标时跳过视觉大模型，由规则直接给出结论；
+    每路摄像头至少每 DETECTOR_VLM_MAX_SKIP 秒仍调用一次视觉大模型，覆盖检测模型识别不了的风险
+需要安装 onnxruntime；未安装或模型文件不存在时预检测自动关闭，推理流程与未启用时相同。
+"""
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+import metrics
+from logs import get_logger
+
+log = get_logger("detector")
+
+RELEVANT_LABELS = ("person", "fire", "smoke")
+
+
+class Detection:
+    """一个检测框（坐标为相对画面宽高的比例 x0, y0, x1, y1）"""
+
+    __slots__ = ("label", "score", "box")
+
+    def __init__(self, label, score, box):
+        self.label = label
+        self.score = score
+        self.box = box
+
+    def to_dict(self):
+        return {"label": self.label, "score": round(self.score, 3), "box": [round(v, 4) for v in self.box]}
+
+
+def describe_position(box):
+    """人员框在画面中的大致位置，如 “画面左下”"""
+    x = (box[0] + box[2]) / 2.0
+    y = (box[1] + box[3]) / 2.0
+    horizontal = "左" if x < 1 / 3 else ("右" if x > 2 / 3 else "中")
+    vertical = "上" if y < 1 / 3 else ("下" if y > 2 / 3 else "中")
+    return "画面中央" if horizontal == vertical == "中" else f"画面{horizontal}{vertical}"
+
+
+class Detector:
+    """ONNX 检测模型（首次使用时加载，加载失败后不再重试）"""
+
+    def __init__(self):
+        self._session = None
+        self._input_name = None
+        self._failed = False
+        self._lock = threading.Lock()
+        self._last_vlm = {}  # camera_id -> 上次调用视觉大模型的时间
+
+    @property
+    def enabled(self):
+        return config.DETECTOR_ENABLED and not self._failed
+
+    def load(self):
+        """加载模型，失败时关闭预检测并返回 None"""
+        if self._session is not None or self._failed:
+            return self._session
+        with self._lock:
+            if self._session is not None or self._failed:
+                return self._session
+            try:
+                import onnxruntime
+                if not os.path.exists(config.DETECTOR_MODEL):
+                    raise FileNotFoundError(config.DETECTOR_MODEL)
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = config.DETECTOR_THREADS
+                session = onnxruntime.InferenceSession(
+                    config.DETECTOR_MODEL, options, providers=["CPUExecutionProvider"])
+            except Exception as e:
+                self._failed = True
+                log.error("本地预检测不可用，已关闭: %s", e)
+                return None
+            self._input_name = session.get_inputs()[0].name
+            self._session = session
+            log.info("本地预检测模型已加载: %s", config.DETECTOR_MODEL)
+        return self._session
+
+    def detect(self, frame):
+        """检测一帧，返回 Detection 列表；预检测不可用时返回 None"""
+        session = self.load() if self.enabled else None
+        if session is None:
+            return None
+        image = frame.image if hasattr(frame, "image") else frame
+        start = time.perf_counter()
+        try:
+            blob, scale = self._preprocess(image)
+            output = session.run(None, {self._input_name: blob})[0]
+            detections = self._postprocess(output, scale, image.shape[1], image.shape[0])
+        except Exception as e:
+            # 预检测失败时按未启用处理（调用视觉大模型）
+            log.warning("本地预检测失败: %s", e)
+            return None
+        metrics.DETECTOR_SECONDS.observe(time.perf_counter() - start)
+        return detections
+
+    def _preprocess(self, image):
+        # 等比缩放后在右侧/下方补边，保持目标形状
+        size = config.DETECTOR_INPUT_SIZE
+        height, width = image.shape[:2]
+        scale = size / float(max(width, height))
+        resized = cv2.resize(image, (int(round(width * scale)), int(round(height * scale))))
+        canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        blob = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB).transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+        return blob, scale
+
+    def _postprocess(self, output, scale, width, height):
+        output = np.squeeze(output, axis=0) if output.ndim == 3 else output
+        offset = 5 if config.DETECTOR_OUTPUT == "yolov5" else 4
+        if config.DETECTOR_OUTPUT != "yolov5" and output.shape[0] < output.shape[1]:
+            # YOLOv8 输出为 (4 + 类别数, 候选框数)
+            output = output.T
+        class_scores = output[:, offset:]
+        if offset == 5:
+            class_scores = class_scores * output[:, 4:5]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+
+        detections = []
+        for class_id, label in config.DETECTOR_LABELS.items():
+            keep = (class_ids == class_id) & (scores >= config.DETECTOR_CONFIDENCE)
+            if not keep.any():
+                continue
+            cx, cy, w, h = (output[keep, i] / scale for i in range(4))
+            boxes = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1)
+            label_scores = scores[keep]
+            indices = cv2.dnn.NMSBoxes(boxes.tolist(), label_scores.tolist(),
+                                       config.DETECTOR_CONFIDENCE, config.DETECTOR_IOU)
+            for i in np.asarray(indices).reshape(-1):
+                x, y, bw, bh = (float(v) for v in boxes[i])
+                box = (max(x / width, 0.0), max(y / height, 0.0),
+                       min((x + bw) / width, 1.0), min((y + bh) / height, 1.0))
+                detections.append(Detection(label, float(label_scores[i]), box))
+        return detections
+
+    def should_skip_vlm(self, camera_id, detections, now):
+        """
+        没有相关目标且距上次调用视觉大模型未超过 DETECTOR_VLM_MAX_SKIP 时跳过
+        now 取帧时间，离线回放时按模拟时间计算
+        """
+        if not config.DETECTOR_SKIP_VLM or "person" not in config.DETECTOR_LABELS.values():
+            # 模型不检测人员时无法判断画面是否为空
+            return False
+        if any(d.label in RELEVANT_LABELS for d in detections):
+            return False
+        return now - self._last_vlm.get(camera_id, float("-inf")) < config.DETECTOR_VLM_MAX_SKIP
+
+    def mark_vlm(self, camera_id, now):
+        self._last_vlm[camera_id] = now
+
+    @staticmethod
+    def prompt_hint(detections):
+        """附加在视觉提示词后的预检测结果"""
+        if not detections:
+            return ""
+        persons = [d for d in detections if d.label == "person"]
+        others = sorted({d.label for d in detections if d.label != "person"})
+        hint = f"\n本地检测模型已在画面中检测到 {len(persons)} 名人员"
+        if persons:
+            hint += "（" + "、".join(describe_position(d.box) for d in persons) + "）"
+        if others:
+            hint += "，以及疑似 " + "、".join(others)
+        return hint + "，请重点判断工牌佩戴、是否进入禁区及环境风险。\n"
+
+    @staticmethod
+    def empty_facts():
+        """跳过视觉大模型时的视觉事实：未检测到人员和烟火"""
+        return {
+            "has_person": False,
+            "badge_status": "不适用",
+            "enter_restricted_area": False,
+            "has_fire_or_smoke": False,
+            "has_electric_risk": False,
+            "scene_summary": "本地预检测未发现人员或烟火",
+            "object_details": {
+                "person_count": 0,
+                "person_positions": [],
+                "environment_status": "未检测到异常目标",
+            },
+            "source": "detector",
+        }
+
+    @staticmethod
+    def apply(facts, detections, camera_id):
+        """用检测结果填充人员相关的视觉事实；配置了禁区时按人员框几何判定是否进入禁区"""
+        import roi
+
+        facts["detections"] = [d.to_dict() for d in detections]
+        if "person" not in config.DETECTOR_LABELS.values():
+            return facts
+        persons = [d for d in detections if d.label == "person"]
+        details = facts.setdefault("object_details", {})
+        facts["has_person"] = bool(persons)
+        details["person_count"] = len(persons)
+        details["person_positions"] = [describe_position(d.box) for d in persons]
+        if any(region.restricted for region in roi.regions(camera_id)):
+            zones = roi.restricted_hits(camera_id, [d.box for d in persons])
+            facts["enter_restricted_area"] = bool(zones)
+            facts["restricted_zones"] = zones
+            facts["restricted_area_source"] = "detector"
+        return facts
+
+
+# 全局预检测实例
+detector = Detector()
@@ -0,0 +1,208 @@
+# event_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts          REAL    NOT NULL,
+    day         TEXT    NOT NULL,
+    camera_id   TEXT    NOT NULL,
+    alarm_level TEXT    NOT NULL,
+    is_alarm    INTEGER NOT NULL,
+    case_id     TEXT,
+    payload     TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS idx_events_camera_ts ON events (camera_id, ts);
+CREATE INDEX IF NOT EXISTS idx_events_level_ts ON events (alarm_level, ts);
+CREATE INDEX IF NOT EXISTS idx_events_alarm_ts ON events (is_alarm, ts);
+
+CREATE TABLE IF NOT EXISTS daily_counters (
+    day       TEXT    NOT NULL,
+    camera_id TEXT    NOT NULL,
+    total     INTEGER NOT NULL DEFAULT 0,
+    alarms    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, camera_id)
+);
+
+CREATE TABLE IF NOT EXISTS incidents (
+    incident_id TEXT    PRIMARY KEY,
+    camera_id   TEXT    NOT NULL,
+    category    TEXT    NOT NULL,
+    start_ts    REAL    NOT NULL,
+    end_ts      REAL,
+    peak_level  TEXT    NOT NULL,
+    alarm_count INTEGER NOT NULL,
+    payload     TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_incidents_start ON incidents (start_ts);
+CREATE INDEX IF NOT EXISTS idx_incidents_camera_start ON incidents (camera_id, start_ts);
+"""
+
+
+class EventStore:
+    """
+    识别结果/报警事件存储（SQLite WAL，只追加）
+
+    按时间、摄像头、报警等级、是否报警建立索引，支持分页和时间范围查询；
+    每日计数在写入事务内同步累加，统计接口无需扫描事件表。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.EVENT_DB_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self):
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, result: dict, ts: float = None) -> int:
+        """追加一条识别结果，返回事件ID"""
+        return self.append_many([result], [ts])[0]
+
+    def append_many(self, results, timestamps=None):
+        """批量追加识别结果（单个事务），返回事件ID列表"""
+        timestamps = timestamps or [None] * len(results)
+        conn = self._connect()
+        ids = []
+        with self._write_lock, conn:
+            for result, ts in zip(results, timestamps):
+                ts = ts if ts is not None else time.time()
+                day = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+                camera_id = result.get("camera_id") or config.DEFAULT_CAMERA
+                is_alarm = 1 if result.get("is_alarm") == "是" else 0
+                cursor = conn.execute(
+                    "INSERT INTO events (ts, day, camera_id, alarm_level, is_alarm, case_id, payload) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (ts, day, camera_id, result.get("alarm_level", "无"), is_alarm,
+                     result.get("case_id"), json.dumps(result, ensure_ascii=False))
+                )
+                conn.execute(
+                    "INSERT INTO daily_counters (day, camera_id, total, alarms) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT(day, camera_id) DO UPDATE SET "
+                    "total = total + 1, alarms = alarms + excluded.alarms",
+                    (day, camera_id, is_alarm)
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def upsert_incidents(self, incidents):
+        """批量写入/更新报警事件聚合记录（单个事务）"""
+        conn = self._connect()
+        with self._write_lock, conn:
+            for incident in incidents:
+                conn.execute(
+                    "INSERT INTO incidents (incident_id, camera_id, category, start_ts, end_ts, "
+                    "peak_level, alarm_count, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(incident_id) DO UPDATE SET end_ts = excluded.end_ts, "
+                    "peak_level = excluded.peak_level, alarm_count = excluded.alarm_count, "
+                    "payload = excluded.payload",
+                    (incident["incident_id"], incident["camera_id"], incident["category"],
+                     incident["start_ts"], incident.get("end_ts"), incident["peak_level"],
+                     incident["alarm_count"], json.dumps(incident, ensure_ascii=False))
+                )
+
+    def query_incidents(self, limit=50, offset=0, start=None, end=None, camera_id=None):
+        """查询报警事件聚合记录（按开始时间倒序）"""
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("start_ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("start_ts < ?")
+            params.append(end)
+        if camera_id:
+            clauses.append("camera_id = ?")
+            params.append(camera_id)
+
+        sql = "SELECT payload FROM incidents"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY start_ts DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        return [json.loads(row["payload"]) for row in self._connect().execute(sql, params)]
+
+    def query(self, limit=50, offset=0, start=None, end=None, camera_id=None,
+              level=None, alarms_only=False, before_id=None):
+        """
+        查询历史事件（按时间倒序）
+        start/end: 时间范围（Unix时间戳，秒）
+        before_id: 游标分页，只返回ID小于该值的事件（比offset更适合深分页）
+        """
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if camera_id:
+            clauses.append("camera_id = ?")
+            params.append(camera_id)
+        if level:
+            clauses.append("alarm_level = ?")
+            params.append(level)
+        if alarms_only:
+            clauses.append("is_alarm = 1")
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+
+        sql = "SELECT id, ts, payload FROM events"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        events = []
+        for row in self._connect().execute(sql, params):
+            event = json.loads(row["payload"])
+            event["id"] = row["id"]
+            event["ts"] = row["ts"]
+            events.append(event)
+        return events
+
+    def daily_counts(self, day=None, camera_id=None):
+        """某天的识别/报警次数（默认今天）"""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        sql = "SELECT COALESCE(SUM(total), 0), COALESCE(SUM(alarms), 0) FROM daily_counters WHERE day = ?"
+        params = [day]
+        if camera_id:
+            sql += " AND camera_id = ?"
+            params.append(camera_id)
+        total, alarms = self._connect().execute(sql, params).fetchone()
+        return {"day": day, "total": total, "alarms": alarms}
+
+    def daily_history(self, days=30, camera_id=None):
+        """最近若干天的每日计数（按日期倒序）"""
+        sql = "SELECT day, SUM(total) AS total, SUM(alarms) AS alarms FROM daily_counters"
+        params = []
+        if camera_id:
+            sql += " WHERE camera_id = ?"
+            params.append(camera_id)
+        sql += " GROUP BY day ORDER BY day DESC LIMIT ?"
+        params.append(days)
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+
+# 全局事件存储实例
+event_store = EventStore()
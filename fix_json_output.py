@@ -4,6 +4,11 @@ import re
 import math
 from datetime import datetime
 
+import metrics
+from logs import get_logger
+
+log = get_logger("json_fixer")
+
 
 class JSONFixer:
 
@@ -138,10 +143,11 @@ class JSONFixer:
         # 先尝试直接解析（可能包含metadata）
         try:
             result = json.loads(t)
-            print("【JSONFixer】直接解析成功")
+            log.debug("直接解析成功")
+            metrics.JSON_PARSE.inc(path="direct")
             return result
         except json.JSONDecodeError as e1:
-            print(f"【JSONFixer】直接解析失败: {e1}")
+            log.debug("直接解析失败: %s", e1)
             
             # 尝试修复常见问题
             try:
@@ -175,7 +181,8 @@ class JSONFixer:
                 t = re.sub(r'("confidence"\s*:\s*)([0-9\.\+\-\*\/\(\)\s=]+)', fix_math, t)
                 
                 result = json.loads(t)
-                print("【JSONFixer】修复后解析成功")
+                log.debug("修复后解析成功")
+                metrics.JSON_PARSE.inc(path="repaired")
                 
                 # 确保metadata存在
                 if "metadata" not in result:
@@ -184,18 +191,20 @@ class JSONFixer:
                 return result
                 
             except json.JSONDecodeError as e2:
-                print(f"【JSONFixer】修复后解析也失败: {e2}")
+                log.warning("修复后解析也失败: %s", e2)
                 
                 # 尝试提取并合并重复的metadata
                 try:
                     result = JSONFixer._handle_duplicate_metadata(t)
                     if result:
-                        print("【JSONFixer】通过处理重复metadata成功")
+                        log.debug("通过处理重复metadata成功")
+                        metrics.JSON_PARSE.inc(path="duplicate_metadata")
                         return result
                 except Exception as e3:
-                    print(f"【JSONFixer】处理重复metadata失败: {e3}")
+                    log.warning("处理重复metadata失败: %s", e3)
                 
                 # 返回默认结构
+                metrics.JSON_PARSE.inc(path="default")
                 return JSONFixer._get_default_structure(f"JSON解析失败: {str(e2)}")
     @staticmethod
     def _handle_duplicate_metadata(text: str):
@@ -208,7 +217,7 @@ class JSONFixer:
         matches = re.findall(metadata_pattern, text, re.DOTALL)
         
         if matches:
-            print(f"【JSONFixer】找到{len(matches)}个metadata字段")
+            log.debug("找到%s个metadata字段", len(matches))
             
             # 使用最后一个metadata
             last_metadata_str = matches[-1]
@@ -247,7 +256,7 @@ class JSONFixer:
                     return result
                     
                 except Exception as e:
-                    print(f"【JSONFixer】处理metadata失败: {e}")
+                    log.warning("处理metadata失败: %s", e)
         
         return None
     
@@ -257,7 +266,7 @@ class JSONFixer:
         if "metadata" in result:
             return result
         
-        print("【JSONFixer】警告：解析后metadata字段不存在，尝试从原始文本恢复")
+        log.warning("解析后metadata字段不存在，尝试从原始文本恢复")
         
         # 尝试从原始文本提取metadata
         try:
@@ -273,7 +282,7 @@ class JSONFixer:
                 try:
                     metadata = json.loads(metadata_str)
                     result["metadata"] = metadata
-                    print("【JSONFixer】从原始文本恢复metadata成功")
+                    log.debug("从原始文本恢复metadata成功")
                 except:
                     # 如果解析失败，尝试清理后解析
                     metadata_str = metadata_str.replace('"model": "deepseek-r1:7b",', '"model": "deepseek-r1:7b",')
@@ -281,16 +290,16 @@ class JSONFixer:
                     try:
                         metadata = json.loads(metadata_str)
                         result["metadata"] = metadata
-                        print("【JSONFixer】清理后恢复metadata成功")
+                        log.debug("清理后恢复metadata成功")
                     except:
-                        print("【JSONFixer】恢复metadata失败，使用默认值")
+                        log.warning("恢复metadata失败，使用默认值")
                         result["metadata"] = JSONFixer._get_default_metadata()
             else:
-                print("【JSONFixer】未找到metadata字段，使用默认值")
+                log.debug("未找到metadata字段，使用默认值")
                 result["metadata"] = JSONFixer._get_default_metadata()
                 
         except Exception as e:
-            print(f"【JSONFixer】确保metadata时出错: {e}")
+            log.warning("确保metadata时出错: %s", e)
             result["metadata"] = JSONFixer._get_default_metadata()
         
         return result
@@ -0,0 +1,271 @@
+# frames.py
+import base64
+import threading
+import time
+
+import cv2
+import numpy as np
+
+_IMAGE_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def encode_image(image, size, quality, fmt="jpeg"):
+    """缩放到指定尺寸并编码为 JPEG / WebP 字节"""
+    if (image.shape[1], image.shape[0]) != tuple(size):
+        image = cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+    ext, flag = _IMAGE_FORMATS[fmt]
+    ok, buf = cv2.imencode(ext, image, [flag, quality])
+    if not ok:
+        raise ValueError(f"{fmt}编码失败")
+    return buf.tobytes()
+
+
+class Frame:
+    """
+    一帧画面及其派生数据（只读共享）
+
+    原始图像在构造时被标记为只读，所有消费者共享同一份数组；
+    推流JPEG、模型JPEG、Base64等派生数据按需计算并缓存，每帧最多编码一次。
+    """
+
+    __slots__ = ("image", "timestamp", "seq", "ring", "_cache", "_lock")
+
+    def __init__(self, image, timestamp=None, seq=0, ring=None):
+        image.setflags(write=False)
+        self.image = image
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.seq = seq
+        self.ring = ring  # 所属环形缓冲（为None表示帧独立持有数据）
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_capture(cls, raw, timestamp=None, seq=0):
+        """由摄像头原始帧构造，只做一次缩放"""
+        from config import FRAME_SIZE
+        width, height = FRAME_SIZE
+        if raw.shape[1] != width or raw.shape[0] != height:
+            raw = cv2.resize(raw, (width, height))
+        return cls(raw, timestamp, seq)
+
+    @classmethod
+    def from_jpeg(cls, data, timestamp=None, seq=0):
+        """由JPEG字节构造（经消息总线收到的帧），尺寸与模型输入相同时原JPEG直接作为模型输入，不再重新编码"""
+        from config import FRAME_SIZE
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("JPEG解码失败")
+        frame = cls(image, timestamp, seq)
+        if (image.shape[1], image.shape[0]) == tuple(FRAME_SIZE):
+            frame._cache["model_jpeg"] = data
+        return frame
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def valid(self):
+        """帧数据是否仍然有效（环形缓冲中的槽位可能已被覆盖）"""
+        return self.ring is None or self.ring.holds(self)
+
+    def detach(self):
+        """复制出一份独立持有数据的帧，供需要长时间持有的消费者（如推理）使用"""
+        if self.ring is None:
+            return self
+        frame = Frame(self.image.copy(), self.timestamp, self.seq)
+        frame._cache.update(self._cache)
+        if not self.valid:
+            raise ValueError(f"帧 #{self.seq} 已被覆盖，无法复制")
+        return frame
+
+    def _memo(self, key, compute):
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                value = compute()
+                self._cache[key] = value
+        return value
+
+    def encoded(self, size, quality, fmt="jpeg"):
+        """指定尺寸、质量、格式的编码字节（每种规格每帧只编码一次，所有客户端共享）"""
+        return self._memo(("encoded", tuple(size), quality, fmt),
+                          lambda: encode_image(self.image, size, quality, fmt))
+
+    def stream_jpeg(self):
+        """推流尺寸的JPEG字节"""
+        import config
+        return self.encoded(config.STREAM_SIZE, config.STREAM_JPEG_QUALITY)
+
+    def model_jpeg(self):
+        """模型输入尺寸的JPEG字节"""
+        import config
+        return self._memo("model_jpeg", lambda: encode_image(
+            self.image, config.FRAME_SIZE, config.MODEL_JPEG_QUALITY))
+
+    def motion_thumb(self):
+        """用于运动检测的低分辨率灰度图"""
+        def compute():
+            gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+            return cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA)
+        return self._memo("motion_thumb", compute)
+
+    def model_base64(self):
+        """模型输入JPEG的Base64字符串"""
+        return self._memo("model_base64", lambda: base64.b64encode(
+            self.model_jpeg()).decode())
+
+
+class FrameRing:
+    """
+    最新帧环形缓冲（单写者、多读者）
+
+    槽位在创建时一次性分配，写入时直接缩放/复制进下一个槽位，
+    读者拿到的是槽位的只读视图，不做任何复制。每个槽位记录当前帧序号，
+    视图在环形缓冲绕回一圈之前有效；需要长时间持有的读者应调用 Frame.detach()。
+    """
+
+    def __init__(self, slots=None, size=None, buffer=None):
+        import config
+        self.slot_count = slots or config.FRAME_RING_SLOTS
+        width, height = size or config.FRAME_SIZE
+        self.shape = (height, width, 3)
+        slots_shape = (self.slot_count,) + self.shape
+        if buffer is None:
+            self._slot_seq = np.zeros(self.slot_count, dtype=np.int64)
+            self._slots = np.zeros(slots_shape, dtype=np.uint8)
+        else:
+            # 映射外部内存（如共享内存），布局：槽位序号表 + 槽位数据
+            self._slot_seq = np.ndarray((self.slot_count,), dtype=np.int64, buffer=buffer)
+            self._slots = np.ndarray(slots_shape, dtype=np.uint8, buffer=buffer,
+                                     offset=self._slot_seq.nbytes)
+        # 接续已有数据的序号（解码进程重启后序号不回退）
+        self._seq = int(np.abs(self._slot_seq).max())
+        self._latest = None
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def buffer_size(slots, size):
+        """映射外部内存时所需的字节数"""
+        width, height = size
+        return slots * 8 + slots * height * width * 3
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def holds(self, frame):
+        """槽位中是否仍是该帧的数据"""
+        return self._slot_seq[frame.seq % self.slot_count] == frame.seq
+
+    def write(self, raw, timestamp=None):
+        """写入一帧（缩放直接输出到预分配槽位），返回共享的只读帧"""
+        seq = self.seq + 1
+        index = seq % self.slot_count
+        slot = self._slots[index]
+
+        # 写入期间将槽位标记为无效，持有旧视图的读者可以据此发现数据已被覆盖
+        self._slot_seq[index] = -seq
+        if raw.shape == self.shape:
+            np.copyto(slot, raw)
+        else:
+            cv2.resize(raw, (self.shape[1], self.shape[0]), dst=slot)
+
+        self._slot_seq[index] = seq
+        return self.commit(seq, timestamp)
+
+    def commit(self, seq, timestamp=None):
+        """发布已写入槽位的帧（外部写者写入共享内存后由读者进程调用）"""
+        frame = Frame(self._slots[seq % self.slot_count].view(), timestamp, seq, ring=self)
+        self._latest = frame
+        self._seq = seq
+        with self._cond:
+            self._cond.notify_all()
+        return frame
+
+    def read(self):
+        """读取最新帧（无锁、无复制），尚无帧时返回None"""
+        return self._latest
+
+    def wait_next(self, after_seq, timeout=None):
+        """等待序号大于after_seq的帧，超时返回None"""
+        latest = self._latest
+        if latest is not None and latest.seq > after_seq:
+            return latest
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+            return self._latest
+
+
+class EncodedFrame:
+    """
+    只有推流JPEG的帧（由其他进程采集、经消息总线收到），供推流读者使用
+
+    其他尺寸/格式由推流JPEG解码后转码，同样每种规格只转码一次
+    """
+
+    __slots__ = ("jpeg", "timestamp", "seq", "_cache", "_lock")
+
+    valid = True
+
+    def __init__(self, jpeg, timestamp, seq):
+        self.jpeg = jpeg
+        self.timestamp = timestamp
+        self.seq = seq
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def stream_jpeg(self):
+        return self.jpeg
+
+    def encoded(self, size, quality, fmt="jpeg"):
+        import config
+        if fmt == "jpeg" and tuple(size) == tuple(config.STREAM_SIZE):
+            return self.jpeg
+        key = (tuple(size), quality, fmt)
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                image = self._cache.get("image")
+                if image is None:
+                    image = self._cache["image"] = cv2.imdecode(
+                        np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                value = self._cache[key] = encode_image(image, size, quality, fmt)
+        return value
+
+
+class LatestFrameBuffer:
+    """只保存最新一帧的缓冲，读者接口与 FrameRing 相同（read / wait_next）"""
+
+    def __init__(self):
+        self._latest = None
+        self._cond = threading.Condition()
+
+    @property
+    def seq(self):
+        return self._latest.seq if self._latest is not None else 0
+
+    def put(self, frame):
+        with self._cond:
+            self._latest = frame
+            self._cond.notify_all()
+
+    def read(self):
+        return self._latest
+
+    def wait_next(self, after_seq, timeout=None):
+        """等待序号大于after_seq的帧，超时返回None"""
+        latest = self._latest
+        if latest is not None and latest.seq > after_seq:
+            return latest
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+            return self._latest
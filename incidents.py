@@ -0,0 +1,216 @@
+# incidents.py
+import threading
+import time
+from datetime import datetime
+
+import config
+from logs import get_logger
+
+log = get_logger("incident")
+
+# 报警等级由低到高
+LEVEL_ORDER = ["无", "一般", "严重", "紧急"]
+# 等级在消息主题、文件名等场合使用的英文名
+LEVEL_KEYS = {"无": "none", "一般": "normal", "严重": "severe", "紧急": "critical"}
+
+# 按优先级从高到低判断事件类别（同一画面有多种风险时取最严重的一种，保持类别稳定）
+_CATEGORY_RULES = [
+    ("fire", lambda facts: facts.get("has_fire_or_smoke")),
+    ("electric", lambda facts: facts.get("has_electric_risk")),
+    ("restricted_area", lambda facts: facts.get("enter_restricted_area")),
+    ("no_badge", lambda facts: facts.get("badge_status") == "未佩戴"),
+]
+
+
+def level_rank(level):
+    return LEVEL_ORDER.index(level) if level in LEVEL_ORDER else 0
+
+
+def incident_category(vision_facts):
+    """由视觉事实得到报警类别；无法归类时为 other（类别会写进事件编号和图片文件名，报警原因只记在 reason 中）"""
+    for name, matches in _CATEGORY_RULES:
+        if matches(vision_facts or {}):
+            return name
+    return "other"
+
+
+class Incident:
+    """一次持续的报警事件（同一摄像头、同一类别的连续报警）"""
+
+    def __init__(self, camera_id, category, level, reason, now):
+        self.incident_id = f"{datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S')}_{camera_id}_{category}"
+        self.camera_id = camera_id
+        self.category = category
+        self.start_ts = now
+        self.last_seen = now
+        self.end_ts = None
+        self.level = level          # 当前等级（含按持续时间自动升级）
+        self.peak_level = level     # 模型给出的最高等级与当前等级中的较高者
+        self.level_since = now
+        self.reason = reason
+        self.alarm_count = 1
+        self.case_ids = []
+        self.frames = []            # 代表帧图片路径（开始、每次升级、结束）
+        self.last_frame = None
+
+    def add_frame(self, path):
+        if path and len(self.frames) < config.INCIDENT_MAX_FRAMES:
+            self.frames.append(path)
+
+    def to_dict(self):
+        return {
+            "incident_id": self.incident_id,
+            "camera_id": self.camera_id,
+            "category": self.category,
+            "start_ts": self.start_ts,
+            "end_ts": self.end_ts,
+            "start_time": datetime.fromtimestamp(self.start_ts).strftime("%Y-%m-%d %H:%M:%S"),
+            "end_time": datetime.fromtimestamp(self.end_ts).strftime("%Y-%m-%d %H:%M:%S") if self.end_ts else None,
+            "duration": round((self.end_ts or self.last_seen) - self.start_ts, 1),
+            "level": self.level,
+            "peak_level": self.peak_level,
+            "reason": self.reason,
+            "alarm_count": self.alarm_count,
+            "case_ids": list(self.case_ids),
+            "frames": list(self.frames),
+            "state": "closed" if self.end_ts else "active",
+        }
+
+
+class IncidentTracker:
+    """
+    报警事件聚合器
+
+    同一摄像头、同一类别的连续报警合并为一个事件，只在状态变化时通知下游：
+    开始（opened）、升级（escalated）、结束（closed）。事件持续期间的重复报警不再保存图片、
+    写知识库案例、播放声音和广播。升级条件：模型给出更高等级，或在当前等级持续超过
+    INCIDENT_ESCALATE_AFTER 设定的时长；超过 INCIDENT_CLOSE_SECONDS 未再报警则事件结束。
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.active = {}  # (camera_id, category) -> Incident
+        self.stats = {"opened": 0, "escalated": 0, "closed": 0, "suppressed": 0}
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def observe(self, camera_id, category, level, reason):
+        """
+        记录一次报警，返回 (状态变化, 事件)
+        状态变化为 "opened" / "escalated"，重复报警被抑制时为 None
+        """
+        self.close_expired()
+        now = self.clock()
+        with self._lock:
+            key = (camera_id, category)
+            incident = self.active.get(key)
+            if incident is None:
+                incident = Incident(camera_id, category, level, reason, now)
+                self.active[key] = incident
+                self.stats["opened"] += 1
+                return "opened", incident
+
+            incident.last_seen = now
+            incident.alarm_count += 1
+            if level_rank(level) > level_rank(incident.level):
+                self._escalate(incident, level, reason, now)
+                return "escalated", incident
+
+            next_level = self._time_escalation(incident, now)
+            if next_level:
+                self._escalate(incident, next_level, reason, now)
+                return "escalated", incident
+
+            self.stats["suppressed"] += 1
+            return None, incident
+
+    def _time_escalation(self, incident, now):
+        """在当前等级持续过久时返回应升级到的等级"""
+        limit = config.INCIDENT_ESCALATE_AFTER.get(incident.level)
+        rank = level_rank(incident.level)
+        if limit is None or rank + 1 >= len(LEVEL_ORDER):
+            return None
+        if now - incident.level_since >= limit:
+            return LEVEL_ORDER[rank + 1]
+        return None
+
+    def _escalate(self, incident, level, reason, now):
+        incident.level = level
+        incident.level_since = now
+        incident.reason = reason
+        if level_rank(level) > level_rank(incident.peak_level):
+            incident.peak_level = level
+        self.stats["escalated"] += 1
+
+    def close_expired(self):
+        """结束超时未再报警的事件，并通知下游"""
+        now = self.clock()
+        closed = []
+        with self._lock:
+            for key, incident in list(self.active.items()):
+                if now - incident.last_seen >= config.INCIDENT_CLOSE_SECONDS:
+                    incident.end_ts = incident.last_seen
+                    del self.active[key]
+                    self.stats["closed"] += 1
+                    closed.append(incident)
+
+        for incident in closed:
+            self._emit_closed(incident)
+        return closed
+
+    def _emit_closed(self, incident):
+        import bus
+        from model_infer import save_alarm_image
+        from persistence import writer
+
+        # 结束时保存最后一帧作为代表帧
+        if incident.last_frame is not None:
+            incident.add_frame(save_alarm_image(
+                incident.last_frame, incident.peak_level, f"{incident.incident_id}_end"))
+            incident.last_frame = None
+
+        record = incident.to_dict()
+        writer.record_incident(record)
+        bus.publish(bus.broadcast_topic(incident.camera_id, incident.peak_level), {
+            "camera_id": incident.camera_id,
+            "vision_analysis": f"报警事件已结束，持续 {record['duration']} 秒，共 {incident.alarm_count} 次报警",
+            "is_alarm": "否",
+            "alarm_level": incident.peak_level,
+            "alarm_reason": incident.reason,
+            "incident_id": incident.incident_id,
+            "incident_state": "closed",
+            "incident": record,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        log.info("事件结束: %s", incident.incident_id, extra={
+            "camera_id": incident.camera_id, "peak_level": incident.peak_level,
+            "alarm_count": incident.alarm_count, "duration": record["duration"]})
+
+    def start_sweeper(self, interval=1.0):
+        """启动后台线程定期结束超时事件（摄像头不再推理时也能及时结束）"""
+        def _run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.close_expired()
+                except Exception as e:
+                    log.error("结束超时事件失败: %s", e)
+
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=_run, daemon=True, name="Incident-Sweeper")
+            self._sweeper.start()
+        return self._sweeper
+
+    def get_active(self):
+        with self._lock:
+            return [incident.to_dict() for incident in self.active.values()]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["active"] = len(self.active)
+        return stats
+
+
+# 全局事件聚合器实例
+incident_tracker = IncidentTracker()
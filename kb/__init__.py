@@ -65,6 +65,11 @@ class KnowledgeBase:
         
         return formatted_results
         
+    def case_store(self):
+        """报警案例归档库"""
+        from .case_store import get_case_store
+        return get_case_store()
+    
     def update_index(self):
         """更新知识库索引"""
         from .indexing import build_index
@@ -76,6 +81,7 @@ class KnowledgeBase:
         stats = {
             "total_cases": len([f for f in os.listdir(self.cases_dir) if f.endswith('.json')]) if os.path.exists(self.cases_dir) else 0,
             "total_documents": len([f for f in os.listdir(self.source_dir) if f.endswith('.md')]) if os.path.exists(self.source_dir) else 0,
+            "archived_cases": self.case_store().count(),
             "index_exists": os.path.exists(os.path.join(self.index_dir, "faiss_bge.index")) if os.path.exists(self.index_dir) else False,
             "last_update": None,
             "status": "ready"
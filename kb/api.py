@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
 from typing import List, Dict, Any
 from datetime import datetime
 import os
@@ -50,6 +51,20 @@ async def review_case(case_id: str, review_result: str):
     
     return {"status": "success", "case_id": case_id}
 
+@router.get("/cases")
+async def list_archived_cases(limit: int = 50, offset: int = 0):
+    """列出归档的报警案例（按时间倒序）"""
+    store = kb.case_store()
+    return {"total": store.count(), "cases": store.list_cases(limit, offset)}
+
+@router.get("/cases/{case_id}/markdown", response_class=PlainTextResponse)
+async def export_case_markdown(case_id: str):
+    """按需导出单个案例的Markdown正文"""
+    case = kb.case_store().get(case_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail="Case not found")
+    return case["markdown"]
+
 @router.post("/rebuild-index")
 async def rebuild_index():
     """重建知识库索引"""
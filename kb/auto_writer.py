@@ -3,18 +3,20 @@ import hashlib
 from datetime import datetime
 import json
 import threading
-KB_SOURCE_DIR = "kb/source"
+from logs import get_logger, payloads_enabled
+
 KB_INDEX_DIR = "kb/index"
+log = get_logger("kb")
 
 def write_alarm_case_to_kb(case: dict):
-    """将报警案例写入知识库（Markdown格式）"""
-    os.makedirs(KB_SOURCE_DIR, exist_ok=True)
+    """将报警案例写入知识库（Markdown格式，存入案例归档库）"""
     os.makedirs(KB_INDEX_DIR, exist_ok=True)
 
-    # 调试：打印case的所有键
-    print(f"【DEBUG】case字典的键: {list(case.keys())}")
-    if 'metadata' in case:
-        print(f"【DEBUG】metadata内容: {json.dumps(case['metadata'], ensure_ascii=False)}")
+    # 调试：输出case的所有键（默认关闭）
+    if payloads_enabled(log):
+        log.debug("case字典的键: %s", list(case.keys()))
+        if 'metadata' in case:
+            log.debug("metadata内容: %s", json.dumps(case['metadata'], ensure_ascii=False))
     
     # 提取关键信息 - 修复字段提取路径
     alarm_level = case.get('alarm_level', '一般')
@@ -37,10 +39,6 @@ def write_alarm_case_to_kb(case: dict):
     kb_history = metadata.get('kb_history_cases', metadata.get('kb_cases_used', 0))
     model_used = metadata.get('model', '未知')
     kb_cases_used = metadata.get('kb_cases_used', 0)
-    print(f"【AUTO_WRITER】知识库使用详情:")
-    print(f"  总参考文档: {kb_total}")
-    print(f"  规则文件: {kb_rules}")
-    print(f"  历史案例: {kb_history}")
 
     # 方法2：如果metadata中没有，尝试从case的其他位置获取
     if model_used == '未知':
@@ -59,19 +57,6 @@ def write_alarm_case_to_kb(case: dict):
     risk_assessment = analysis.get('risk_assessment', case.get('risk_assessment', '无'))
     recommendation = analysis.get('recommendation', case.get('recommendation', '无'))
     
-    # 生成文件名（使用case_id确保唯一）
-    filename = f"case_{case_id}.md"
-    path = os.path.join(KB_SOURCE_DIR, filename)
-    
-    # 检查文件是否已存在（防止重复写入）
-    if os.path.exists(path):
-        # 如果文件已存在，添加计数器后缀
-        counter = 1
-        while os.path.exists(path):
-            filename = f"case_{case_id}_v{counter}.md"
-            path = os.path.join(KB_SOURCE_DIR, filename)
-            counter += 1
-
     kb_reference_text = ""
     if kb_total > 0:
         if kb_history > 0 and kb_rules > 0:
@@ -134,15 +119,22 @@ def write_alarm_case_to_kb(case: dict):
 *案例ID: {case_id}
 *生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 """
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
-    print(f"【知识库】案例已保存：{path}")
-    print(f"【知识库】模型: {model_used}, 参考案例数: {kb_cases_used}")
+    # 存入案例归档库（case_id 重复时自动追加 _v 后缀）
+    from kb.case_store import get_case_store
+    store = get_case_store()
+    case_id = store.put(case_id, content, case, alarm_level)
+    source = store.source_name(case_id)
+    log.info("案例已保存: %s", source, extra={
+        "model": model_used, "kb_total_references": kb_total,
+        "kb_rule_files": kb_rules, "kb_history_cases": kb_history})
     trigger_index_update()
-    return path
+    return source
 
 def trigger_index_update():
     """触发知识库索引更新（异步）"""
+    import config
+    if not config.KB_AUTO_REINDEX:
+        return
     def _update_index():
         try:
             # 延迟5秒，避免频繁重建
@@ -153,18 +145,20 @@ def trigger_index_update():
             try:
                 from kb.indexing import build_index
                 
-                print("【知识库】开始重建索引...")
+                log.info("开始重建索引")
                 
                 # 重建索引
-                result = build_index(
-                    data_dir='kb/source',
-                    index_path='kb/index/faiss_bge.index',
-                    meta_path='kb/index/docs_bge.pkl',
-                    model_name='BAAI/bge-small-zh-v1.5'
-                )
+                import metrics
+                with metrics.KB_INDEX_REBUILD_SECONDS.time():
+                    result = build_index(
+                        data_dir='kb/source',
+                        index_path='kb/index/faiss_bge.index',
+                        meta_path='kb/index/docs_bge.pkl',
+                        model_name='BAAI/bge-small-zh-v1.5'
+                    )
                 
                 if result['status'] == 'success':
-                    print(f"✅ 索引重建成功！文档块数量: {result['chunks_count']}")
+                    log.info("索引重建成功，文档块数量: %s", result['chunks_count'])
                     
                     # 🔥 关键修改：延迟刷新缓存，避免影响正在进行的查询
                     time.sleep(2)  # 等待2秒，让当前查询完成
@@ -173,18 +167,18 @@ def trigger_index_update():
                     try:
                         from kb.retriever import refresh_cache
                         refresh_cache()
-                        print("✅ 检索器缓存已刷新，新索引立即生效")
+                        log.info("检索器缓存已刷新，新索引立即生效")
                     except ImportError as e:
-                        print(f"⚠️ 无法刷新缓存: {e}")
+                        log.warning("无法刷新缓存: %s", e)
                         
                 else:
-                    print(f"❌ 索引重建失败: {result.get('message', '未知错误')}")
+                    log.error("索引重建失败: %s", result.get('message', '未知错误'))
                     
             except ImportError as e:
-                print(f"【WARN】无法导入索引模块: {e}")
+                log.warning("无法导入索引模块: %s", e)
                 
         except Exception as e:
-            print(f"【ERROR】索引更新线程异常: {e}")
+            log.exception("索引更新线程异常: %s", e)
         
     # 启动异步线程更新索引
     threading.Thread(target=_update_index, daemon=True).start()
\ No newline at end of file
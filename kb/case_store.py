@@ -0,0 +1,174 @@
+# case_store.py
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+KB_CASE_DB = "kb/archive/cases.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_id     TEXT    NOT NULL UNIQUE,
+    created_at  TEXT    NOT NULL,
+    alarm_level TEXT,
+    markdown    TEXT    NOT NULL,
+    data        TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cases_created ON cases (created_at);
+"""
+
+
+class CaseStore:
+    """
+    报警案例归档（SQLite，按 case_id 建唯一索引）
+
+    替代每个报警一个 case_<id>.md 文件的做法：案例正文和原始数据存放在单个数据库中，
+    索引构建时按写入顺序流式读取；需要时再按需导出为 Markdown。
+    """
+
+    def __init__(self, path=KB_CASE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self):
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def source_name(case_id):
+        """案例在检索结果中的来源名（保持 case_ 前缀，检索端据此区分历史案例和规则文件）"""
+        return f"case_{case_id}.md"
+
+    def put(self, case_id, markdown, data=None, alarm_level=None):
+        """保存案例，case_id 已存在时自动追加 _v 后缀，返回最终的 case_id"""
+        conn = self._connect()
+        payload = json.dumps(data, ensure_ascii=False, default=str) if data is not None else None
+        with self._write_lock:
+            final_id = case_id
+            counter = 1
+            while True:
+                try:
+                    with conn:
+                        conn.execute(
+                            "INSERT INTO cases (case_id, created_at, alarm_level, markdown, data) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (final_id, datetime.now().isoformat(), alarm_level, markdown, payload)
+                        )
+                    return final_id
+                except sqlite3.IntegrityError:
+                    final_id = f"{case_id}_v{counter}"
+                    counter += 1
+
+    def get(self, case_id):
+        """按 case_id 读取案例，不存在返回None"""
+        row = self._connect().execute(
+            "SELECT case_id, created_at, alarm_level, markdown, data FROM cases WHERE case_id = ?",
+            (case_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        case = dict(row)
+        case["data"] = json.loads(case["data"]) if case["data"] else None
+        return case
+
+    def list_cases(self, limit=50, offset=0):
+        """按时间倒序列出案例摘要"""
+        rows = self._connect().execute(
+            "SELECT case_id, created_at, alarm_level FROM cases ORDER BY seq DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        )
+        return [dict(row) for row in rows]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    def iter_documents(self, batch_size=500):
+        """按写入顺序流式读取 (来源名, Markdown正文)，供索引构建使用"""
+        conn = self._connect()
+        last_seq = 0
+        while True:
+            rows = conn.execute(
+                "SELECT seq, case_id, markdown FROM cases WHERE seq > ? ORDER BY seq LIMIT ?",
+                (last_seq, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self.source_name(row["case_id"]), row["markdown"]
+            last_seq = rows[-1]["seq"]
+
+    def export_markdown(self, out_dir, case_ids=None):
+        """把案例导出为 case_<id>.md 文件，返回导出的文件数"""
+        os.makedirs(out_dir, exist_ok=True)
+        conn = self._connect()
+        if case_ids is None:
+            rows = conn.execute("SELECT case_id, markdown FROM cases ORDER BY seq")
+        else:
+            placeholders = ",".join("?" * len(case_ids))
+            rows = conn.execute(
+                f"SELECT case_id, markdown FROM cases WHERE case_id IN ({placeholders})",
+                list(case_ids)
+            )
+        count = 0
+        for row in rows:
+            path = os.path.join(out_dir, self.source_name(row["case_id"]))
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(row["markdown"])
+            count += 1
+        return count
+
+    def migrate_markdown(self, source_dir="kb/source", archive_dir="kb/archive/markdown"):
+        """把旧版 kb/source/case_*.md 导入归档库，原文件移到 archive_dir，返回导入数量"""
+        os.makedirs(archive_dir, exist_ok=True)
+        count = 0
+        for filename in sorted(os.listdir(source_dir)):
+            if not (filename.startswith("case_") and filename.endswith(".md")):
+                continue
+            path = os.path.join(source_dir, filename)
+            with open(path, "r", encoding="utf-8") as f:
+                markdown = f.read()
+            self.put(filename[len("case_"):-len(".md")], markdown)
+            shutil.move(path, os.path.join(archive_dir, filename))
+            count += 1
+        return count
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_case_store():
+    """获取全局案例归档实例（首次使用时创建）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CaseStore()
+    return _store
+
+
+if __name__ == "__main__":
+    # 用法: python -m kb.case_store migrate | export <目录> | stats
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    store = get_case_store()
+    if command == "migrate":
+        print(f"已导入 {store.migrate_markdown()} 个旧版案例文件")
+    elif command == "export":
+        out_dir = sys.argv[2] if len(sys.argv) > 2 else "kb/export"
+        print(f"已导出 {store.export_markdown(out_dir)} 个案例到 {out_dir}")
+    else:
+        print(f"案例总数: {store.count()}")
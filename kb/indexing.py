@@ -3,9 +3,7 @@ import glob
 import pickle
 import re
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import faiss
 
 def smart_chunk_text(text, source_file, max_chars=400):
     """智能分块文本，保持语义完整性"""
@@ -103,74 +101,56 @@ def smart_chunk_text(text, source_file, max_chars=400):
     
     return chunks
 
+def iter_source_documents(data_dir='kb/source', include_cases=True):
+    """依次产出 (来源名, 正文, 是否历史案例)：目录下的 Markdown 文件 + 案例归档库"""
+    for filepath in sorted(glob.glob(os.path.join(data_dir, '*.md'))):
+        filename = Path(filepath).name
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                yield filename, f.read(), filename.startswith('case_')
+        except Exception as e:
+            print(f"  处理文件 {filename} 失败: {e}")
+    
+    if not include_cases:
+        return
+    
+    from kb.case_store import get_case_store
+    for source, markdown in get_case_store().iter_documents():
+        yield source, markdown, True
+
 def build_index(data_dir='kb/source', 
                 index_path='kb/index/faiss_bge.index',
                 meta_path='kb/index/docs_bge.pkl',
-                model_name='BAAI/bge-small-zh-v1.5'):
-    """构建知识库索引"""
+                model_name='BAAI/bge-small-zh-v1.5',
+                include_cases=True):
+    """构建知识库索引（include_cases=False 时只索引 data_dir 下的文件）"""
+    
+    # 重量级依赖在需要时才导入（只做分块时不需要）
+    import faiss
+    from .retriever import load_model
     
     print("🔨 开始构建知识库索引...")
     
     # 确保目录存在
     os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
     
-    # 加载模型
+    # 加载模型（与检索共用已预热的模型实例）
     print(f"📥 加载模型: {model_name}")
-    model = SentenceTransformer(model_name)
+    model = load_model(model_name)
     dim = model.get_sentence_embedding_dimension()
     print(f"   模型维度: {dim}")
     
-    # 查找所有Markdown文件
-    files = glob.glob(os.path.join(data_dir, '*.md'))
-    
-    if not files:
-        print("⚠️  没有找到知识库文件")
-        return {'status': 'error', 'message': 'No source files found'}
-    
-    print(f"📚 找到 {len(files)} 个知识库文件")
-    
-    # 分块处理
-    all_chunks = []
-    
-    for filepath in files:
-        filename = Path(filepath).name
-        
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            if not content.strip():
-                continue
-            
-            # 智能分块
-            chunks = smart_chunk_text(content, filename, max_chars=500)
-            
-            print(f"  {filename}: {len(chunks)} 个块")
-            
-            all_chunks.extend(chunks)
-            
-        except Exception as e:
-            print(f"  处理文件 {filename} 失败: {e}")
-    
-    if not all_chunks:
-        print("❌ 没有生成有效的文档块")
-        return {'status': 'error', 'message': 'No chunks generated'}
-    
-    print(f"📊 总共生成 {len(all_chunks)} 个文档块")
-    
-    # 准备文本用于编码
-    texts = [chunk['text'] for chunk in all_chunks]
-    
     # 创建内积索引（余弦相似度）
     index = faiss.IndexFlatIP(dim)
     
-    # 分批处理向量化
+    # 流式分块并分批向量化：规则文件 + 案例归档库
+    all_chunks = []
+    pending_texts = []
     batch_size = 32
-    print("⚡ 生成向量嵌入...")
+    file_count = 0
+    case_count = 0
     
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i+batch_size]
-        
+    def encode_batch(batch_texts):
         # 编码并归一化
         embeddings = model.encode(
             batch_texts,
@@ -178,12 +158,42 @@ def build_index(data_dir='kb/source',
             normalize_embeddings=True,  # 关键：归一化向量
             show_progress_bar=False
         ).astype('float32')
-        
         index.add(embeddings)
+    
+    print("⚡ 分块并生成向量嵌入...")
+    for filename, content, is_case in iter_source_documents(data_dir, include_cases):
+        if not content.strip():
+            continue
+        
+        # 智能分块
+        chunks = smart_chunk_text(content, filename, max_chars=500)
+        
+        if is_case:
+            case_count += 1
+        else:
+            file_count += 1
+            print(f"  {filename}: {len(chunks)} 个块")
+        
+        all_chunks.extend(chunks)
+        pending_texts.extend(chunk['text'] for chunk in chunks)
         
-        progress = min(i + batch_size, len(texts)) / len(texts) * 100
-        print(f"  进度: {progress:.1f}%", end='\r')
+        while len(pending_texts) >= batch_size:
+            encode_batch(pending_texts[:batch_size])
+            pending_texts = pending_texts[batch_size:]
+            print(f"  已向量化: {index.ntotal} 个块", end='\r')
     
+    if not all_chunks:
+        print("❌ 没有生成有效的文档块")
+        if file_count == 0 and case_count == 0:
+            print("⚠️  没有找到知识库文件")
+            return {'status': 'error', 'message': 'No source files found'}
+        return {'status': 'error', 'message': 'No chunks generated'}
+    
+    if pending_texts:
+        encode_batch(pending_texts)
+    
+    print(f"\n📚 规则文件 {file_count} 个，历史案例 {case_count} 个")
+    print(f"📊 总共生成 {len(all_chunks)} 个文档块")
     print(f"\n✅ 向量嵌入完成")
     
     # 保存索引
@@ -2,93 +2,98 @@
 import os
 import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
 import threading
 import time
 
+from logs import get_logger
+
+log = get_logger("kb")
+
 # 全局缓存
 _cached_model = None
 _cached_index = None
 _cached_meta = None
 
-# 使用RLock（可重入锁）避免死锁
-_cache_lock = threading.RLock()
-_loading_in_progress = False  # 标记是否正在加载
+# 模型与索引分别加锁，启动时可并行预热；sentence_transformers / faiss 在首次加载时才导入
+_model_lock = threading.Lock()
+_index_lock = threading.Lock()
 
-def load_index(index_path='kb/index/faiss_bge.index', 
-               meta_path='kb/index/docs_bge.pkl', 
-               model_name='BAAI/bge-small-zh-v1.5'):
-    """加载索引、元数据和模型（线程安全）"""
-    global _cached_model, _cached_index, _cached_meta, _loading_in_progress
+# BGE模型建议的查询格式
+QUERY_INSTRUCTION = "为这个句子生成表示以用于检索相关文章："
+
+def _create_model(model_name):
+    import config
+    from sentence_transformers import SentenceTransformer
+    
+    if config.EMBEDDING_MODEL_OFFLINE:
+        # 优先使用本地缓存的模型快照，避免启动时访问 Hugging Face 检查更新
+        try:
+            return SentenceTransformer(model_name, local_files_only=True)
+        except Exception as e:
+            log.warning("本地缓存中没有向量模型，联网下载: %s", e)
+    return SentenceTransformer(model_name)
+
+def load_model(model_name='BAAI/bge-small-zh-v1.5'):
+    """加载向量模型（线程安全，只加载一次）"""
+    global _cached_model
+    
+    with _model_lock:
+        if _cached_model is None:
+            start = time.time()
+            _cached_model = _create_model(model_name)
+            log.info("向量模型加载完成: %s", model_name, extra={"seconds": round(time.time() - start, 1)})
+        return _cached_model
+
+def load_faiss_index(index_path='kb/index/faiss_bge.index', 
+                     meta_path='kb/index/docs_bge.pkl'):
+    """加载FAISS索引和元数据（线程安全）"""
+    global _cached_index, _cached_meta
     
-    with _cache_lock:
-        # 双重检查锁定模式
-        if _cached_index is not None and _cached_meta is not None and _cached_model is not None:
-            return _cached_index, _cached_meta, _cached_model
+    with _index_lock:
+        if _cached_index is not None and _cached_meta is not None:
+            return _cached_index, _cached_meta
         
-        if _loading_in_progress:
-            # 如果正在加载，等待
-            while _loading_in_progress:
-                time.sleep(0.1)
-            return _cached_index, _cached_meta, _cached_model
+        if not os.path.exists(index_path) or not os.path.exists(meta_path):
+            raise FileNotFoundError('Index or metadata not found. Run indexing first.')
         
-        _loading_in_progress = True
+        import faiss
         
-        try:
-            if not os.path.exists(index_path) or not os.path.exists(meta_path):
-                raise FileNotFoundError('Index or metadata not found. Run indexing first.')
-            
-            print("【检索器】开始加载索引和模型...")
-            
-            # 1. 加载模型（最耗时）
-            print("  - 加载BGE模型...")
-            start = time.time()
-            _cached_model = SentenceTransformer(model_name)
-            print(f"    ✅ 模型加载完成，耗时: {time.time()-start:.1f}秒")
-            
-            # 2. 加载索引
-            print("  - 加载FAISS索引...")
-            start = time.time()
-            _cached_index = faiss.read_index(index_path)
-            print(f"    ✅ 索引加载完成，耗时: {time.time()-start:.1f}秒")
-            print(f"      索引大小: {_cached_index.ntotal}")
-            
-            # 3. 加载元数据
-            print("  - 加载元数据...")
-            start = time.time()
-            with open(meta_path, 'rb') as f:
-                _cached_meta = pickle.load(f)
-            print(f"    ✅ 元数据加载完成，耗时: {time.time()-start:.1f}秒")
-            print(f"      元数据数量: {len(_cached_meta)}")
-            
-            print("✅ 所有资源加载完成")
-            return _cached_index, _cached_meta, _cached_model
-            
-        finally:
-            _loading_in_progress = False
+        start = time.time()
+        index = faiss.read_index(index_path)
+        with open(meta_path, 'rb') as f:
+            meta = pickle.load(f)
+        log.info("知识库索引加载完成", extra={
+            "vectors": index.ntotal, "documents": len(meta), "seconds": round(time.time() - start, 1)})
+        
+        _cached_index, _cached_meta = index, meta
+        return _cached_index, _cached_meta
+
+def load_index(index_path='kb/index/faiss_bge.index', 
+               meta_path='kb/index/docs_bge.pkl', 
+               model_name='BAAI/bge-small-zh-v1.5'):
+    """加载索引、元数据和模型（线程安全）"""
+    index, meta = load_faiss_index(index_path, meta_path)
+    model = load_model(model_name)
+    return index, meta, model
+
+def warmup():
+    """预热向量模型：加载并编码一次查询（首次编码有额外的初始化开销）"""
+    model = load_model()
+    model.encode([QUERY_INSTRUCTION + "预热"], convert_to_numpy=True, normalize_embeddings=True)
+    return model
 
 def query(query_text: str, top_k=5, similarity_threshold=0.3):
     """查询相似文档（线程安全）"""
     try:
-        with _cache_lock:
-            # 确保索引已加载
-            if _cached_index is None or _cached_meta is None or _cached_model is None:
-                load_index()
-            
-            # 复制引用到局部变量，避免在锁释放后被修改
-            index = _cached_index
-            meta = _cached_meta
-            model = _cached_model
+        # 确保索引已加载（返回局部引用，刷新缓存不影响本次查询）
+        index, meta, model = load_index()
         
         # 检查复制后的引用是否有效
         if index is None or meta is None or model is None:
-            print("【检索器】索引未加载，返回空结果")
+            log.warning("知识库索引未加载，返回空结果")
             return []
         
-        # BGE模型建议的查询格式
-        instruction = "为这个句子生成表示以用于检索相关文章："
-        query_with_instruction = instruction + query_text
+        query_with_instruction = QUERY_INSTRUCTION + query_text
         
         # 计算查询向量
         q_emb = model.encode([query_with_instruction], 
@@ -114,19 +119,18 @@ def query(query_text: str, top_k=5, similarity_threshold=0.3):
                     'distance': float(distance)
                 })
         
-        print(f"【检索器】查询 '{query_text[:30]}...' 返回 {len(results)} 个结果")
+        log.debug("知识库查询返回 %d 个结果", len(results), extra={"query": query_text[:30]})
         return results
         
     except Exception as e:
-        print(f"【检索器】查询过程中出错: {e}")
+        log.warning("知识库查询出错: %s", e)
         # 返回空结果而不是抛出异常
         return []
 
 def refresh_cache():
-    """刷新缓存，强制重新加载索引"""
-    global _cached_model, _cached_index, _cached_meta
-    with _cache_lock:
-        _cached_model = None
+    """刷新缓存，强制重新加载索引（向量模型不变，保留已加载的实例）"""
+    global _cached_index, _cached_meta
+    with _index_lock:
         _cached_index = None
         _cached_meta = None
-    print("【检索器】缓存已刷新")
\ No newline at end of file
+    log.info("检索器缓存已刷新")
\ No newline at end of file
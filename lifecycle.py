@@ -0,0 +1,164 @@
+# lifecycle.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from logs import get_logger
+
+log = get_logger("startup")
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class Component:
+    """一个需要预热的组件"""
+
+    def __init__(self, name, warmup, required=True):
+        self.name = name
+        self.warmup = warmup
+        self.required = required
+        self.state = PENDING
+        self.seconds = None
+        self.error = None
+        self.detail = {}
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "required": self.required,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "error": self.error,
+            **self.detail,
+        }
+
+
+class Lifecycle:
+    """
+    启动生命周期
+
+    服务启动时不再同步加载重量级资源：各组件在后台线程池中并行预热，
+    就绪接口报告每个组件的状态。必需组件全部就绪后服务才算就绪；
+    可选组件（如知识库）失败时服务降级运行。
+    """
+
+    def __init__(self):
+        self.components = {}
+        self.started_at = None
+        self._lock = threading.Lock()
+
+    def register(self, name, warmup, required=True):
+        self.components[name] = Component(name, warmup, required)
+
+    def start(self):
+        """在后台并行预热所有组件，立即返回"""
+        self.started_at = time.time()
+        executor = ThreadPoolExecutor(max_workers=config.STARTUP_WORKERS, thread_name_prefix="Warmup")
+        for component in self.components.values():
+            executor.submit(self._run, component)
+        executor.shutdown(wait=False)
+
+    def _run(self, component):
+        with self._lock:
+            component.state = LOADING
+        start = time.time()
+        try:
+            detail = component.warmup()
+            with self._lock:
+                component.detail = detail or {}
+                component.state = READY
+            log.info("组件就绪: %s", component.name, extra={"seconds": round(time.time() - start, 3)})
+        except Exception as e:
+            with self._lock:
+                component.error = str(e)[:200]
+                component.state = FAILED
+            level = log.error if component.required else log.warning
+            level("组件预热失败: %s: %s", component.name, e)
+        finally:
+            component.seconds = time.time() - start
+
+    def is_ready(self):
+        with self._lock:
+            return all(c.state == READY for c in self.components.values() if c.required)
+
+    def status(self):
+        with self._lock:
+            components = {name: c.to_dict() for name, c in self.components.items()}
+            states = [c.state for c in self.components.values()]
+            required = [c.state for c in self.components.values() if c.required]
+
+        if FAILED in required:
+            overall = "failed"
+        elif any(state != READY for state in required):
+            overall = "starting"
+        elif FAILED in states:
+            overall = "degraded"
+        else:
+            overall = "ready"
+
+        return {
+            "status": overall,
+            "ready": overall in ("ready", "degraded"),
+            "uptime": round(time.time() - self.started_at, 1) if self.started_at else 0.0,
+            "components": components,
+        }
+
+
+# ---------- 默认组件 ----------
+
+def _warm_pipeline():
+    """导入推理链路模块（ollama 客户端、推理模型、知识库等），首次推理不再付导入开销"""
+    import psutil  # noqa: F401  系统状态接口使用
+    import model_infer  # noqa: F401
+    return {}
+
+
+def _warm_embedding_model():
+    from kb.retriever import warmup
+    model = warmup()
+    return {"dimension": model.get_sentence_embedding_dimension()}
+
+
+def _warm_kb_index():
+    from kb.retriever import load_faiss_index
+    index, meta = load_faiss_index()
+    return {"index_size": index.ntotal, "meta_count": len(meta)}
+
+
+def _warm_ollama(model_name):
+    def warmup():
+        import ollama
+        # 空提示的请求会让 Ollama 把模型加载进显存/内存，首个报警无需等待模型冷启动
+        ollama.generate(model=model_name, prompt="", keep_alive=config.model_config.KEEP_ALIVE)
+        return {"model": model_name}
+    return warmup
+
+
+def _warm_reasoning_model():
+    from reasoning_model import reasoning_model
+    return reasoning_model.warm_prefix()
+
+
+def _warm_detector():
+    from detector import detector
+    if detector.load() is None:
+        raise RuntimeError("本地预检测模型加载失败")
+    return {"model": config.DETECTOR_MODEL}
+
+
+def register_defaults():
+    from config import model_config
+    lifecycle.register("pipeline", _warm_pipeline)
+    lifecycle.register("vision_model", _warm_ollama(model_config.VISION_MODEL))
+    lifecycle.register("reasoning_model", _warm_reasoning_model)
+    lifecycle.register("embedding_model", _warm_embedding_model, required=False)
+    lifecycle.register("kb_index", _warm_kb_index, required=False)
+    if config.DETECTOR_ENABLED:
+        lifecycle.register("detector", _warm_detector, required=False)
+
+
+# 全局生命周期实例
+lifecycle = Lifecycle()
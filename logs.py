@@ -0,0 +1,155 @@
+# logs.py
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+import config
+
+# LogRecord 自带的属性，其余属性视为结构化字段（通过 extra= 传入）；rate_limit 只用于控制限流，不输出
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "rate_limit"}
+
+_ROOT = "app"
+_setup_lock = threading.Lock()
+_listener = None
+
+
+def _short_name(record):
+    return record.name[len(_ROOT) + 1:] if record.name.startswith(_ROOT + ".") else record.name
+
+
+def _extra_fields(record):
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": _short_name(record),
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """与原 print 输出相近的文本格式：时间 【模块】级别 消息 key=value"""
+
+    def format(self, record):
+        line = (f"{self.formatTime(record, '%H:%M:%S')} 【{_short_name(record).upper()}】"
+                f"{record.levelname} {record.getMessage()}")
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按调用位置限流：每个窗口内同一行代码最多输出 burst 条，
+    超出的被丢弃，窗口结束后的下一条日志带上 suppressed 字段说明丢弃了多少条
+    WARNING 及以上级别、以及通过 extra={"rate_limit": False} 声明的日志（如每次的报警决策）不限流
+    """
+
+    def __init__(self, burst=None, window=None):
+        super().__init__()
+        self.burst = burst or config.LOG_RATE_LIMIT
+        self.window = window or config.LOG_RATE_WINDOW
+        self._buckets = {}  # (文件, 行号) -> [窗口开始时间, 已输出条数, 已丢弃条数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, "rate_limit", True) is False:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                suppressed = bucket[2] if bucket else 0
+                self._buckets[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if bucket[1] < self.burst:
+                bucket[1] += 1
+                return True
+            bucket[2] += 1
+            return False
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时直接丢弃，调用线程从不阻塞"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # 只在调用线程合并参数（避免对象之后被修改），异常堆栈留给后台线程格式化
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+def setup():
+    """配置日志：调用线程只做过滤和入队，格式化与输出在后台线程完成"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        formatter = JsonFormatter() if config.LOG_FORMAT == "json" else TextFormatter()
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if config.LOG_FILE:
+            handlers.append(logging.handlers.WatchedFileHandler(config.LOG_FILE, encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        queue_handler = _DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger(_ROOT)
+        root.setLevel(config.LOG_LEVEL)
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    """获取模块日志器，如 get_logger("infer")"""
+    setup()
+    return logging.getLogger(f"{_ROOT}.{name}")
+
+
+def payloads_enabled(logger):
+    """是否输出大段调试内容（模型原始输出、完整视觉事实等），默认关闭"""
+    return config.LOG_DEBUG_PAYLOADS and logger.isEnabledFor(logging.DEBUG)
+
+
+def dropped_count():
+    """因日志队列满而丢弃的条数"""
+    return _DroppingQueueHandler.dropped
@@ -1,33 +1,25 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 import asyncio
 import json
-import threading
 import time
-from datetime import datetime
 
 # 正确导入 config 模块中的变量
 import config
 
-# 从 config 中导入需要的变量
-from config import (
-    broadcast_queue, 
-    recognition_results,
-    RTSP_URL, 
-    INFER_INTERVAL,
-    latest_frame,
-    latest_frame_lock,
-    inference_lock,
-    last_infer_time,
-    sound_lock
-)
-
-from camera import capture_rtsp
+from bus import get_bus
+import metrics
+import tracing
+from lifecycle import lifecycle
+from logs import get_logger
+from ws_manager import ConnectionManager
 from stream import generate_frames
 
+log = get_logger("ws")
+
 # 尝试导入知识库API，如果失败则提供替代方案
 try:
     from kb.api import router as kb_router
@@ -48,51 +40,41 @@ except ImportError as e:
 app = FastAPI(title="智能安防视频分析系统")
 
 # ===================== WebSocket 管理 =====================
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"【WS】客户端连接，当前连接数: {len(self.active_connections)}")
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        print(f"【WS】客户端断开，剩余连接数: {len(self.active_connections)}")
-
-    async def broadcast(self, message: dict):
-        disconnected = []
-        for ws in list(self.active_connections):
-            try:
-                await ws.send_text(json.dumps(message, ensure_ascii=False))
-            except Exception as e:
-                print(f"【WS】发送失败: {e}")
-                disconnected.append(ws)
-        
-        for ws in disconnected:
-            self.disconnect(ws)
-
 manager = ConnectionManager()
 
 # ===================== WebSocket路由 =====================
 @app.websocket("/ws")
 async def ws_endpoint(websocket: WebSocket):
-    print("【WS】收到连接请求")
-    await manager.connect(websocket)
+    """
+    订阅参数（查询参数或运行时发送的 JSON 消息）：
+      topics=cam01,*.critical  cameras=cam01,cam02  min_level=severe  alarms_only=1
+      mode=immediate|batch  batch_ms=500
+      video=cam01  video_view=full|grid  video_size=auto|<档位>  video_fps=10  video_format=jpeg|webp
+    画面以二进制消息在同一连接上推送，JSON 消息 {"video": [...]} 可同时订阅多路（缩略图宫格），见 ws_video.py
+    """
+    log.debug("收到连接请求")
+    await manager.connect(websocket, dict(websocket.query_params))
     try:
         while True:
-            # 接收消息（可以是心跳或其他数据）
+            # 接收消息（心跳，或 JSON 格式的订阅修改）
             data = await websocket.receive_text()
-            print(f"【WS】收到消息: {data}")
+            log.debug("收到消息: %s", data)
             if data == "ping":
                 await websocket.send_text("pong")
+            elif data.startswith("{"):
+                try:
+                    options = json.loads(data)
+                except ValueError:
+                    continue
+                subscriber = manager.configure(websocket, options)
+                if subscriber is not None:
+                    await websocket.send_text(json.dumps(
+                        {"type": "subscribed", **subscriber.to_dict()}, ensure_ascii=False))
     except WebSocketDisconnect:
-        print("【WS】客户端断开连接")
+        log.debug("客户端断开连接")
         manager.disconnect(websocket)
     except Exception as e:
-        print(f"【WS】连接异常: {e}")
+        log.warning("连接异常: %s", e)
         manager.disconnect(websocket)
 
 # ===================== Web路由 =====================
@@ -105,25 +87,86 @@ async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.get("/video_feed")
-async def video_feed():
+async def video_feed(camera: str = None, size: str = None, fps: float = None):
+    """MJPEG 推流；size 为档位名时固定档位，省略或为 auto 时按本连接的发送吞吐自动选择"""
+    if camera is not None and camera not in config.frame_buffers:
+        raise HTTPException(status_code=404, detail=f"Unknown camera: {camera}")
+    if size not in (None, "auto") and size not in config.STREAM_LADDER:
+        raise HTTPException(status_code=400, detail=f"Unknown size: {size}")
     return StreamingResponse(
-        generate_frames(),
+        generate_frames(camera, size, fps),
         media_type="multipart/x-mixed-replace; boundary=frame"
     )
 
 # ===================== API 端点 =====================
+@app.get("/api/cameras")
+async def get_cameras():
+    """摄像头列表与可订阅的画面档位"""
+    return {
+        "cameras": list(config.CAMERAS),
+        "default": config.DEFAULT_CAMERA,
+        "video_levels": {name: list(size) for name, (size, _) in config.STREAM_LADDER.items()},
+        "video_formats": list(config.STREAM_FORMATS),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 指标"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/api/alarms/history")
-async def get_alarm_history(limit: int = 50):
-    """获取历史报警记录"""
-    from config import recognition_results
-    return recognition_results[-limit:]
+async def get_alarm_history(limit: int = 50, offset: int = 0,
+                            start: float = None, end: float = None,
+                            camera: str = None, level: str = None,
+                            alarms_only: bool = False, before_id: int = None):
+    """
+    获取历史报警记录（按时间正序返回当前页）
+    start/end: Unix时间戳范围；before_id: 游标分页，取上一页最小的 id
+    """
+    from event_store import event_store
+    events = event_store.query(
+        limit=max(1, min(limit, 1000)), offset=max(0, offset), start=start, end=end,
+        camera_id=camera, level=level, alarms_only=alarms_only, before_id=before_id
+    )
+    events.reverse()
+    return events
+
+@app.get("/api/alarms/daily")
+async def get_alarm_daily(days: int = 30, camera: str = None):
+    """获取每日识别/报警计数"""
+    from event_store import event_store
+    return event_store.daily_history(days=days, camera_id=camera)
+
+@app.get("/api/incidents")
+async def get_incidents(limit: int = 50, offset: int = 0,
+                        start: float = None, end: float = None, camera: str = None):
+    """获取报警事件聚合记录（按开始时间倒序）"""
+    from event_store import event_store
+    return event_store.query_incidents(
+        limit=max(1, min(limit, 1000)), offset=max(0, offset), start=start, end=end, camera_id=camera
+    )
+
+@app.get("/api/incidents/active")
+async def get_active_incidents():
+    """获取进行中的报警事件"""
+    from incidents import incident_tracker
+    return incident_tracker.get_active()
+
+@app.get("/api/system/ready")
+async def get_system_ready():
+    """就绪检查：必需组件全部预热完成时返回 200，否则 503，并列出各组件状态"""
+    status = lifecycle.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 @app.get("/api/system/status")
 async def get_system_status():
     """获取系统状态"""
     import psutil
-    import time
     from kb import kb
+    from scheduler import scheduler
+    from event_store import event_store
+    from persistence import writer
+    from incidents import incident_tracker
     
     status = {
         "system": {
@@ -133,8 +176,11 @@ async def get_system_status():
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         },
         "knowledge_base": kb.get_statistics(),
-        "alarms_today": len([r for r in recognition_results 
-                           if r.get("is_alarm") == "是"])
+        "inference": scheduler.get_stats(),
+        "persistence": writer.get_stats(),
+        "incidents": incident_tracker.get_stats(),
+        "startup": lifecycle.status(),
+        "alarms_today": event_store.daily_counts()["alarms"]
     }
     return status
 
@@ -153,24 +199,27 @@ async def get_model_info():
     return info
 
 # ===================== 广播工作者 =====================
-async def broadcast_worker():
-    """WebSocket广播任务"""
-    print("【WS】广播工作者已启动")
+async def broadcast_worker(subscription):
+    """WebSocket广播任务：订阅消息总线上的广播主题（推理可以在其他进程）"""
+    log.info("广播工作者已启动")
+    loop = asyncio.get_running_loop()
     while True:
         try:
-            # 从队列获取结果（阻塞，最多1秒）
-            result = broadcast_queue.get(timeout=1)
-            print(f"【WS】准备广播: {result.get('alarm_level', '无')}报警")
+            # 在线程池中等待消息（最多1秒），不阻塞事件循环
+            message = await loop.run_in_executor(None, subscription.get, 1.0)
+            if message is None:
+                continue
+            topic, result, _ = message
             
-            # 广播给所有连接的客户端
-            await manager.broadcast(result)
-            
-            # 标记任务完成
-            broadcast_queue.task_done()
-            print(f"【WS】广播完成")
+            # 广播给订阅了该主题的客户端
+            start = time.time()
+            await manager.broadcast(result, topic)
+            tracing.record_span("ws.broadcast", result.get("trace_id"), start, time.time(),
+                                clients=len(manager.active_connections))
+            log.debug("广播完成", extra={"alarm_level": result.get("alarm_level", "无")})
             
         except Exception as e:
-            # 队列为空时正常等待
+            log.warning("广播失败: %s", e)
             await asyncio.sleep(0.1)
 
 # ===================== 系统启动 =====================
@@ -188,21 +237,24 @@ async def startup():
     
     print("="*50)
     
-    # 启动摄像头捕获线程
-    camera_thread = threading.Thread(
-        target=capture_rtsp, 
-        daemon=True,
-        name="RTSP-Capture-Thread"
-    )
-    camera_thread.start()
-    print("【INFO】摄像头线程已启动")
+    # 先订阅广播主题，再启动本进程的其他角色，避免错过最早的消息
+    asyncio.create_task(broadcast_worker(get_bus().subscribe("broadcast.")))
     
-    # 启动 WebSocket 广播任务
-    asyncio.create_task(broadcast_worker())
+    # 按 APP_ROLES 启动本进程的采集/推理角色（推理角色在后台并行预热模型与知识库）
+    # 多个 worker 时只有一个运行采集/推理，其余只负责推送
+    from roles import start_roles
+    start_roles(elect=True)
     
-    # 等待摄像头初始化
-    await asyncio.sleep(2)
-    print("【INFO】系统启动完成")
+    print("【INFO】系统启动完成（组件预热状态见 /api/system/ready）")
+
+@app.on_event("shutdown")
+async def shutdown():
+    """系统关闭事件：停止本进程的采集角色，等待后台写入完成"""
+    from persistence import writer
+    from roles import stop_roles
+    stop_roles()
+    if not writer.flush(timeout=5):
+        print("【WARN】仍有未写完的持久化任务")
 
 # ===================== 注册知识库API路由 =====================
 # 注意：这部分放在最后，避免影响其他路由
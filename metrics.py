@@ -0,0 +1,212 @@
+# metrics.py
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认耗时分桶（秒），覆盖从毫秒级解码到数十秒的模型推理
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类：按标签值分组保存样本"""
+
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增减的瞬时值"""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[0][i] += 1
+                    break
+            sample[1] += value
+            sample[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = 'le="%s"' % _format_value(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------- 采集 ----------
+CAPTURE_FRAMES = Counter("capture_frames_total", "Frames (packets) received from the video source", ["camera"])
+CAPTURE_DECODED = Counter("capture_frames_decoded_total", "Frames decoded and written to the frame ring", ["camera"])
+CAPTURE_FPS = Gauge("capture_fps", "Received frames per second on the current connection", ["camera"])
+CAPTURE_DECODE_SECONDS = Histogram("capture_decode_seconds", "Time spent decoding one frame", ["camera"],
+                                   buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5))
+CAPTURE_ERRORS = Counter("capture_errors_total", "Capture connection errors", ["camera"])
+FRAMES_DROPPED = Counter("frames_dropped_total", "Frames dropped before use", ["camera", "reason"])
+
+# ---------- 推理 ----------
+INFER_QUEUE_WAIT = Histogram("inference_queue_wait_seconds", "Frame capture to model call start", ["camera"])
+INFER_SECONDS = Histogram("inference_seconds", "End-to-end inference time", ["camera"])
+VISION_SECONDS = Histogram("vision_model_seconds", "Vision model call latency")
+REASONING_SECONDS = Histogram("reasoning_model_seconds", "Reasoning model call latency")
+DETECTOR_SECONDS = Histogram("detector_seconds", "Local pre-detector latency",
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+TRACKS_ACTIVE = Gauge("tracks_active", "Objects currently tracked", ["camera"])
+TRACKS_CREATED = Counter("tracks_created_total", "New object tracks", ["camera"])
+VISION_SKIPPED = Counter("vision_model_skipped_total", "Inferences answered without the vision model", ["reason"])
+KB_RETRIEVAL_SECONDS = Histogram("kb_retrieval_seconds", "Knowledge base retrieval latency",
+                                 buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+MODEL_TOKENS = Counter("model_tokens_total", "Tokens processed by the model backend", ["model", "kind"])
+MODEL_PROMPT_TOKENS = Histogram("model_prompt_tokens", "Prompt tokens evaluated per call (reused prefix excluded)",
+                                ["model"], buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+MODEL_PROMPT_EVAL_SECONDS = Histogram("model_prompt_eval_seconds", "Prompt processing time per model call", ["model"])
+STRUCTURED_OUTPUT = Counter("model_structured_output_total",
+                            "Model outputs by schema check: valid, repaired by the JSON fixer, or invalid",
+                            ["model", "result"])
+JSON_PARSE = Counter("reasoning_json_parse_total", "Reasoning output parse path taken", ["path"])
+KB_INDEX_REBUILD_SECONDS = Histogram("kb_index_rebuild_seconds", "Knowledge base index rebuild duration",
+                                     buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+
+# ---------- 推送 ----------
+WS_CLIENTS = Gauge("ws_clients", "Connected WebSocket clients")
+WS_BROADCAST_SECONDS = Histogram("ws_broadcast_seconds", "Time to fan one message out to all WebSocket clients",
+                                 buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+WS_SEND_FAILURES = Counter("ws_send_failures_total", "Failed WebSocket sends")
+WS_MESSAGES_COALESCED = Counter("ws_messages_coalesced_total",
+                                "Non-alarm updates replaced by a newer one before a batched send")
+STREAM_LEVEL_SWITCHES = Counter("stream_level_switches_total",
+                                "Per-client stream ladder level changes", ["direction"])
+WS_VIDEO_VIEWS = Gauge("ws_video_views", "Camera views subscribed over the WebSocket video channel")
+WS_VIDEO_FRAMES = Counter("ws_video_frames_total", "Frames sent over the WebSocket video channel", ["level"])
+WS_VIDEO_BYTES = Counter("ws_video_bytes_total", "Encoded frame bytes sent over the WebSocket video channel",
+                         ["level"])
+WS_VIDEO_FRAMES_SKIPPED = Counter("ws_video_frames_skipped_total",
+                                  "Frames skipped for a WebSocket client", ["reason"])
+
+# ---------- 消息总线 ----------
+BUS_PUBLISHED = Counter("bus_messages_published_total", "Messages published on the message bus", ["topic"])
+BUS_DROPPED = Counter("bus_messages_dropped_total", "Messages dropped because a subscriber or the bus was full",
+                      ["topic"])
+
+
+def render():
+    """导出全部指标（Prometheus 文本格式）"""
+    return REGISTRY.render()
@@ -5,19 +5,30 @@ import threading
 import time
 from datetime import datetime
 import ollama
-from config import latest_frame_lock, broadcast_queue, recognition_results, inference_lock, last_infer_time
+from config import recognition_results
 from sound import play_alarm_sound
 from config import ALARM_DIR
+import config
+import metrics
+import tracing
 import os
+from logs import get_logger, payloads_enabled
+from frames import Frame
 
 # 导入新模块
-from reasoning_model import reasoning_model
-from kb import kb
+from reasoning_model import reasoning_model, record_usage
+from persistence import writer
+from incidents import incident_tracker, incident_category
+import bus
+
+log = get_logger("infer")
 
 def frame_to_base64(frame):
-    """将帧转换为Base64编码"""
-    frame = cv2.resize(frame, (640, 360))
-    _, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    """将帧转换为Base64编码（Frame对象直接复用缓存的编码结果）"""
+    if isinstance(frame, Frame):
+        return frame.model_base64()
+    frame = cv2.resize(frame, config.FRAME_SIZE)
+    _, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, config.MODEL_JPEG_QUALITY])
     return base64.b64encode(buf).decode()
 
 def save_alarm_image(frame, alert_level, case_id=None):
@@ -36,16 +47,19 @@ def save_alarm_image(frame, alert_level, case_id=None):
         filename = f"{ts}_{level_map.get(alert_level, 'unknown')}.jpg"
     
     path = os.path.join(ALARM_DIR, filename)
-    cv2.imwrite(path, frame)
-    print(f"【ALARM】图片已保存：{path}")
+    if isinstance(frame, Frame):
+        # 直接使用送检时已编码的JPEG，避免再次编码
+        data = frame.model_jpeg()
+    else:
+        _, buf = cv2.imencode(".jpg", frame)
+        data = buf.tobytes()
+    # 由后台写入器落盘，不阻塞推理线程
+    with tracing.span("alarm.save_image", bytes=len(data)):
+        writer.write_bytes(path, data)
+    log.info("报警图片已提交保存: %s", path)
     return path
 
-def vision_model_analysis(frame):
-    """视觉大模型分析（第一阶段）"""
-    image_b64 = frame_to_base64(frame)
-    
-    vision_prompt = """
-你是公司内部安防系统的【视觉感知模块】。
+VISION_SYSTEM_PROMPT = """你是公司内部安防系统的【视觉感知模块】。
 只输出 JSON，不要解释，不要多余文字。
 格式如下：
 {
@@ -60,58 +74,103 @@ def vision_model_analysis(frame):
     "person_positions": ["位置描述"],
     "environment_status": "环境状态描述"
   }
-}
-"""
-    resp = ollama.chat(
-        model="qwen3-vl:8b",
-        messages=[{"role": "user", "content": vision_prompt, "images": [image_b64]}]
-    )
-    
-    raw_text = resp["message"]["content"]
-    try:
-        facts = json.loads(raw_text)
-    except Exception as e:
-        print(f"【WARN】视觉模型输出无法解析: {e}")
-        return None
-    
-    return facts
+}"""
 
-def send_to_model(frame):
-    """完整的模型推理流程（双模型）"""
-    global recognition_results
-    
-    # ====== 第一阶段：视觉模型分析 ======
-    print("【INFO】第一阶段：视觉模型分析中...")
-    vision_facts = vision_model_analysis(frame)
+def vision_model_analysis(frame, camera_id=None, hint="", persons=False):
+    """
+    视觉大模型分析（第一阶段）；hint 为附加在提示词后的说明（如本地预检测结果），
+    persons 为 True 时要求按跟踪编号逐人回答（hint 中已列出编号）
+    """
+    import roi
+    from schemas import parse, vision_schema
+    # 配置了 ROI 时只送检区域裁剪图或拼图，否则送检整帧
+    if roi.input_mode(camera_id) != "full" and isinstance(frame, Frame):
+        regions = roi.regions(camera_id)
+        images = roi.vision_images(frame, camera_id)
+    else:
+        regions = []
+        images = [frame_to_base64(frame)]
     
-    if vision_facts is None:
-        print("【ERROR】视觉分析失败，跳过本次推理")
-        return
+    # 固定指令作为 system 前缀（可复用缓存），区域说明、预检测结果等随图片放在本次输入中
+    vision_prompt = (roi.prompt_suffix(camera_id, regions) + hint).strip() or "请分析这张监控画面。"
+    schema = vision_schema(regions=bool(regions), persons=persons)
+    with tracing.span("vision_model.call", model="qwen3-vl:8b", prompt_chars=len(vision_prompt),
+                      images=len(images), image_b64_bytes=sum(len(i) for i in images)) as span:
+        resp = ollama.chat(
+            model="qwen3-vl:8b",
+            messages=[{"role": "system", "content": VISION_SYSTEM_PROMPT},
+                      {"role": "user", "content": vision_prompt, "images": images}],
+            format=schema if config.model_config.STRUCTURED_OUTPUT else None,
+            keep_alive=config.model_config.KEEP_ALIVE,
+        )
+        record_usage("qwen3-vl:8b", resp, span)
+        raw_text = resp["message"]["content"]
+        span.set(response_chars=len(raw_text))
     
-    # 记录视觉分析结果
-    print(f"【DEBUG】视觉分析结果: {json.dumps(vision_facts, ensure_ascii=False)}")
+    facts = parse(raw_text, schema, "qwen3-vl:8b")
+    if facts is None:
+        # 不符合结构时去掉代码块标记、尾逗号等再解析
+        from fix_json_output import JSONFixer
+        try:
+            facts = json.loads(JSONFixer.remove_trailing_commas(JSONFixer.extract_and_fix_json(raw_text.strip())))
+            if not isinstance(facts, dict):
+                raise ValueError("不是 JSON 对象")
+        except Exception as e:
+            log.warning("视觉模型输出无法解析: %s", e)
+            metrics.STRUCTURED_OUTPUT.inc(model="qwen3-vl:8b", result="invalid")
+            return None
+        metrics.STRUCTURED_OUTPUT.inc(model="qwen3-vl:8b", result="repaired")
     
-    # ====== 第二阶段：推理模型分析 ======
-    print("【INFO】第二阶段：推理模型分析中...")
+    # 按区域送检时，禁区判定以区域为准
+    return roi.apply_region_facts(facts, regions)
+
+def rule_decision(vision_facts, source):
+    """不经推理模型、直接按规则给出的决策"""
+    from rules import decide_alarm
+    is_alarm, level, reason = decide_alarm(vision_facts)
+    return {
+        "final_decision": {
+            "is_alarm": is_alarm,
+            "alarm_level": level,
+            "alarm_reason": reason,
+            "confidence": 0.9
+        },
+        "analysis": {
+            "risk_assessment": vision_facts.get("scene_summary", ""),
+            "recommendation": "",
+            "rules_applied": [source]
+        },
+        "metadata": {
+            "model": source,
+            "timestamp": datetime.now().isoformat(),
+            "kb_cases_used": 0
+        }
+    }
+
+def reasoning_analysis(vision_facts):
+    """推理模型分析（第二阶段），模型出错时使用后备规则"""
+    log.debug("第二阶段：推理模型分析中")
     try:
-        reasoning_result = reasoning_model.infer(vision_facts)
+        with metrics.REASONING_SECONDS.time(), tracing.span("reasoning"):
+            reasoning_result = reasoning_model.infer(vision_facts)
         
-        # 记录推理结果
-        with open("reasoning_debug.log", "a", encoding="utf-8") as f:
-            f.write(f"\n{'='*60}\n")
-            f.write(f"时间: {datetime.now().isoformat()}\n")
-            f.write(f"视觉事实: {json.dumps(vision_facts, ensure_ascii=False)}\n")
-            f.write(f"推理结果: {json.dumps(reasoning_result, ensure_ascii=False, indent=2)}\n")
+        # 记录推理结果（后台追加写入，默认关闭）
+        if config.LOG_DEBUG_PAYLOADS:
+            writer.append_text(
+                "reasoning_debug.log",
+                f"\n{'='*60}\n"
+                f"时间: {datetime.now().isoformat()}\n"
+                f"视觉事实: {json.dumps(vision_facts, ensure_ascii=False)}\n"
+                f"推理结果: {json.dumps(reasoning_result, ensure_ascii=False, indent=2)}\n"
+            )
             
     except Exception as e:
-        print(f"【ERROR】推理模型异常: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("推理模型异常: %s", e)
         try:
             similar_cases = []
             reasoning_result = reasoning_model.get_fallback_decision(vision_facts, similar_cases)
         except Exception as fallback_error:
-            print(f"【ERROR】后备决策也失败: {fallback_error}")
+            log.error("后备决策也失败: %s", fallback_error)
             # 返回最低限度的决策
             reasoning_result = {
                 "final_decision": {
@@ -132,6 +191,89 @@ def send_to_model(frame):
                 }
             }
     
+    return reasoning_result
+
+def send_to_model(frame, camera_id=None):
+    """完整的模型推理流程（双模型）"""
+    global recognition_results
+    
+    from detector import detector
+    from tracker import tracker
+    camera_id = camera_id or config.DEFAULT_CAMERA
+    
+    # ====== 本地预检测（可选）：没有人员/烟火时跳过视觉模型 ======
+    # 目标跟踪（可选）：人员都有缓存的结论且状态未变时不再调用视觉模型
+    detections = camera_tracker = tracks = None
+    if tracker.enabled:
+        camera_tracker = tracker.get(camera_id)
+        if camera_tracker.running:
+            # 后台线程在持续检测和跟踪，直接使用其最近一次的结果
+            snapshot = camera_tracker.snapshot(frame.timestamp)
+            if snapshot is not None:
+                detections, tracks = snapshot
+    if detections is None and detector.enabled:
+        with tracing.span("detector") as span:
+            detections = detector.detect(frame)
+            if detections is not None:
+                span.set(detections=len(detections))
+        if detections is not None and camera_tracker is not None:
+            if camera_tracker.running:
+                # 后台结果暂不可用：只用本帧检测结果，不更新（避免旧帧打乱后台关联）
+                camera_tracker = None
+            else:
+                tracks = camera_tracker.update(detections, frame.timestamp)
+    
+    # ====== 第一阶段：视觉模型分析 ======
+    if detections is not None and detector.should_skip_vlm(camera_id, detections, frame.timestamp):
+        log.debug("预检测未发现相关目标，跳过视觉模型")
+        metrics.VISION_SKIPPED.inc(reason="detector_empty")
+        vision_facts = detector.empty_facts()
+    elif tracks and camera_tracker.reusable(tracks, frame.timestamp):
+        log.debug("跟踪目标的结论仍有效，跳过视觉模型")
+        metrics.VISION_SKIPPED.inc(reason="tracks_cached")
+        vision_facts = camera_tracker.cached_facts(tracks)
+        detector.apply(vision_facts, detections, camera_id)
+    else:
+        log.debug("第一阶段：视觉模型分析中")
+        hint = detector.prompt_hint(detections) if detections else ""
+        if tracks:
+            hint += camera_tracker.prompt_hint(tracks)
+        with metrics.VISION_SECONDS.time(), tracing.span("vision"):
+            vision_facts = vision_model_analysis(frame, camera_id, hint,
+                                                 persons=any(t.label == "person" for t in tracks or ()))
+        if vision_facts is not None and detections is not None:
+            detector.mark_vlm(camera_id, frame.timestamp)
+            # 人员数量、位置以检测框为准
+            detector.apply(vision_facts, detections, camera_id)
+            if tracks is not None:
+                camera_tracker.record(tracks, vision_facts, frame.timestamp)
+    
+    if vision_facts is None:
+        log.error("视觉分析失败，跳过本次推理", extra={"camera_id": camera_id})
+        return None
+    
+    bus.publish(f"facts.{camera_id}", {
+        "camera_id": camera_id,
+        "facts": vision_facts,
+        "trace_id": tracing.current_trace_id(),
+    })
+    
+    # 记录视觉分析结果（大段内容默认不输出）
+    if payloads_enabled(log):
+        log.debug("视觉分析结果: %s", json.dumps(vision_facts, ensure_ascii=False))
+    
+    # ====== 第二阶段：推理模型分析 ======
+    if vision_facts.get("source") == "detector":
+        # 预检测确认画面中没有人员和烟火，结论由规则直接给出，不调用推理模型
+        reasoning_result = rule_decision(vision_facts, "本地预检测")
+    elif vision_facts.get("source") == "tracker":
+        # 人员与上次完整推理时相同则沿用其结论，有人离开时按缓存的结论由规则判定
+        reasoning_result = camera_tracker.cached_decision(tracks) or rule_decision(vision_facts, "目标跟踪")
+    else:
+        reasoning_result = reasoning_analysis(vision_facts)
+        if tracks:
+            camera_tracker.remember_decision(tracks, reasoning_result)
+    
     final_decision = reasoning_result.get("final_decision", {})
     analysis = reasoning_result.get("analysis", {})
     metadata = reasoning_result.get("metadata", {})
@@ -147,14 +289,36 @@ def send_to_model(frame):
     scene_hash = hashlib.md5(vision_facts.get('scene_summary', '').encode()).hexdigest()[:8]
     case_id = f"{timestamp}_{scene_hash}"
     
+    # 同一摄像头、同类原因的连续报警合并为一个事件，只在开始/升级时执行下游动作
+    incident = None
+    transition = None
     if is_alarm == "是" and alarm_level != "无":
+        transition, incident = incident_tracker.observe(
+            camera_id or config.DEFAULT_CAMERA,
+            incident_category(vision_facts),
+            alarm_level,
+            alarm_reason
+        )
+        incident.last_frame = frame
+        if transition is None:
+            case_id = None
+            log.info("事件持续中，抑制重复报警", extra={
+                "incident_id": incident.incident_id, "alarm_count": incident.alarm_count})
+    
+    if transition is not None:
+        # 自动升级时使用事件的当前等级
+        alarm_level = incident.level
         try:
             # 保存报警图片（使用case_id）
             image_path = save_alarm_image(frame, alarm_level, case_id)
+            incident.add_frame(image_path)
+            incident.case_ids.append(case_id)
             
             # 准备案例数据 - 关键修改：传递完整的metadata
             case_data = {
                 "case_id": case_id,
+                "incident_id": incident.incident_id,
+                "incident_state": transition,
                 "scene_summary": vision_facts.get('scene_summary', ''),
                 "alarm_level": alarm_level,
                 "alarm_reason": alarm_reason,
@@ -174,26 +338,29 @@ def send_to_model(frame):
                 "timestamp": datetime.now().isoformat(),
             }
             
-            # 打印调试信息
-            print(f"【DEBUG】传递给知识库的metadata: {json.dumps(metadata, ensure_ascii=False)}")
-            print(f"【DEBUG】kb_cases_used值: {metadata.get('kb_cases_used', 0)}")
+            # 调试信息
+            if payloads_enabled(log):
+                log.debug("传递给知识库的metadata: %s", json.dumps(metadata, ensure_ascii=False))
             
-            # 保存到知识库
+            # 保存到知识库（后台写入）
             from kb.auto_writer import write_alarm_case_to_kb
-            case_file_path = write_alarm_case_to_kb(case_data)
-            print(f"【INFO】案例已保存到知识库：{case_id} -> {case_file_path}")
+            writer.call(tracing.bind(write_alarm_case_to_kb, "kb.write_case"), case_data)
+            log.info("案例已提交保存到知识库: %s", case_id)
             
         except Exception as e:
-            print(f"【WARN】保存案例到知识库失败: {e}")
+            log.warning("保存案例到知识库失败: %s", e)
             case_id = None
         
         # 播放报警声音
         play_alarm_sound(alarm_level)
         
-        print(f"【ALARM】{alarm_level}级报警：{alarm_reason}")
+        writer.record_incident(incident.to_dict())
+        log.warning("%s级报警: %s", alarm_level, alarm_reason, extra={
+            "camera_id": incident.camera_id, "incident_id": incident.incident_id, "transition": transition})
     
     # ====== 构建输出 ======
     output = {
+        "camera_id": camera_id or config.DEFAULT_CAMERA,
         "vision_analysis": vision_facts.get("scene_summary", ""),
         "is_alarm": is_alarm,
         "alarm_level": alarm_level,
@@ -206,55 +373,78 @@ def send_to_model(frame):
         "kb_history_cases": metadata.get("kb_history_cases", 0),
         "kb_cases_used": metadata.get("kb_history_cases", 0),  # 向后兼容
         "case_id": case_id,
+        "incident_id": incident.incident_id if incident else None,
+        "incident_state": (transition or "ongoing") if incident else None,
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "model": metadata.get("model", "unknown")
+        "model": metadata.get("model", "unknown"),
+        "trace_id": tracing.current_trace_id()
     }
     
-    # 保存到历史结果
+    # 保存到历史结果（内存中只保留最近若干条，完整历史写入事件库）
     recognition_results.append(output)
-    if len(recognition_results) > 100:
-        recognition_results.pop(0)
+    writer.record_event(output)
     
-    # 广播到WebSocket
-    broadcast_queue.put(output)
+    # 广播到WebSocket（事件持续期间的重复报警不再广播）
+    if incident is None or transition is not None:
+        bus.publish(bus.broadcast_topic(output["camera_id"], alarm_level), output)
     
-    # ====== 打印详细结果 ======
-    print(f"【RESULT】报警决策: {is_alarm} ({alarm_level}) - {alarm_reason}")
-    print(f"【RESULT】置信度: {final_decision.get('confidence', 0.0):.4f}")
-    print(f"【RESULT】使用模型: {metadata.get('model', 'unknown')}")
-    kb_total = metadata.get("kb_total_references", 0)
-    kb_history = metadata.get("kb_history_cases", 0)
-    kb_rules = metadata.get("kb_rule_files", 0)
-    if kb_total > 0:
-        if kb_history > 0:
-            print(f"【RESULT】参考了 {kb_history} 个历史案例", end="")
-            if kb_rules > 0:
-                print(f" 和 {kb_rules} 个规则文件")
-            else:
-                print()
-        elif kb_rules > 0:
-            print(f"【RESULT】参考了 {kb_rules} 个规则文件")
-    else:
-        print(f"【RESULT】未参考知识库")
+    # ====== 记录结果（一条结构化日志） ======
+    log.info("报警决策: %s (%s) - %s", is_alarm, alarm_level, alarm_reason, extra={
+        "camera_id": output["camera_id"],
+        "confidence": output["confidence"],
+        "model": output["model"],
+        "kb_rule_files": output["kb_rule_files"],
+        "kb_history_cases": output["kb_history_cases"],
+        "trace_id": output["trace_id"],
+        "rate_limit": False,
+    })
+    
+    return output
         
-def try_infer(frame, last_infer_time_ref):
+def try_infer(frame, last_infer_time_ref, camera_id=None):
     """
     frame: 当前帧
     last_infer_time_ref: [last_infer_time] 形式的列表，确保线程能更新
+    camera_id: 帧所属摄像头
     """
-    from threading import Lock
     from config import inference_lock
+    from scheduler import scheduler
+
+    camera_id = camera_id or config.DEFAULT_CAMERA
+    if not scheduler.begin(camera_id):
+        metrics.FRAMES_DROPPED.inc(camera=camera_id, reason="infer_in_flight")
+        return
 
     if not inference_lock.acquire(blocking=False):
+        # 模型容量已满，放弃本次推理
+        scheduler.cancel(camera_id)
+        metrics.FRAMES_DROPPED.inc(camera=camera_id, reason="infer_busy")
         return
 
     last_infer_time_ref[0] = time.time()  # 更新全局推理时间
 
     def _run():
+        start = time.time()
+        if isinstance(frame, Frame):
+            metrics.INFER_QUEUE_WAIT.observe(max(start - frame.timestamp, 0.0), camera=camera_id)
+        output = None
+        captured_at = frame.timestamp if isinstance(frame, Frame) else start
         try:
-            send_to_model(frame)
+            # trace 从帧采集时刻开始，排队等待单独记录为一个阶段
+            with tracing.start_trace("inference", start_time=captured_at, camera=camera_id) as trace:
+                tracing.record_span("queue_wait", trace.trace_id, captured_at, start)
+                output = send_to_model(frame, camera_id)
+                if output is not None:
+                    trace.set(is_alarm=output.get("is_alarm"), alarm_level=output.get("alarm_level"))
         finally:
             inference_lock.release()
+            latency = time.time() - start
+            metrics.INFER_SECONDS.observe(latency, camera=camera_id)
+            is_alarm = output is not None and output.get("is_alarm") == "是"
+            scheduler.finish(camera_id, latency, is_alarm)
+            # 采集在其他进程时据此调整推理间隔
+            if output is not None:
+                bus.publish(f"decisions.{camera_id}", {**output, "latency": round(latency, 3)})
 
     threading.Thread(target=_run, daemon=True).start()
 
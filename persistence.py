@@ -0,0 +1,233 @@
+# persistence.py
+import os
+import queue
+import threading
+import time
+
+import config
+from logs import get_logger
+
+log = get_logger("persist")
+
+
+def _rotate(path, max_bytes, backups):
+    """文件超过 max_bytes 时依次改名为 path.1 … path.<backups>，最旧的一份被覆盖"""
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+    except OSError:
+        return
+    for i in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    if backups > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+
+class BackgroundWriter:
+    """
+    后台持久化写入器
+
+    推理线程只负责把写盘任务放入有界队列，由单独的线程批量执行：
+    同一批次内对同一文件的追加合并为一次打开，fsync 每批次每文件只做一次，
+    事件库记录合并为一个事务，同一报警事件的多次更新只写最新状态。队列满时普通任务（调试日志）直接丢弃，
+    关键任务（报警图片、知识库案例、事件记录）最多等待 PERSIST_BLOCK_TIMEOUT 秒。
+    """
+
+    def __init__(self, maxsize=None, batch_size=None):
+        self.queue = queue.Queue(maxsize=maxsize or config.PERSIST_QUEUE_SIZE)
+        self.batch_size = batch_size or config.PERSIST_BATCH_SIZE
+        self.stats = {
+            "submitted": 0,
+            "written": 0,
+            "dropped": 0,
+            "errors": 0,
+            "batches": 0,
+            "max_depth": 0,
+            "blocked_seconds": 0.0,
+            "last_batch_size": 0,
+            "last_batch_seconds": 0.0,
+        }
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="Persistence-Writer")
+                self._thread.start()
+        return self._thread
+
+    # ---------- 提交任务 ----------
+
+    def _submit(self, item, critical):
+        self.start()
+        blocked = 0.0
+        try:
+            if critical:
+                start = time.time()
+                try:
+                    self.queue.put(item, timeout=config.PERSIST_BLOCK_TIMEOUT)
+                finally:
+                    blocked = time.time() - start
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats["dropped"] += 1
+                self.stats["blocked_seconds"] += blocked
+            log.warning("写入队列已满，丢弃任务: %s", item[0])
+            return False
+
+        with self._stats_lock:
+            self.stats["submitted"] += 1
+            self.stats["blocked_seconds"] += blocked
+            self.stats["max_depth"] = max(self.stats["max_depth"], self.queue.qsize())
+        return True
+
+    def append_text(self, path, text, critical=False, max_bytes=None, backups=3):
+        """追加文本到文件（调试日志等）；指定 max_bytes 时文件超过该大小后轮转为 path.1 … path.<backups>"""
+        return self._submit(("append", path, text, (max_bytes, backups) if max_bytes else None), critical)
+
+    def write_bytes(self, path, data, critical=True):
+        """写入二进制文件（报警图片等）"""
+        return self._submit(("bytes", path, data), critical)
+
+    def record_event(self, result, ts=None):
+        """写入事件库"""
+        return self._submit(("event", result, ts if ts is not None else time.time()), True)
+
+    def record_incident(self, incident):
+        """写入/更新报警事件聚合记录"""
+        return self._submit(("incident", incident), True)
+
+    def call(self, fn, *args, critical=True):
+        """在写入线程中执行任意函数（如生成知识库案例）"""
+        return self._submit(("call", fn, args), critical)
+
+    # ---------- 写入线程 ----------
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            start = time.time()
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+                with self._stats_lock:
+                    self.stats["batches"] += 1
+                    self.stats["last_batch_size"] = len(batch)
+                    self.stats["last_batch_seconds"] = round(time.time() - start, 4)
+
+    def _write_batch(self, batch):
+        appends = {}
+        rotations = {}
+        events = []
+        incidents = {}
+        incident_updates = 0
+        files = []
+        written = 0
+        errors = 0
+
+        for item in batch:
+            kind = item[0]
+            try:
+                if kind == "append":
+                    appends.setdefault(item[1], []).append(item[2])
+                    if item[3]:
+                        rotations[item[1]] = item[3]
+                elif kind == "event":
+                    events.append(item)
+                elif kind == "incident":
+                    # 同一批次内同一事件只保留最新状态
+                    incidents[item[1]["incident_id"]] = item[1]
+                    incident_updates += 1
+                elif kind == "bytes":
+                    f = open(item[1], "wb")
+                    files.append(f)
+                    f.write(item[2])
+                    written += 1
+                elif kind == "call":
+                    item[1](*item[2])
+                    written += 1
+            except Exception as e:
+                errors += 1
+                log.error("写入任务失败 (%s): %s", kind, e)
+
+        for path, texts in appends.items():
+            try:
+                if path in rotations:
+                    _rotate(path, *rotations[path])
+                f = open(path, "a", encoding="utf-8")
+                files.append(f)
+                f.write("".join(texts))
+                written += len(texts)
+            except Exception as e:
+                errors += len(texts)
+                log.error("追加文件失败 %s: %s", path, e)
+
+        if events:
+            try:
+                from event_store import event_store
+                event_store.append_many([e[1] for e in events], [e[2] for e in events])
+                written += len(events)
+            except Exception as e:
+                errors += len(events)
+                log.error("写入事件库失败: %s", e)
+
+        if incidents:
+            try:
+                from event_store import event_store
+                event_store.upsert_incidents(list(incidents.values()))
+                written += incident_updates
+            except Exception as e:
+                errors += incident_updates
+                log.error("写入事件聚合记录失败: %s", e)
+
+        # 每批次每个文件只 fsync 一次
+        for f in files:
+            try:
+                f.flush()
+                if config.PERSIST_FSYNC:
+                    os.fsync(f.fileno())
+            except Exception as e:
+                errors += 1
+                log.error("fsync失败 %s: %s", f.name, e)
+            finally:
+                f.close()
+
+        with self._stats_lock:
+            self.stats["written"] += written
+            self.stats["errors"] += errors
+
+    # ---------- 状态 ----------
+
+    def flush(self, timeout=None):
+        """等待队列中的任务全部写完，超时返回False"""
+        with self.queue.all_tasks_done:
+            return self.queue.all_tasks_done.wait_for(
+                lambda: self.queue.unfinished_tasks == 0, timeout)
+
+    def get_stats(self):
+        """获取写入统计信息（含背压指标）"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["queue_capacity"] = self.queue.maxsize
+        stats["blocked_seconds"] = round(stats["blocked_seconds"], 4)
+        return stats
+
+
+# 全局写入器实例
+writer = BackgroundWriter()
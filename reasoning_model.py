@@ -5,89 +5,128 @@ from typing import Dict, Any, List
 from kb import KnowledgeBase
 from datetime import datetime
 from config import model_config
-class ReasoningModel:
-    """推理语言大模型"""
-    def __init__(self, model_name: str = "deepseek-r1:7b"):
-        self.model_name = model_name
-        self.kb = KnowledgeBase()
-    
-    def generate_prompt(self, vision_facts: Dict[str, Any], 
-                   similar_cases: List[Dict] = None) -> str:
-        """生成推理模型的提示词"""
-    
-        # 视觉事实总结
-        vision_summary = f"""
-视觉分析结果：
-- 有人员：{vision_facts.get('has_person', '未知')}
-- 工牌状态：{vision_facts.get('badge_status', '未知')}
-- 进入禁区：{vision_facts.get('enter_restricted_area', '未知')}
-- 火灾/烟雾：{vision_facts.get('has_fire_or_smoke', '未知')}
-- 电气风险：{vision_facts.get('has_electric_risk', '未知')}
-- 场景描述：{vision_facts.get('scene_summary', '无描述')}
-"""
-    
-        # 知识库案例
-        kb_context = ""
-        if similar_cases and len(similar_cases) > 0:
-            kb_context = "\n相关历史案例：\n"
-            for i, case in enumerate(similar_cases[:3], 1):
-                source = case.get('source', '未知')
-                text = case.get('text', '')[:150]
-                score = case.get('score', 0)
-                kb_context += f"{i}. 来源：{source}\n"
-                kb_context += f"   内容：{text}...\n"
-                kb_context += f"   相似度：{score:.4f}\n"
-        else:
-            kb_context = "\n相关历史案例：无相关历史案例\n"
-        
-        prompt = f"""你是一个专业的安防专家，负责分析监控画面并做出报警决策。
+from persistence import writer
+from schemas import DECISION_SCHEMA, parse
+import metrics
+import tracing
+import config
+from logs import get_logger, payloads_enabled
+
+log = get_logger("reasoning")
+
+# 推理模型的固定指令与输出格式：每次调用完全相同，作为 system 消息放在最前面，
+# Ollama 可以复用上次调用已计算好的这段前缀（模型常驻期间），每次只需处理后面的少量输入
+SYSTEM_PROMPT = """你是一个专业的安防专家，负责分析监控画面并做出报警决策。
 
 ## 重要指令：
 - 你只能输出 JSON 格式，不能有任何其他文字
 - JSON 必须严格符合指定的格式
-- 所有数值必须是纯数字
-- confidence 字段必须是 0.0 到 1.0 之间的纯数字
+- 所有数值必须是纯数字，confidence 必须是 0.0 到 1.0 之间的数字（例如 0.75、0.85），不要进行数学运算
 - 不要解释，不要注释，不要多余的空格
 
 ## 分析要求：
 1. 基于视觉分析结果进行综合判断
-2. 考虑公司安防政策和风险评估
+2. 考虑公司安防政策和风险评估，参考相关历史案例
 3. 输出明确的报警决策
 
 ## 输入信息：
-{vision_summary}
-{kb_context}
+用户消息给出本次的视觉分析结果（JSON，字段：has_person 有人员、badge_status 工牌状态、
+enter_restricted_area 进入禁区、has_fire_or_smoke 火灾/烟雾、has_electric_risk 电气风险、scene_summary 场景描述）
+和相关历史案例（来源、相似度、内容摘要）。
 
 ## 输出格式（必须严格遵守，这是有效的JSON示例）：
-{{
-  "final_decision": {{
-    "is_alarm": "是" 或 "否",
-    "alarm_level": "无" 或 "一般" 或 "严重" 或 "紧急",
+{
+  "final_decision": {
+    "is_alarm": "是",
+    "alarm_level": "严重",
     "alarm_reason": "详细的报警原因说明",
-    "confidence": 0.85  # 注意：必须是0.0到1.0之间的数字，不要进行计算
-  }},
-  "analysis": {{
+    "confidence": 0.85
+  },
+  "analysis": {
     "risk_assessment": "风险评估描述",
     "recommendation": "处置建议",
     "rules_applied": ["规则1", "规则2"]
-  }},
-  "metadata": {{
-    "model": "{self.model_name}",  # 直接使用模型名称
-    "timestamp": "2024-01-01T00:00:00"
-  }}
-}}
+  }
+}
+is_alarm 取 "是" 或 "否"；alarm_level 取 "无"、"一般"、"严重" 或 "紧急"。"""
 
+# 本次输入中带上的视觉事实字段
+_FACT_FIELDS = ("has_person", "badge_status", "enter_restricted_area",
+                "has_fire_or_smoke", "has_electric_risk", "scene_summary")
 
 
-## 特别注意：
-- confidence字段必须是0.0到1.0之间的数字，例如0.75、0.85
-- 不要进行数学运算（不要写+、-、=等符号）
-- 不要添加任何额外的文本、注释或解释
+def record_usage(model, response, span=None):
+    """记录 Ollama 返回的 token 数与耗时（prompt_eval_count 不含复用缓存的前缀）"""
+    try:
+        prompt_tokens = response.get("prompt_eval_count") or 0
+        output_tokens = response.get("eval_count") or 0
+        prompt_seconds = (response.get("prompt_eval_duration") or 0) / 1e9
+    except Exception:
+        return
+    metrics.MODEL_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    metrics.MODEL_TOKENS.inc(output_tokens, model=model, kind="output")
+    metrics.MODEL_PROMPT_TOKENS.observe(prompt_tokens, model=model)
+    if prompt_seconds:
+        metrics.MODEL_PROMPT_EVAL_SECONDS.observe(prompt_seconds, model=model)
+    if span is not None:
+        span.set(prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                 prompt_eval_ms=round(prompt_seconds * 1000, 1))
 
-现在，基于以上信息，输出你的决策JSON："""
+
+class ReasoningModel:
+    """推理语言大模型"""
+    def __init__(self, model_name: str = "deepseek-r1:7b"):
+        self.model_name = model_name
+        self.kb = KnowledgeBase()
+    
+    @property
+    def options(self):
+        # 各次调用的选项保持一致（num_ctx 变化会让 Ollama 重新加载模型、前缀缓存失效）
+        return {"temperature": model_config.REASONING_TEMPERATURE,
+                "num_ctx": model_config.REASONING_NUM_CTX}
+    
+    def messages(self, prompt: str) -> List[Dict[str, str]]:
+        """固定的 system 前缀 + 本次输入"""
+        return [{"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}]
+    
+    def generate_prompt(self, vision_facts: Dict[str, Any], 
+                   similar_cases: List[Dict] = None) -> str:
+        """生成本次调用的输入（固定的指令与输出格式见 SYSTEM_PROMPT）"""
+        facts = {key: vision_facts.get(key) for key in _FACT_FIELDS if key in vision_facts}
+        prompt = "视觉分析结果：" + json.dumps(facts, ensure_ascii=False, separators=(",", ":"))
     
+        # 知识库案例（内容摘要去掉多余空白）
+        if similar_cases:
+            prompt += "\n相关历史案例："
+            for i, case in enumerate(similar_cases[:3], 1):
+                text = " ".join(case.get('text', '').split())[:model_config.REASONING_KB_SNIPPET_CHARS]
+                prompt += f"\n{i}. [{case.get('source', '未知')} {case.get('score', 0):.2f}] {text}"
+        else:
+            prompt += "\n相关历史案例：无"
+        
         return prompt
     
+    def chat(self, prompt: str, **options):
+        """
+        调用推理模型：固定前缀 + 本次输入，模型常驻；
+        启用结构化输出时按 DECISION_SCHEMA 约束解码，并关闭 deepseek-r1 的思考过程输出
+        """
+        return ollama.chat(
+            model=self.model_name,
+            messages=self.messages(prompt),
+            options=dict(self.options, **options),
+            keep_alive=model_config.KEEP_ALIVE,
+            think=model_config.REASONING_THINK,
+            format=DECISION_SCHEMA if model_config.STRUCTURED_OUTPUT else None,
+        )
+    
+    def warm_prefix(self):
+        """预先计算 system 前缀并让模型常驻，首次推理只需处理本次输入"""
+        response = self.chat("视觉分析结果：{}\n相关历史案例：无", num_predict=1)
+        record_usage(self.model_name, response)
+        return {"model": self.model_name, "prefix_tokens": response.get("prompt_eval_count")}
+    
     def query_knowledge_base(self, vision_facts: Dict[str, Any]) -> List[Dict]:
         """查询知识库获取相关案例"""
         # 构建查询字符串
@@ -108,11 +147,14 @@ class ReasoningModel:
         query_text = " ".join(query_parts) + " " + vision_facts.get('scene_summary', '')
         
         # 查询知识库
-        similar_cases = self.kb.get_similar_cases(
-            query_text, 
-            top_k=3, 
-            similarity_threshold=0.3
-        )
+        with metrics.KB_RETRIEVAL_SECONDS.time(), \
+                tracing.span("kb.retriever", query_chars=len(query_text), top_k=3) as span:
+            similar_cases = self.kb.get_similar_cases(
+                query_text, 
+                top_k=3, 
+                similarity_threshold=0.3
+            )
+            span.set(results=len(similar_cases))
         
         return similar_cases
     
@@ -120,7 +162,8 @@ class ReasoningModel:
         """执行推理，增强错误处理"""
         
         # 查询知识库
-        similar_cases = self.query_knowledge_base(vision_facts)
+        with tracing.span("kb.query"):
+            similar_cases = self.query_knowledge_base(vision_facts)
         
                 # 区分类型
         rule_files = []
@@ -139,54 +182,57 @@ class ReasoningModel:
         kb_rules = len(rule_files)     # 规则文件数
         kb_history = len(history_cases) # 历史案例数
         
-        print(f"【知识库】检索结果: {kb_total} 个文档")
-        print(f"  - 规则文件: {kb_rules} 个")
-        print(f"  - 历史案例: {kb_history} 个")
-        
-        # 详细来源
-        if similar_cases:
-            print("  具体来源:")
-            for i, case in enumerate(similar_cases):
-                source = case.get('source', '未知')
-                score = case.get('score', 0)
-                if 'case_' in source:
-                    type_str = "📁 历史案例"
-                elif source.endswith('.md'):
-                    type_str = "📚 规则文件"
-                else:
-                    type_str = "❓ 其他"
-                print(f"    {i+1}. {type_str}: {source} (相似度: {score:.4f})")
+        log.info("知识库检索结果: %d 个文档", kb_total, extra={
+            "kb_rule_files": kb_rules,
+            "kb_history_cases": kb_history,
+            "sources": [f"{case.get('source', '未知')}:{case.get('score', 0):.4f}" for case in similar_cases],
+        })
                 
         # 生成提示词
         prompt = self.generate_prompt(vision_facts, similar_cases)
         
         try:
             # 调用语言模型
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                options={"temperature": model_config.REASONING_TEMPERATURE}
-            )    
-            
-            # 获取原始文本
-            raw_text = response["message"]["content"].strip()
-            print(f"【DEBUG】模型原始输出:\n{raw_text}\n")
+            with tracing.span("reasoning_model.call", model=self.model_name,
+                              prompt_chars=len(prompt)) as span:
+                response = self.chat(prompt)
+                record_usage(self.model_name, response, span)
+                
+                # 获取原始文本
+                raw_text = response["message"]["content"].strip()
+                span.set(response_chars=len(raw_text))
+            if payloads_enabled(log):
+                log.debug("模型原始输出:\n%s", raw_text)
             
-            # 保存原始输出用于调试
-            with open("model_raw_outputs.log", "a", encoding="utf-8") as f:
-                f.write(f"\n{'='*60}\n")
-                f.write(f"时间: {datetime.now().isoformat()}\n")
-                f.write(f"模型: {self.model_name}\n")
-                f.write(f"输出:\n{raw_text}\n")
+            # 保存原始输出用于调试（后台追加写入，默认关闭）
+            if config.LOG_DEBUG_PAYLOADS:
+                writer.append_text(
+                    "model_raw_outputs.log",
+                    f"\n{'='*60}\n"
+                    f"时间: {datetime.now().isoformat()}\n"
+                    f"模型: {self.model_name}\n"
+                    f"输出:\n{raw_text}\n"
+                )
             
-            # 使用JSONFixer解析
-            from fix_json_output import JSONFixer
-            result = JSONFixer.safe_parse(raw_text)
+            # 结构化输出直接解析；不符合结构（或后端不支持结构化输出）时用JSONFixer修复
+            with tracing.span("json.parse", input_chars=len(raw_text)) as span:
+                result = parse(raw_text, DECISION_SCHEMA, self.model_name)
+                repaired = result is None
+                if repaired:
+                    from fix_json_output import JSONFixer
+                    result = JSONFixer.safe_parse(raw_text)
+                else:
+                    metrics.JSON_PARSE.inc(path="schema")
+                span.set(repaired=repaired)
             
             # 验证结果格式
             if not self._validate_result_format(result):
-                print("【WARN】模型输出格式不正确，使用后备决策")
+                log.warning("模型输出格式不正确，使用后备决策")
+                metrics.JSON_PARSE.inc(path="fallback")
+                metrics.STRUCTURED_OUTPUT.inc(model=self.model_name, result="invalid")
                 return self.get_fallback_decision(vision_facts, similar_cases)
+            if repaired:
+                metrics.STRUCTURED_OUTPUT.inc(model=self.model_name, result="repaired")
             
             # 确保metadata包含必要信息
             if "metadata" not in result:
@@ -220,9 +266,7 @@ class ReasoningModel:
             return result
             
         except Exception as e:
-            print(f"【ERROR】推理模型错误: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("推理模型错误: %s", e)
             return self.get_fallback_decision(vision_facts, similar_cases)
         
     def _extract_json_from_text(self, text: str) -> Dict[str, Any]:
@@ -230,8 +274,9 @@ class ReasoningModel:
         if not text:
             raise ValueError("模型返回空文本")
         
-        print(f"【DEBUG】开始提取JSON，文本长度: {len(text)}")
-        print(f"【DEBUG】前500字符: {text[:500]}")
+        log.debug("开始提取JSON，文本长度: %d", len(text))
+        if payloads_enabled(log):
+            log.debug("前500字符: %s", text[:500])
         
         # 方法1: 清理文本中的代码块标记
         text_clean = text.strip()
@@ -252,10 +297,10 @@ class ReasoningModel:
         # 方法2: 尝试直接解析清理后的文本
         try:
             result = json.loads(text_clean)
-            print("【DEBUG】方法1: 直接解析成功")
+            log.debug("方法1: 直接解析成功")
             return result
         except json.JSONDecodeError as e:
-            print(f"【DEBUG】方法1失败: {e.msg}, 位置: {e.pos}")
+            log.debug("方法1失败: %s, 位置: %s", e.msg, e.pos)
         
         # 方法3: 查找第一个 { 和最后一个 }
         try:
@@ -264,12 +309,13 @@ class ReasoningModel:
             
             if start >= 0 and end > start:
                 json_str = text_clean[start:end]
-                print(f"【DEBUG】提取的JSON字符串: {json_str[:200]}...")
+                if payloads_enabled(log):
+                    log.debug("提取的JSON字符串: %s...", json_str[:200])
                 result = json.loads(json_str)
-                print("【DEBUG】方法2: 提取{}成功")
+                log.debug("方法2: 提取{}成功")
                 return result
         except Exception as e:
-            print(f"【DEBUG】方法2失败: {e}")
+            log.debug("方法2失败: %s", e)
         
         # 方法4: 使用正则表达式提取JSON
         try:
@@ -278,17 +324,17 @@ class ReasoningModel:
             matches = re.findall(json_pattern, text_clean, re.DOTALL)
             
             if matches:
-                print(f"【DEBUG】找到{len(matches)}个可能的JSON对象")
+                log.debug("找到%d个可能的JSON对象", len(matches))
                 for i, match in enumerate(matches):
                     try:
                         result = json.loads(match)
-                        print(f"【DEBUG】方法3: 第{i+1}个匹配解析成功")
+                        log.debug("方法3: 第%d个匹配解析成功", i + 1)
                         return result
                     except json.JSONDecodeError as e:
-                        print(f"【DEBUG】第{i+1}个匹配解析失败: {e.msg}")
+                        log.debug("第%d个匹配解析失败: %s", i + 1, e.msg)
                         continue
         except Exception as e:
-            print(f"【DEBUG】方法3失败: {e}")
+            log.debug("方法3失败: %s", e)
         
         # 方法5: 尝试修复不完整的JSON
         try:
@@ -302,13 +348,13 @@ class ReasoningModel:
             if open_braces > close_braces:
                 # 补全缺失的闭合括号
                 json_str += '}' * (open_braces - close_braces)
-                print(f"【DEBUG】补全了{open_braces - close_braces}个闭合括号")
+                log.debug("补全了%d个闭合括号", open_braces - close_braces)
             
             result = json.loads(json_str)
-            print("【DEBUG】方法4: 补全括号后解析成功")
+            log.debug("方法4: 补全括号后解析成功")
             return result
         except Exception as e:
-            print(f"【DEBUG】方法4失败: {e}")
+            log.debug("方法4失败: %s", e)
         
         # 所有方法都失败
         raise ValueError(f"无法从模型输出中提取有效的JSON。文本前200字符: {text[:200]}")
@@ -374,19 +420,19 @@ class ReasoningModel:
             cleaned_lines.append(line)
         text = '\n'.join(cleaned_lines)
         
-        print(f"【DEBUG】修复后的JSON文本: {text[:500]}...")
+        if payloads_enabled(log):
+            log.debug("修复后的JSON文本: %s...", text[:500])
         return text
     def _validate_result_format(self, result: Dict) -> bool:
         """验证结果格式是否正确，增强容错性"""
         try:
-            print(f"【DEBUG】开始验证结果格式，可用字段: {list(result.keys())}")
+            log.debug("开始验证结果格式")
             original_metadata = result.get("metadata", {})
             # 检查必需字段
             required_sections = ["final_decision", "analysis"]
             for section in required_sections:
                 if section not in result:
-                    print(f"【ERROR】缺少必需字段: {section}")
-                    print(f"【ERROR】可用字段: {list(result.keys())}")
+                    log.error("缺少必需字段: %s", section, extra={"fields": list(result.keys())})
                     return False
             
             # 检查 final_decision 字段
@@ -394,22 +440,21 @@ class ReasoningModel:
             required_decisions = ["is_alarm", "alarm_level", "alarm_reason"]
             for field in required_decisions:
                 if field not in final_decision:
-                    print(f"【ERROR】final_decision 缺少字段: {field}")
-                    print(f"【ERROR】final_decision字段: {list(final_decision.keys())}")
+                    log.error("final_decision 缺少字段: %s", field,
+                              extra={"fields": list(final_decision.keys())})
                     return False
             
             # 验证报警等级
             valid_levels = ["无", "一般", "严重", "紧急"]
             alarm_level = final_decision.get("alarm_level")
             if alarm_level not in valid_levels:
-                print(f"【ERROR】无效的报警等级: {alarm_level}")
-                print(f"【ERROR】有效等级应为: {valid_levels}")
+                log.error("无效的报警等级: %s", alarm_level, extra={"valid_levels": valid_levels})
                 return False
             
             # 验证是否报警
             is_alarm = final_decision.get("is_alarm")
             if is_alarm not in ["是", "否"]:
-                print(f"【ERROR】无效的是否报警: {is_alarm}")
+                log.error("无效的是否报警: %s", is_alarm)
                 return False
             
             # 确保confidence在0-1范围内
@@ -425,7 +470,7 @@ class ReasoningModel:
             
             # 如果缺少metadata，添加默认值（增强容错）
             if "metadata" not in result:
-                print("【WARN】缺少metadata字段，自动添加")
+                log.warning("缺少metadata字段，自动添加")
                 from datetime import datetime
                 result["metadata"] = {
                     "model": self.model_name,
@@ -442,7 +487,7 @@ class ReasoningModel:
                 if "kb_cases_used" not in result["metadata"]:
                     result["metadata"]["kb_cases_used"] = 0
             
-            print("【DEBUG】结果格式验证通过")
+            log.debug("结果格式验证通过")
             if original_metadata:
                 if "model" in original_metadata:
                     result["metadata"]["original_model"] = original_metadata["model"]
@@ -452,9 +497,7 @@ class ReasoningModel:
             return True
             
         except Exception as e:
-            print(f"【ERROR】验证结果格式失败: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("验证结果格式失败: %s", e)
             return False
 
 
@@ -0,0 +1,345 @@
+# replay.py
+"""
+离线回放：用录制的视频文件或图片目录跑完整条识别链路
+
+帧按录制时间（模拟时钟）推进，推理门控、视觉模型、知识库检索、推理模型、报警事件聚合与
+实时运行完全相同，但不等待墙钟，后端处理多快就回放多快。每次推理输出一行决策记录
+（含各阶段耗时），结束时打印汇总统计。
+
+门控方式：
+  adaptive  与实时运行相同的自适应间隔；推理耗时按模拟时间占用模型，期间到达的帧被放弃，
+            用于评估实时部署时实际能分析到哪些帧
+  interval  按录制时间固定间隔推理，不受后端速度影响，结果可复现（回归测试、补录知识库）
+
+示例:
+  python replay.py recordings/cam01.mp4 recordings/cam02.mp4
+  python replay.py snapshots/ --image-fps 1 --gating interval --interval 5 --workspace /tmp/replay
+"""
+import argparse
+import glob
+import heapq
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import cv2
+
+import config
+
+_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class SimClock:
+    """模拟时钟：时间由回放的帧时间戳推进，而不是墙钟"""
+
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ts):
+        self.now = max(self.now, ts)
+
+
+class ReplaySource:
+    """一个回放源（视频文件或图片目录），按时间顺序产生 (时间戳, 摄像头, 帧序号, 图像)"""
+
+    def __init__(self, path, camera_id, start_ts, sample_fps=None, image_fps=1.0):
+        self.path = path
+        self.camera_id = camera_id
+        self.start_ts = start_ts
+        self.sample_interval = 1.0 / sample_fps if sample_fps else 0.0
+        self.image_fps = image_fps
+        self.frames_read = 0
+        self.frames_decoded = 0
+        self.duration = 0.0
+
+    def __iter__(self):
+        if os.path.isdir(self.path):
+            return self._images()
+        return self._video()
+
+    def _images(self):
+        files = sorted(
+            filename for filename in glob.glob(os.path.join(self.path, "*"))
+            if filename.lower().endswith(_IMAGE_EXTS)
+        )
+        for index, filename in enumerate(files):
+            self.frames_read += 1
+            image = cv2.imread(filename)
+            if image is None:
+                continue
+            self.frames_decoded += 1
+            self.duration = index / self.image_fps
+            yield self.start_ts + self.duration, self.camera_id, index, image
+
+    def _video(self):
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            raise ValueError(f"无法打开视频: {self.path}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps != fps or fps <= 0:
+            fps = 25.0
+
+        # 与实时采集相同：只解码按取帧率需要的帧，其余只 grab 不解码
+        index = 0
+        next_sample = 0.0
+        try:
+            while cap.grab():
+                offset = index / fps
+                index += 1
+                self.frames_read += 1
+                self.duration = offset
+                if offset < next_sample:
+                    continue
+                ok, image = cap.retrieve()
+                if not ok:
+                    continue
+                next_sample = offset + self.sample_interval
+                self.frames_decoded += 1
+                yield self.start_ts + offset, self.camera_id, index - 1, image
+        finally:
+            cap.release()
+
+
+class StageTimer:
+    """收集回放 trace 内各阶段 span 的耗时"""
+
+    def __init__(self):
+        self.pending = {}   # trace_id -> {阶段名: 毫秒}
+        self.samples = {}   # 阶段名 -> [毫秒]
+
+    def __call__(self, span):
+        stages = self.pending.get(span.trace_id)
+        if stages is None or span.end is None or span.parent_id is None:
+            return
+        ms = (span.end - span.start) * 1000
+        stages[span.name] = round(stages.get(span.name, 0.0) + ms, 3)
+
+    def begin(self, trace_id):
+        if trace_id:
+            self.pending[trace_id] = {}
+
+    def end(self, trace_id):
+        stages = self.pending.pop(trace_id, None) or {}
+        for name, ms in stages.items():
+            self.samples.setdefault(name, []).append(ms)
+        return stages
+
+    def summary(self):
+        result = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            result[name] = {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p95_ms": round(values[min(int(len(values) * 0.95), len(values) - 1)], 3),
+            }
+        return result
+
+
+def use_workspace(workspace):
+    """报警图片、事件库、追踪和知识库写入独立目录；知识库从当前目录复制，新案例不影响线上知识库"""
+    workspace = os.path.abspath(workspace)
+    for name in ("source", "index", "archive"):
+        src = os.path.join("kb", name)
+        dst = os.path.join(workspace, "kb", name)
+        if os.path.isdir(src) and not os.path.exists(dst):
+            shutil.copytree(src, dst)
+    config.ALARM_DIR = os.path.join(workspace, "alarms")
+    config.DATA_DIR = os.path.join(workspace, "data")
+    config.EVENT_DB_PATH = os.path.join(config.DATA_DIR, "events.db")
+    config.TRACE_FILE = os.path.join(config.DATA_DIR, "traces.jsonl")
+    os.makedirs(config.ALARM_DIR, exist_ok=True)
+    os.makedirs(config.DATA_DIR, exist_ok=True)
+    os.chdir(workspace)
+
+
+def _camera_ids(paths, cameras):
+    if cameras:
+        if len(cameras) != len(paths):
+            raise SystemExit("--camera 的数量必须与输入数量一致")
+        return cameras
+    ids = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0] or "replay"
+        camera_id = name
+        suffix = 2
+        while camera_id in ids:
+            camera_id = f"{name}_{suffix}"
+            suffix += 1
+        ids.append(camera_id)
+    return ids
+
+
+def replay(args):
+    # 所有输入按同一个起始时间对齐，模拟多路摄像头同时录制
+    start_ts = datetime.fromisoformat(args.start).timestamp() if args.start else time.time()
+    paths = [os.path.abspath(path) for path in args.inputs]
+    output_path = os.path.abspath(args.output) if args.output else None
+    camera_ids = _camera_ids(paths, args.camera)
+
+    if args.workspace:
+        use_workspace(args.workspace)
+    config.ALARM_SOUND_ENABLED = args.sound
+    # 回放结果只在本进程内，不发布到线上的消息总线（无订阅者时进程内总线直接丢弃）
+    config.BUS_BACKEND = "inprocess"
+    config.TRACING_ENABLED = True
+
+    import tracing
+    from frames import FrameRing
+    from incidents import incident_tracker
+    from model_infer import send_to_model
+    from persistence import writer
+    from scheduler import scheduler
+
+    # 调度器和事件聚合器使用模拟时间；模型容量只在回放的摄像头之间分配
+    clock = SimClock(start_ts)
+    scheduler.clock = clock
+    scheduler.cameras = {}
+    incident_tracker.clock = clock
+
+    sources = [
+        ReplaySource(path, camera_id, start_ts, args.sample_fps, args.image_fps)
+        for path, camera_id in zip(paths, camera_ids)
+    ]
+    rings = {camera_id: FrameRing(slots=2, size=config.capture_size(camera_id)) for camera_id in camera_ids}
+    last_infer = {camera_id: float("-inf") for camera_id in camera_ids}
+    source_of = {source.camera_id: source.path for source in sources}
+    busy_until = float("-inf")
+
+    timer = StageTimer()
+    tracing.add_listener(timer)
+
+    if output_path is None:
+        output_path = os.path.join(config.DATA_DIR, f"replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    stats = {"inferred": 0, "failed": 0, "skipped_interval": 0, "skipped_busy": 0}
+    decisions = {}
+    latencies = []
+    wall_start = time.perf_counter()
+
+    with open(output_path, "w", encoding="utf-8") as out:
+        def emit(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        for ts, camera_id, index, image in heapq.merge(*sources, key=lambda item: item[0]):
+            clock.advance(ts)
+            frame = rings[camera_id].write(image, ts)
+            base = {
+                "camera_id": camera_id,
+                "source": source_of[camera_id],
+                "frame_index": index,
+                "video_ts": round(ts - start_ts, 3),
+                "sim_time": datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            }
+
+            # ---- 推理门控（与 camera.infer_gate 相同，但使用模拟时间）----
+            if args.gating == "adaptive":
+                scheduler.observe_frame(camera_id, frame)
+                interval = scheduler.interval(camera_id)
+            else:
+                interval = args.interval
+            gate = None
+            if ts - last_infer[camera_id] < interval:
+                gate = "interval"
+            elif args.gating == "adaptive" and ts < busy_until:
+                gate = "busy"
+            if gate is not None:
+                stats["skipped_" + gate] += 1
+                if args.all_frames:
+                    emit({**base, "gate": gate})
+                continue
+
+            # ---- 推理 ----
+            last_infer[camera_id] = ts
+            scheduler.begin(camera_id)
+            started = time.perf_counter()
+            with tracing.start_trace("replay", camera=camera_id, frame_index=index) as trace:
+                timer.begin(trace.trace_id)
+                output = send_to_model(frame.detach(), camera_id)
+            latency = time.perf_counter() - started
+            stages = timer.end(trace.trace_id)
+            latencies.append(latency * 1000)
+
+            if args.gating == "adaptive":
+                # 推理按实际耗时占用模型（模拟时间），结束时刻再更新调度状态
+                busy_until = ts + latency
+                clock.advance(busy_until)
+            is_alarm = output is not None and output.get("is_alarm") == "是"
+            scheduler.finish(camera_id, latency, is_alarm)
+
+            record = {**base, "gate": "infer", "latency_ms": round(latency * 1000, 3), "stages": stages}
+            if output is None:
+                stats["failed"] += 1
+                record["status"] = "failed"
+            else:
+                stats["inferred"] += 1
+                level = output.get("alarm_level", "无")
+                decisions[level] = decisions.get(level, 0) + 1
+                record.update({key: output.get(key) for key in (
+                    "is_alarm", "alarm_level", "alarm_reason", "confidence", "vision_analysis",
+                    "case_id", "incident_id", "incident_state", "trace_id")})
+            emit(record)
+            out.flush()
+
+        # 回放结束时仍在持续的事件按超时结束，写入事件库
+        clock.advance(clock.now + config.INCIDENT_CLOSE_SECONDS)
+        incident_tracker.close_expired()
+
+    wall = time.perf_counter() - wall_start
+    tracing.remove_listener(timer)
+    writer.flush(timeout=30)
+
+    sim_seconds = max((source.duration for source in sources), default=0.0)
+    latencies.sort()
+    summary = {
+        "output": output_path,
+        "gating": args.gating,
+        "sources": [{
+            "camera_id": source.camera_id,
+            "path": source.path,
+            "frames_read": source.frames_read,
+            "frames_decoded": source.frames_decoded,
+            "duration_s": round(source.duration, 3),
+        } for source in sources],
+        **stats,
+        "decisions": decisions,
+        "incidents": incident_tracker.get_stats(),
+        "sim_seconds": round(sim_seconds, 3),
+        "wall_seconds": round(wall, 3),
+        "speedup": round(sim_seconds / wall, 2) if wall > 0 else None,
+        "latency_mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "latency_p95_ms": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3) if latencies else None,
+        "stages": timer.summary(),
+    }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放录制的视频/图片，输出逐帧决策与各阶段耗时")
+    parser.add_argument("inputs", nargs="+", help="视频文件或图片目录（可多个，按同一起始时间对齐）")
+    parser.add_argument("--camera", action="append", help="各输入对应的摄像头ID（按顺序，默认取文件名）")
+    parser.add_argument("--gating", choices=("adaptive", "interval"), default="adaptive")
+    parser.add_argument("--interval", type=float, default=config.INFER_INTERVAL,
+                        help="interval 门控的推理间隔（录制时间，秒）")
+    parser.add_argument("--sample-fps", type=float, default=config.DISPLAY_FPS,
+                        help="视频解码取帧率（运动检测与推理候选帧），0 表示解码全部帧")
+    parser.add_argument("--image-fps", type=float, default=1.0, help="图片目录的等效帧率")
+    parser.add_argument("--start", help="录制起始时间（ISO 格式，默认当前时间）")
+    parser.add_argument("--output", help="决策记录输出路径（JSON Lines，默认 data/replay_时间.jsonl）")
+    parser.add_argument("--all-frames", action="store_true", help="被门控跳过的帧也输出记录")
+    parser.add_argument("--workspace", help="独立工作目录（报警图片、事件库、知识库案例不写入线上目录）")
+    parser.add_argument("--sound", action="store_true", help="回放时播放报警声音")
+    args = parser.parse_args()
+
+    summary = replay(args)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# roi.py
+"""
+感兴趣区域（ROI）
+
+按摄像头配置的多边形区域（config.CAMERAS[camera_id]["rois"]，坐标为相对画面宽高的比例）：
+  - 送检画面：crops 模式每个区域一张裁剪图，mosaic 模式各区域拼成一张带编号的图，
+    总像素不超过 VISION_PIXEL_BUDGET；禁区裁剪时遮挡区域外的部分，区域内有人即在禁区内
+  - 禁区判定：有人员框时按脚底点是否落在禁区多边形内判定，有区域裁剪的逐区域回答时按区域判定，
+    都没有时才采用视觉模型对“是否进入禁区”的判断
+"""
+import base64
+import math
+
+import cv2
+import numpy as np
+
+import config
+from frames import encode_image
+
+KINDS = {"restricted": "禁区", "entry": "出入口", "focus": "关注区域"}
+_MASK_COLOR = 128
+
+
+class Region:
+    """一个多边形区域（坐标为相对画面宽高的比例）"""
+
+    __slots__ = ("index", "name", "kind", "polygon")
+
+    def __init__(self, index, name, kind, polygon):
+        self.index = index
+        self.name = name
+        self.kind = kind if kind in KINDS else "focus"
+        self.polygon = np.clip(np.asarray(polygon, dtype=np.float32).reshape(-1, 2), 0.0, 1.0)
+        if len(self.polygon) < 3:
+            raise ValueError(f"区域 {name} 至少需要3个顶点")
+
+    @property
+    def restricted(self):
+        return self.kind == "restricted"
+
+    def bbox(self, width, height, padding=0.0):
+        """区域外接矩形（像素坐标，含边距）"""
+        x0, y0 = self.polygon.min(axis=0) - padding
+        x1, y1 = self.polygon.max(axis=0) + padding
+        return (max(int(x0 * width), 0), max(int(y0 * height), 0),
+                min(int(math.ceil(x1 * width)), width), min(int(math.ceil(y1 * height)), height))
+
+    def contains(self, x, y):
+        """点（相对坐标）是否在区域内（含边界）"""
+        return cv2.pointPolygonTest(self.polygon, (float(x), float(y)), False) >= 0
+
+    def describe(self):
+        return f"{self.index}. {self.name}（{KINDS[self.kind]}）"
+
+
+_regions = {}
+
+
+def regions(camera_id):
+    """摄像头配置的区域（解析一次后缓存）"""
+    camera_id = camera_id or config.DEFAULT_CAMERA
+    if camera_id not in _regions:
+        _regions[camera_id] = [
+            Region(index, roi.get("name") or f"区域{index}", roi.get("type"), roi["polygon"])
+            for index, roi in enumerate(config.camera_setting(camera_id, "rois") or [], 1)
+        ]
+    return _regions[camera_id]
+
+
+def input_mode(camera_id):
+    """本摄像头送检画面的方式（未配置区域时总是整帧）"""
+    mode = config.camera_setting(camera_id, "vision_input", config.VISION_INPUT)
+    return mode if mode in ("crops", "mosaic") and regions(camera_id) else "full"
+
+
+def _crop(image, region):
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = region.bbox(width, height, config.ROI_PADDING)
+    crop = image[y0:y1, x0:x1]
+    if region.restricted:
+        # 遮挡禁区外的部分，裁剪图中出现的人员即位于禁区内
+        mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+        points = np.round(region.polygon * (width, height) - (x0, y0)).astype(np.int32)
+        cv2.fillPoly(mask, [points], 255)
+        crop = crop.copy()
+        crop[mask == 0] = _MASK_COLOR
+    return crop
+
+
+def _fit(size, budget):
+    """按像素预算缩小（不放大）"""
+    width, height = size
+    scale = min(1.0, math.sqrt(budget / float(width * height)))
+    return max(int(width * scale), 16), max(int(height * scale), 16)
+
+
+def _mosaic(crops):
+    """把各区域裁剪图按网格拼成一张图，每格左上角标注区域编号"""
+    count = len(crops)
+    cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    total = sum(c.shape[0] * c.shape[1] for c in crops)
+    width, height = config.FRAME_SIZE
+    width, height = _fit((width, height), min(config.VISION_PIXEL_BUDGET, total))
+    cell_w, cell_h = width // cols, height // rows
+    canvas = np.full((cell_h * rows, cell_w * cols, 3), _MASK_COLOR, dtype=np.uint8)
+    for i, crop in enumerate(crops):
+        row, col = divmod(i, cols)
+        scale = min(cell_w / crop.shape[1], cell_h / crop.shape[0])
+        w, h = max(int(crop.shape[1] * scale), 1), max(int(crop.shape[0] * scale), 1)
+        x, y = col * cell_w + (cell_w - w) // 2, row * cell_h + (cell_h - h) // 2
+        canvas[y:y + h, x:x + w] = cv2.resize(crop, (w, h), interpolation=cv2.INTER_AREA)
+        cv2.rectangle(canvas, (col * cell_w, row * cell_h), (col * cell_w + 24, row * cell_h + 22), (0, 0, 0), -1)
+        cv2.putText(canvas, str(i + 1), (col * cell_w + 5, row * cell_h + 17),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return canvas
+
+
+def vision_images(frame, camera_id):
+    """
+    按区域送检的图片（Base64 列表）：crops 模式每个区域一张（顺序与 regions() 相同），mosaic 模式一张拼图
+    只在 input_mode() 不为 full 时使用
+    """
+    crops = [_crop(frame.image, region) for region in regions(camera_id)]
+    if input_mode(camera_id) == "mosaic":
+        images = [_mosaic(crops)]
+    else:
+        # 所有裁剪图按同一比例缩小到总像素预算以内
+        total = sum(c.shape[0] * c.shape[1] for c in crops)
+        ratio = min(1.0, config.VISION_PIXEL_BUDGET / float(total))
+        images = []
+        for crop in crops:
+            size = _fit((crop.shape[1], crop.shape[0]), crop.shape[0] * crop.shape[1] * ratio)
+            images.append(crop if ratio >= 1.0 else cv2.resize(crop, size, interpolation=cv2.INTER_AREA))
+    encoded = [
+        base64.b64encode(encode_image(image, (image.shape[1], image.shape[0]), config.MODEL_JPEG_QUALITY)).decode()
+        for image in images
+    ]
+    return encoded
+
+
+def prompt_suffix(camera_id, camera_regions):
+    """按区域送检时追加在视觉提示词后的说明"""
+    if not camera_regions:
+        return ""
+    if input_mode(camera_id) == "mosaic":
+        layout = "输入是一张拼接图，每格左上角的编号对应以下区域"
+    else:
+        layout = "输入是按以下顺序排列的多张区域裁剪图"
+    return (
+        f"\n{layout}（禁区图中灰色部分为禁区以外，已遮挡）：\n"
+        + "\n".join(region.describe() for region in camera_regions)
+        + '\n额外输出 "regions" 字段，按编号逐个给出：'
+        '[{"index": 编号, "has_person": true/false, "person_count": 数量, '
+        '"badge_status": "佩戴" / "未佩戴" / "无法确认" / "不适用"}]\n'
+    )
+
+
+def zones_at(camera_id, x, y):
+    """包含该点（相对坐标）的区域"""
+    return [region for region in regions(camera_id) if region.contains(x, y)]
+
+
+def restricted_hits(camera_id, boxes):
+    """
+    人员框（相对坐标 x0, y0, x1, y1）中脚底点落在禁区内的：返回禁区名称列表（去重）
+    """
+    names = []
+    for x0, y0, x1, y1 in boxes:
+        for region in zones_at(camera_id, (x0 + x1) / 2.0, y1):
+            if region.restricted and region.name not in names:
+                names.append(region.name)
+    return names
+
+
+def apply_region_facts(facts, camera_regions):
+    """
+    用逐区域的回答修正视觉事实：禁区是否有人按区域判定（禁区外已遮挡），
+    任一区域有人时 has_person 为 true。模型漏答某个禁区时保留模型的整体判断。
+    """
+    if not camera_regions or not isinstance(facts, dict):
+        return facts
+    answers = {}
+    for item in facts.get("regions") or []:
+        try:
+            answers[int(item.get("index"))] = item
+        except (AttributeError, TypeError, ValueError):
+            continue
+    if any(answer.get("has_person") for answer in answers.values()):
+        facts["has_person"] = True
+
+    restricted = [region for region in camera_regions if region.restricted]
+    if restricted and all(region.index in answers for region in restricted):
+        inside = [region.name for region in restricted if answers[region.index].get("has_person")]
+        facts["enter_restricted_area"] = bool(inside)
+        facts["restricted_zones"] = inside
+        facts["restricted_area_source"] = "roi"
+    return facts
@@ -0,0 +1,225 @@
+# roles.py
+"""
+角色启动
+
+系统拆分为三种角色，通过消息总线（bus.py）连接，可以同进程运行（默认），也可以拆到不同进程/主机：
+  capture    采集与推理门控：每路摄像头解码、运动检测、按推理间隔把帧发布到总线
+  inference  视觉模型、知识库检索、推理模型、报警事件聚合、知识库写入
+  api        FastAPI：推流、WebSocket 推送、查询接口（由 main.py 承担）
+
+本进程的角色由环境变量 APP_ROLES 指定。拆分部署示例（Redis Streams）：
+  APP_ROLES=capture   BUS_BACKEND=redis python roles.py
+  APP_ROLES=inference BUS_BACKEND=redis python roles.py
+  APP_ROLES=api       BUS_BACKEND=redis uvicorn main:app
+使用 ZeroMQ 时先运行代理：python bus.py broker
+"""
+import threading
+import time
+
+import config
+from bus import get_bus
+from logs import get_logger
+
+log = get_logger("roles")
+
+
+def _cameras(selected):
+    return [camera_id for camera_id in config.CAMERAS if selected is None or camera_id in selected]
+
+
+def _start_thread(target, name):
+    thread = threading.Thread(target=target, daemon=True, name=name)
+    thread.start()
+    return thread
+
+
+# ---------- capture ----------
+
+def start_capture_role():
+    """启动本进程负责的摄像头采集"""
+    from decoder import start_capture
+
+    cameras = _cameras(config.CAPTURE_CAMERAS)
+    for camera_id in cameras:
+        start_capture(camera_id)
+    if not config.has_role("inference"):
+        _start_thread(_scheduler_feedback, "Scheduler-Feedback")
+    mode = "独立进程" if config.DECODE_IN_SUBPROCESS else "线程"
+    print(f"【INFO】已启动 {len(cameras)} 路摄像头采集（{mode}解码）")
+
+
+def stop_capture_role():
+    """停止本进程的解码子进程并释放共享内存中的帧缓冲"""
+    from decoder import stop_all
+
+    stop_all()
+
+
+def _scheduler_feedback():
+    """推理在其他进程时，用总线上的推理决策更新本地调度器（推理耗时、是否报警）"""
+    from scheduler import scheduler
+
+    for _, data, _ in get_bus().subscribe("decisions."):
+        try:
+            scheduler.finish(data["camera_id"], data["latency"], data.get("is_alarm") == "是")
+        except Exception as e:
+            log.warning("更新推理调度失败: %s", e)
+
+
+def dispatch_frame(frame, camera_id, last_infer_time_ref):
+    """门控通过的帧：推理在本进程时直接提交，否则发布到总线"""
+    if config.has_role("inference"):
+        from model_infer import try_infer
+        try_infer(frame, last_infer_time_ref, camera_id)
+        return
+    last_infer_time_ref[0] = time.time()
+    # 采集尺寸大于模型输入时（配置了 ROI 裁剪）按采集尺寸发送，推理侧裁剪时保留细节
+    height, width = frame.image.shape[:2]
+    if (width, height) == tuple(config.FRAME_SIZE):
+        payload = frame.model_jpeg()
+    else:
+        payload = frame.encoded((width, height), config.MODEL_JPEG_QUALITY)
+    get_bus().publish(f"frames.{camera_id}", {
+        "camera_id": camera_id,
+        "timestamp": frame.timestamp,
+        "seq": frame.seq,
+    }, payload)
+
+
+def publish_video(frame, camera_id):
+    """API 在其他进程时，把推流画面发布到总线"""
+    get_bus().publish(f"video.{camera_id}", {
+        "camera_id": camera_id,
+        "timestamp": frame.timestamp,
+        "seq": frame.seq,
+    }, frame.stream_jpeg())
+
+
+# ---------- inference ----------
+
+def start_inference_role():
+    """启动推理角色：后台预热模型与知识库、事件超时清理，采集在其他进程时订阅总线上的帧"""
+    from incidents import incident_tracker
+    from lifecycle import lifecycle, register_defaults
+
+    if config.STARTUP_WARMUP:
+        register_defaults()
+        lifecycle.start()
+    incident_tracker.start_sweeper()
+    if not config.has_role("capture"):
+        _start_thread(_consume_frames, "Frame-Consumer")
+    elif config.DETECTOR_ENABLED and config.TRACKING_ENABLED:
+        # 帧缓冲在本进程时后台持续跟踪，两次推理之间目标也能保持关联
+        from tracker import tracker
+        tracker.start(_cameras(config.INFERENCE_CAMERAS))
+
+
+def _consume_frames():
+    from frames import Frame
+    from model_infer import try_infer
+
+    cameras = config.INFERENCE_CAMERAS
+    prefixes = ["frames."] if cameras is None else [f"frames.{camera_id}" for camera_id in cameras]
+    # 负责全部摄像头的推理主机共用一个消费组分摊帧；按摄像头分配时组名包含摄像头集合，
+    # 只与负责相同摄像头的主机分摊，不会读走其他主机负责的摄像头的帧
+    group = config.INFERENCE_GROUP if cameras is None else \
+        f"{config.INFERENCE_GROUP}:{','.join(sorted(cameras))}"
+    subscription = get_bus().subscribe(prefixes, group=group)
+    last_infer = {}
+    print(f"【INFO】推理角色已订阅: {', '.join(prefixes)}")
+
+    for _, data, payload in subscription:
+        camera_id = data["camera_id"]
+        if cameras is not None and camera_id not in cameras:
+            continue
+        try:
+            frame = Frame.from_jpeg(payload, data.get("timestamp"), data.get("seq", 0))
+        except Exception as e:
+            log.warning("无法解码总线上的帧: %s", e, extra={"camera_id": camera_id})
+            continue
+        # 推理繁忙时 try_infer 直接放弃该帧（帧时效性强，不排队）
+        try_infer(frame, last_infer.setdefault(camera_id, [0.0]), camera_id)
+
+
+# ---------- api ----------
+
+def start_video_relay():
+    """采集在其他进程时，把总线上的推流画面写入本进程的帧缓冲，供 /video_feed 使用"""
+    from frames import EncodedFrame, LatestFrameBuffer
+
+    buffers = {}
+    for camera_id in config.CAMERAS:
+        buffers[camera_id] = config.frame_buffers[camera_id] = LatestFrameBuffer()
+
+    def _run():
+        for _, data, payload in get_bus().subscribe("video."):
+            buffer = buffers.get(data["camera_id"])
+            if buffer is not None:
+                buffer.put(EncodedFrame(payload, data["timestamp"], data["seq"]))
+
+    _start_thread(_run, "Video-Relay")
+
+
+_role_lock = None
+
+
+def _elect():
+    """
+    同一主机上的多个 API worker（uvicorn --workers）共用同一份配置，
+    通过文件锁保证只有一个 worker 运行采集/推理角色，其余 worker 只负责推送
+    """
+    global _role_lock
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    lock = open(config.ROLE_LOCK_FILE, "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _role_lock = lock  # 进程存活期间保持锁
+    return True
+
+
+def start_roles(elect=False):
+    """
+    按 APP_ROLES 启动本进程的 capture / inference 角色（api 角色由 main.py 启动）
+    elect: 由 API worker 调用时为 True，多个 worker 中只有一个运行采集/推理
+    """
+    if elect and (config.has_role("capture") or config.has_role("inference")) and not _elect():
+        config.ROLES.difference_update({"capture", "inference"})
+        if config.BUS_BACKEND == "inprocess":
+            log.error("多个 worker 时进程内总线无法跨进程传递报警和画面，请设置 BUS_BACKEND=redis 或 zmq")
+    print(f"【INFO】本进程角色: {', '.join(sorted(config.ROLES))}，消息总线: {config.BUS_BACKEND}")
+    if config.has_role("inference"):
+        start_inference_role()
+    if config.has_role("capture"):
+        start_capture_role()
+    if config.has_role("api") and not config.has_role("capture"):
+        start_video_relay()
+
+
+def stop_roles():
+    """关闭本进程的角色（由 main.py 的关闭事件和独立运行时的退出路径调用）"""
+    if config.has_role("capture"):
+        stop_capture_role()
+
+
+if __name__ == "__main__":
+    import signal
+    import sys
+
+    if config.has_role("api"):
+        raise SystemExit("api 角色请使用 uvicorn main:app 启动")
+    # 容器停止时发送 SIGTERM，转为正常退出以执行下面的清理
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    start_roles()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_roles()
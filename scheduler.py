@@ -0,0 +1,187 @@
+# scheduler.py
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+
+
+class CameraActivity:
+    """单路摄像头的推理调度状态"""
+
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.interval = config.INFER_INTERVAL
+        self.quiet_streak = 0          # 连续无活动的推理次数
+        self.last_alarm_time = 0.0
+        self.last_motion_time = 0.0
+        self.motion_score = 0.0
+        self.prev_thumb = None
+        self.in_flight = False
+
+
+class AdaptiveScheduler:
+    """
+    自适应推理间隔控制器
+
+    每路摄像头的目标间隔由场景活动决定：报警后降到下限，检测到运动时缩短，
+    持续安静时逐步放大到上限。所有摄像头的推理频率之和再受全局模型容量约束
+    （并发数 / 平均推理耗时），超出时按比例拉长各路间隔，避免增加摄像头后延迟失控。
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.latency = None  # 推理耗时的指数滑动平均（秒）
+        self.cameras = {camera_id: CameraActivity(camera_id) for camera_id in config.CAMERAS}
+        self.skipped = 0     # 因容量已满而放弃的推理次数
+        self._lock = threading.Lock()
+        self._last_rebalance = 0.0
+
+    def _camera(self, camera_id):
+        camera = self.cameras.get(camera_id)
+        if camera is None:
+            camera = self.cameras.setdefault(camera_id, CameraActivity(camera_id))
+        return camera
+
+    def _bounds(self, camera_id):
+        low = config.camera_setting(camera_id, "infer_interval_min", config.INFER_INTERVAL_MIN)
+        high = config.camera_setting(camera_id, "infer_interval_max", config.INFER_INTERVAL_MAX)
+        return low, high
+
+    def _max_quiet_streak(self, camera_id):
+        """安静间隔放大到上限所需的连续安静次数（在对数空间计算，避免求幂溢出）"""
+        base = config.camera_setting(camera_id, "infer_interval", config.INFER_INTERVAL)
+        _, high = self._bounds(camera_id)
+        factor = config.QUIET_BACKOFF_FACTOR
+        if factor <= 1.0 or base <= 0 or high <= base:
+            return 0
+        return math.ceil(math.log(high / base) / math.log(factor))
+
+    # ---------- 输入信号 ----------
+
+    def observe_frame(self, camera_id, frame):
+        """用低分辨率灰度图的帧差估计画面运动"""
+        if not config.ADAPTIVE_INFER:
+            return
+        thumb = frame.motion_thumb()
+        camera = self._camera(camera_id)
+        prev = camera.prev_thumb
+        camera.prev_thumb = thumb
+        if prev is None:
+            return
+
+        diff = cv2.absdiff(thumb, prev)
+        camera.motion_score = float(np.count_nonzero(diff > config.MOTION_PIXEL_DELTA)) / diff.size
+        if camera.motion_score >= config.MOTION_THRESHOLD:
+            was_quiet = self.clock() - camera.last_motion_time > config.MOTION_HOLD_SECONDS
+            camera.last_motion_time = self.clock()
+            camera.quiet_streak = 0
+            if was_quiet:
+                # 从安静转为有运动，立即缩短间隔
+                self._rebalance()
+
+    def begin(self, camera_id):
+        """申请一次推理；同一摄像头已有推理在进行时返回False"""
+        with self._lock:
+            camera = self._camera(camera_id)
+            if camera.in_flight:
+                return False
+            camera.in_flight = True
+            return True
+
+    def cancel(self, camera_id):
+        """推理未能启动（如后端容量已满）"""
+        with self._lock:
+            self._camera(camera_id).in_flight = False
+            self.skipped += 1
+
+    def finish(self, camera_id, latency, is_alarm=False):
+        """一次推理结束，更新耗时估计和场景活动"""
+        now = self.clock()
+        with self._lock:
+            camera = self._camera(camera_id)
+            camera.in_flight = False
+
+            if self.latency is None:
+                self.latency = latency
+            else:
+                alpha = config.LATENCY_EWMA_ALPHA
+                self.latency = alpha * latency + (1 - alpha) * self.latency
+
+            if is_alarm:
+                camera.last_alarm_time = now
+                camera.quiet_streak = 0
+            elif now - camera.last_motion_time > config.MOTION_HOLD_SECONDS:
+                # 间隔到达上限后不再累加
+                camera.quiet_streak = min(camera.quiet_streak + 1, self._max_quiet_streak(camera_id))
+
+        self._rebalance()
+
+    # ---------- 间隔计算 ----------
+
+    def _target(self, camera, now):
+        """不考虑容量时该摄像头期望的间隔"""
+        base = config.camera_setting(camera.camera_id, "infer_interval", config.INFER_INTERVAL)
+        low, high = self._bounds(camera.camera_id)
+
+        if now - camera.last_alarm_time < config.ALARM_BOOST_SECONDS:
+            target = low
+        elif now - camera.last_motion_time < config.MOTION_HOLD_SECONDS:
+            target = base * config.MOTION_INTERVAL_FACTOR
+        else:
+            streak = min(camera.quiet_streak, self._max_quiet_streak(camera.camera_id))
+            target = base * config.QUIET_BACKOFF_FACTOR ** streak
+
+        return min(max(target, low), high)
+
+    def _rebalance(self):
+        now = self.clock()
+        with self._lock:
+            self._last_rebalance = now
+            targets = {cid: self._target(cam, now) for cid, cam in self.cameras.items()}
+
+            # 全局容量预算：每秒可完成的推理数
+            scale = 1.0
+            if self.latency:
+                capacity = config.MODEL_CONCURRENCY / self.latency * config.MODEL_UTILIZATION_TARGET
+                demand = sum(1.0 / t for t in targets.values())
+                if demand > capacity:
+                    scale = demand / capacity
+
+            for cid, target in targets.items():
+                # 容量约束只会拉长间隔（因此总不低于下限），但不超过上限
+                _, high = self._bounds(cid)
+                self.cameras[cid].interval = min(target * scale, high)
+
+    def interval(self, camera_id):
+        """当前推理间隔（秒）"""
+        if not config.ADAPTIVE_INFER:
+            return config.camera_setting(camera_id, "infer_interval", config.INFER_INTERVAL)
+        if self.clock() - self._last_rebalance > 1.0:
+            # 报警/运动保持期会随时间结束，定期重新计算
+            self._rebalance()
+        return self._camera(camera_id).interval
+
+    def get_stats(self):
+        """获取调度统计信息"""
+        return {
+            "adaptive": config.ADAPTIVE_INFER,
+            "avg_latency": round(self.latency, 3) if self.latency else None,
+            "skipped": self.skipped,
+            "cameras": {
+                cid: {
+                    "interval": round(self.interval(cid), 2),
+                    "motion_score": round(cam.motion_score, 4),
+                    "quiet_streak": cam.quiet_streak,
+                    "in_flight": cam.in_flight,
+                }
+                for cid, cam in list(self.cameras.items())
+            }
+        }
+
+
+# 全局调度器实例
+scheduler = AdaptiveScheduler()
@@ -0,0 +1,160 @@
+# schemas.py
+"""
+模型输出结构（JSON Schema）
+
+调用 Ollama 时作为 format 参数传入，模型按结构约束解码，只能生成符合结构的 JSON；
+解析后再按同一结构校验（只支持这里用到的 type / enum / required / properties / items / 数值范围）。
+旧版 Ollama 不支持结构化输出或输出不符合结构时，调用方走原来的修复路径（fix_json_output.py）。
+"""
+import json
+
+import metrics
+from logs import get_logger
+
+log = get_logger("schemas")
+
+BADGE_STATUS = ["佩戴", "未佩戴", "无法确认", "不适用"]
+
+VISION_FACTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "has_person": {"type": "boolean"},
+        "badge_status": {"type": "string", "enum": BADGE_STATUS},
+        "enter_restricted_area": {"type": "boolean"},
+        "has_fire_or_smoke": {"type": "boolean"},
+        "has_electric_risk": {"type": "boolean"},
+        "scene_summary": {"type": "string"},
+        "object_details": {
+            "type": "object",
+            "properties": {
+                "person_count": {"type": "integer", "minimum": 0},
+                "person_positions": {"type": "array", "items": {"type": "string"}},
+                "environment_status": {"type": "string"},
+            },
+            "required": ["person_count", "person_positions", "environment_status"],
+        },
+    },
+    "required": ["has_person", "badge_status", "enter_restricted_area", "has_fire_or_smoke",
+                 "has_electric_risk", "scene_summary", "object_details"],
+}
+
+# 按区域送检时逐区域的回答（见 roi.prompt_suffix）
+_REGIONS = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index": {"type": "integer"},
+            "has_person": {"type": "boolean"},
+            "person_count": {"type": "integer", "minimum": 0},
+            "badge_status": {"type": "string", "enum": BADGE_STATUS},
+        },
+        "required": ["index", "has_person", "person_count", "badge_status"],
+    },
+}
+
+# 目标跟踪时逐人的回答（见 tracker.CameraTracker.prompt_hint）
+_PERSONS = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index": {"type": "integer"},
+            "badge_status": {"type": "string", "enum": BADGE_STATUS[:3]},
+            "in_restricted_area": {"type": "boolean"},
+        },
+        "required": ["index", "badge_status", "in_restricted_area"],
+    },
+}
+
+DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "final_decision": {
+            "type": "object",
+            "properties": {
+                "is_alarm": {"type": "string", "enum": ["是", "否"]},
+                "alarm_level": {"type": "string", "enum": ["无", "一般", "严重", "紧急"]},
+                "alarm_reason": {"type": "string"},
+                "confidence": {"type": "number", "minimum": 0.0, "maximum": 1.0},
+            },
+            "required": ["is_alarm", "alarm_level", "alarm_reason", "confidence"],
+        },
+        "analysis": {
+            "type": "object",
+            "properties": {
+                "risk_assessment": {"type": "string"},
+                "recommendation": {"type": "string"},
+                "rules_applied": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["risk_assessment", "recommendation", "rules_applied"],
+        },
+    },
+    "required": ["final_decision", "analysis"],
+}
+
+
+def vision_schema(regions=False, persons=False):
+    """本次视觉调用的输出结构：按区域送检、目标跟踪时分别要求 regions / persons 字段"""
+    if not regions and not persons:
+        return VISION_FACTS_SCHEMA
+    schema = dict(VISION_FACTS_SCHEMA, properties=dict(VISION_FACTS_SCHEMA["properties"]),
+                  required=list(VISION_FACTS_SCHEMA["required"]))
+    for name, field, enabled in (("regions", _REGIONS, regions), ("persons", _PERSONS, persons)):
+        if enabled:
+            schema["properties"][name] = field
+            schema["required"].append(name)
+    return schema
+
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "integer": int,
+    "number": (int, float),
+}
+
+
+def validate(value, schema, path="$"):
+    """按结构校验，返回错误列表（为空表示符合）"""
+    expected = schema.get("type")
+    if expected is not None:
+        # bool 是 int 的子类，不能当作数值
+        if not isinstance(value, _TYPES[expected]) or (expected in ("integer", "number") and isinstance(value, bool)):
+            return [f"{path}: 应为 {expected}"]
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} 不在 {schema['enum']} 中")
+    if "minimum" in schema and value < schema["minimum"]:
+        errors.append(f"{path}: 小于 {schema['minimum']}")
+    if "maximum" in schema and value > schema["maximum"]:
+        errors.append(f"{path}: 大于 {schema['maximum']}")
+    if isinstance(value, dict):
+        for name in schema.get("required", ()):
+            if name not in value:
+                errors.append(f"{path}.{name}: 缺少字段")
+        for name, field in schema.get("properties", {}).items():
+            if name in value:
+                errors.extend(validate(value[name], field, f"{path}.{name}"))
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def parse(text, schema, model):
+    """
+    解析结构化输出：是合法 JSON 且符合结构时返回解析结果，否则返回 None（由调用方走修复路径）
+    """
+    try:
+        value = json.loads(text)
+        errors = validate(value, schema)
+    except ValueError as e:
+        errors = [f"不是有效的 JSON: {e}"]
+    if not errors:
+        metrics.STRUCTURED_OUTPUT.inc(model=model, result="valid")
+        return value
+    log.warning("模型输出不符合结构，改用修复解析", extra={"model": model, "errors": errors[:5]})
+    return None
@@ -2,8 +2,11 @@ from playsound import playsound
 import threading
 from config import ALARM_SOUNDS, sound_lock
 import os
+import config
 
 def play_alarm_sound(level: str):
+    if not config.ALARM_SOUND_ENABLED:
+        return
     sound_path = ALARM_SOUNDS.get(level)
     if not sound_path or not os.path.exists(sound_path):
         return
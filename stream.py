@@ -3,39 +3,174 @@ import cv2
 import numpy as np
 import time
 import config  # 改为导入整个模块
+import metrics
+
+_waiting_jpeg = None
+
+# 各档位（及格式）最近编码结果的平均字节数，用于估算各档位所需带宽
+_frame_bytes = {}
+_BYTES_PER_PIXEL = 0.15  # 尚无实测时的估算值
+_ALPHA = 0.2
+
+
+def _waiting_placeholder():
+    """等待画面的JPEG（只编码一次）"""
+    global _waiting_jpeg
+    if _waiting_jpeg is None:
+        width, height = config.STREAM_SIZE
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        cv2.putText(frame, "Waiting...", (80, 140),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        _, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, config.STREAM_JPEG_QUALITY])
+        _waiting_jpeg = buf.tobytes()
+    return _waiting_jpeg
+
+
+def record_frame_size(level, nbytes, fmt="jpeg"):
+    key = (level, fmt)
+    previous = _frame_bytes.get(key)
+    _frame_bytes[key] = nbytes if previous is None else previous + (nbytes - previous) * _ALPHA
+
+
+def frame_size(level, fmt="jpeg"):
+    """某档位一帧的估计字节数"""
+    nbytes = _frame_bytes.get((level, fmt))
+    if nbytes is None:
+        (width, height), _ = config.STREAM_LADDER[level]
+        nbytes = width * height * _BYTES_PER_PIXEL
+    return nbytes
+
+
+def stream_fps(fps, view="full"):
+    """客户端请求的帧率（为空时按画面类型取默认值，且不超过上限）"""
+    try:
+        fps = float(fps or 0)
+    except (TypeError, ValueError):
+        fps = 0
+    if fps <= 0:
+        fps = config.STREAM_FPS_GRID if view == "grid" else config.STREAM_FPS_DEFAULT
+    return min(fps, config.STREAM_FPS_MAX)
+
+
+class Link:
+    """一个客户端连接的发送吞吐估计（字节/秒，EWMA），连接上的各路画面共享"""
+
+    def __init__(self):
+        self.rate = None
+        self.selectors = []
+
+    def observe(self, nbytes, seconds):
+        # 发送在数据写入连接缓冲后返回，缓冲满（链路跟不上）时才会等待，耗时因此反映链路能力
+        rate = nbytes / max(seconds, 0.001)
+        self.rate = rate if self.rate is None else self.rate + (rate - self.rate) * _ALPHA
+
+    def demand(self, exclude=None):
+        """连接上其他画面按当前档位所需的带宽（字节/秒）"""
+        return sum(s.demand() for s in self.selectors if s is not exclude)
+
+
+class LevelSelector:
+    """
+    一路画面的档位选择
+
+    level 为 None 或 "auto" 时在画面类型（grid / full）的档位范围内自动选择：
+    从最低档开始，按连接的实测吞吐选择能容纳的最高档；降档间隔不小于 STREAM_ADAPT_DOWN_INTERVAL 秒，
+    升档需要在当前档位保持 STREAM_ADAPT_UP_INTERVAL 秒，避免来回切换。
+    发送方积压（上一帧未发完）时强制降一档。
+    """
+
+    def __init__(self, link, fps, view="full", level=None, fmt="jpeg"):
+        names = list(config.STREAM_LADDER)
+        if level in config.STREAM_LADDER:
+            low = high = level
+        else:
+            low, high = config.STREAM_VIEW_LEVELS.get(view, config.STREAM_VIEW_LEVELS["full"])
+        self.levels = names[names.index(low):names.index(high) + 1]
+        self.auto = len(self.levels) > 1
+        self.index = 0
+        self.link = link
+        self.fps = fps
+        self.fmt = fmt
+        self.congested = False
+        self.changed_at = 0.0  # 首次得到吞吐估计后立即选择档位
+        link.selectors.append(self)
+
+    @property
+    def level(self):
+        return self.levels[self.index]
+
+    def demand(self):
+        return frame_size(self.level, self.fmt) * self.fps
+
+    def close(self):
+        if self in self.link.selectors:
+            self.link.selectors.remove(self)
+
+    def update(self, now=None):
+        """每发出一帧后调用，按最新的吞吐估计调整档位"""
+        if not self.auto or self.link.rate is None:
+            return
+        now = now if now is not None else time.monotonic()
+        budget = self.link.rate * config.STREAM_ADAPT_HEADROOM - self.link.demand(exclude=self)
+        target = 0
+        for index, level in enumerate(self.levels):
+            if frame_size(level, self.fmt) * self.fps <= budget:
+                target = index
+        if self.congested:
+            target = min(target, max(self.index - 1, 0))
+            self.congested = False
+
+        elapsed = now - self.changed_at
+        if (target < self.index and elapsed >= config.STREAM_ADAPT_DOWN_INTERVAL) or \
+                (target > self.index and elapsed >= config.STREAM_ADAPT_UP_INTERVAL):
+            metrics.STREAM_LEVEL_SWITCHES.inc(direction="down" if target < self.index else "up")
+            self.index = target
+            self.changed_at = now
+
+
+def generate_frames(camera_id=None, level=None, fps=None):
+    """
+    MJPEG 推流
+    level: 档位名（见 config.STREAM_LADDER）；为 None 或 "auto" 时按本连接的发送吞吐自动选择
+    fps: 推送帧率，为 None 时取 STREAM_FPS_DEFAULT
+    """
+    camera_id = camera_id or config.DEFAULT_CAMERA
+    frame_buffer = config.frame_buffers[camera_id]
+
+    target_frame_time = 1.0 / stream_fps(fps)
+    selector = LevelSelector(Link(), 1.0 / target_frame_time, "full", level)
+    last_seq = 0
 
-def generate_frames():
-    from config import frame_buffer
-    
-    target_fps = 20
-    target_frame_time = 1.0 / target_fps
-    
     while True:
         start_time = time.time()
-        
-        # 从双缓冲读取（无锁读取）
-        frame_copy = frame_buffer.read()
-        
-        if frame_copy is None:
-            # 尝试从旧版变量读取
-            with config.latest_frame_lock:
-                frame_copy = config.latest_frame.copy() if config.latest_frame is not None else None
-        
-        if frame_copy is None:
-            frame = np.zeros((270, 480, 3), dtype=np.uint8)
-            cv2.putText(frame, "Waiting...", (80, 140),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+
+        # 等待新帧（事件驱动，无新帧时最多等待1秒后重发当前画面）
+        frame = frame_buffer.wait_next(last_seq, timeout=1.0) or frame_buffer.read()
+
+        # 编码（同一帧同一档位只编码一次，多个客户端共享）
+        if frame is None:
+            jpeg = _waiting_placeholder()
         else:
-            frame = cv2.resize(frame_copy, (480, 270))
-        
-        # 编码
-        _, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        
+            size, quality = config.STREAM_LADDER[selector.level]
+            jpeg = frame.encoded(size, quality)
+            if not frame.valid:
+                # 编码期间槽位已被覆盖，丢弃本帧
+                metrics.FRAMES_DROPPED.inc(camera=camera_id, reason="stale")
+                continue
+            record_frame_size(selector.level, len(jpeg))
+            last_seq = frame.seq
+
+        sent = time.time()
         yield (b"--frame\r\n"
-               b"Content-Type: image/jpeg\r\n\r\n" + 
-               buf.tobytes() + b"\r\n")
-        
+               b"Content-Type: image/jpeg\r\n\r\n" +
+               jpeg + b"\r\n")
+
+        # 上一块数据发出后生成器才继续执行，这段时间即发送耗时
+        if frame is not None:
+            selector.link.observe(len(jpeg), time.time() - sent)
+            selector.update()
+
         # 控制帧率
         processing_time = time.time() - start_time
         if processing_time < target_frame_time:
-            time.sleep(target_frame_time - processing_time)
\ No newline at end of file
+            time.sleep(target_frame_time - processing_time)
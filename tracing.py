@@ -0,0 +1,255 @@
+# tracing.py
+import contextvars
+import json
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+
+import config
+from logs import get_logger
+
+log = get_logger("tracing")
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一个计时阶段"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "status")
+
+    def __init__(self, name, trace_id, span_id, parent_id=None, start=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round((self.end - self.start) * 1000, 3) if self.end else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """未启用追踪或不在 trace 内时使用，调用方无需判断"""
+
+    trace_id = None
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def root_span_id(trace_id):
+    """根 span 的ID由 trace ID 派生，跨线程/异步补记的 span 只凭 trace ID 即可挂到根上"""
+    return trace_id[:16]
+
+
+def current_trace_id():
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+@contextmanager
+def _activate(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.status = "error"
+        span.attributes["error"] = str(e)[:200]
+        raise
+    finally:
+        _current.reset(token)
+        span.end = time.time()
+        _export(span)
+
+
+@contextmanager
+def start_trace(name, start_time=None, **attributes):
+    """开始一个新的 trace（根 span），start_time 可取帧采集时间"""
+    if not config.TRACING_ENABLED:
+        yield _NOOP
+        return
+    trace_id = uuid.uuid4().hex
+    span = Span(name, trace_id, root_span_id(trace_id), start=start_time, attributes=attributes)
+    with _activate(span):
+        yield span
+
+
+@contextmanager
+def span(name, **attributes):
+    """在当前 trace 内记录一个子阶段；不在 trace 内时不记录"""
+    parent = _current.get()
+    if parent is None:
+        yield _NOOP
+        return
+    child = Span(name, parent.trace_id, uuid.uuid4().hex[:16], parent.span_id, attributes=attributes)
+    with _activate(child):
+        yield child
+
+
+def record_span(name, trace_id, start, end, parent_id=None, **attributes):
+    """补记已经结束的阶段（如排队等待、事件循环中的广播）"""
+    if not config.TRACING_ENABLED or not trace_id:
+        return
+    finished = Span(name, trace_id, uuid.uuid4().hex[:16],
+                    parent_id or root_span_id(trace_id), start=start, attributes=attributes)
+    finished.end = end
+    _export(finished)
+
+
+def bind(fn, name):
+    """把当前 trace 上下文带到其他线程执行（如后台写入器），并记录为一个 span"""
+    context = contextvars.copy_context()
+
+    def _run(*args, **kwargs):
+        def _traced():
+            with span(name):
+                return fn(*args, **kwargs)
+        return context.run(_traced)
+
+    return _run
+
+
+# ---------- 导出 ----------
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span):
+    result = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(int(span.start * 1e9)),
+        "endTimeUnixNano": str(int(span.end * 1e9)),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+        "status": {"code": 2 if span.status == "error" else 1},
+    }
+    if span.parent_id:
+        result["parentSpanId"] = span.parent_id
+    return result
+
+
+class OTLPExporter:
+    """按批次把 span 以 OTLP/HTTP JSON 格式发送到本地采集器，队列满或发送失败时丢弃"""
+
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint or config.TRACE_OTLP_ENDPOINT
+        self.queue = queue.Queue(maxsize=config.TRACE_EXPORT_BATCH * 20)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="Trace-Exporter")
+        self._thread.start()
+
+    def export(self, span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + config.TRACE_EXPORT_INTERVAL
+            while len(batch) < config.TRACE_EXPORT_BATCH:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": config.TRACE_SERVICE_NAME}}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "tracing"},
+                    "spans": [_otlp_span(span) for span in batch],
+                }],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            self.dropped += len(batch)
+            log.warning("发送到采集器失败，丢弃本批span: %s", e, extra={"spans": len(batch)})
+
+
+_otlp_exporter = None
+_exporter_lock = threading.Lock()
+_listeners = []
+
+
+def add_listener(fn):
+    """注册 span 结束回调（如离线回放统计各阶段耗时），回调在结束 span 的线程中执行"""
+    _listeners.append(fn)
+
+
+def remove_listener(fn):
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+
+def _sampled(trace_id):
+    """按 trace ID 采样（同一 trace 的所有 span 结果相同）"""
+    ratio = config.TRACE_SAMPLE_RATIO
+    return ratio >= 1.0 or int(trace_id[:8], 16) < ratio * 0x100000000
+
+
+def _export(span):
+    global _otlp_exporter
+    for listener in list(_listeners):
+        listener(span)
+    if config.TRACE_EXPORTER == "none" or not _sampled(span.trace_id):
+        return
+    if config.TRACE_EXPORTER == "file":
+        from persistence import writer
+        writer.append_text(config.TRACE_FILE, json.dumps(span.to_dict(), ensure_ascii=False) + "\n",
+                           max_bytes=config.TRACE_FILE_MAX_BYTES, backups=config.TRACE_FILE_BACKUPS)
+    elif config.TRACE_EXPORTER == "otlp":
+        if _otlp_exporter is None:
+            with _exporter_lock:
+                if _otlp_exporter is None:
+                    _otlp_exporter = OTLPExporter()
+        _otlp_exporter.export(span)
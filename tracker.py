@@ -0,0 +1,279 @@
+# tracker.py
+"""
+目标跟踪（需要启用本地预检测）
+
+按 IoU 把相邻帧的检测框关联成跟踪目标并分配编号，工牌、禁区结论按目标缓存：
+  - 视觉大模型按编号逐个回答每名人员的工牌与禁区情况，结论记在对应目标上
+  - 画面中的人员都有未过期的结论、且没有进出区域（按脚底点所在的 ROI 区域判断）时，
+    直接用缓存的结论组成视觉事实，不再调用视觉大模型；出现新目标、目标进出区域、
+    结论超过 TRACK_VERDICT_TTL 或检测到烟火时才重新调用
+  - 人员集合与上次完整推理相同时沿用上次的推理结论，报警状态在同一批人员身上保持稳定
+采集与推理同进程时每路摄像头有一个后台线程按 TRACK_FPS 检测并更新目标，
+使目标在两次推理之间保持关联，推理直接使用其最近一次的结果（不重复检测）；
+拆分部署或 TRACK_FPS 为 0 时在推理帧上检测并更新。
+"""
+import itertools
+import threading
+import time
+
+import config
+import metrics
+from detector import describe_position, detector
+from logs import get_logger
+
+log = get_logger("tracker")
+
+# 多人的工牌结论合并时取最严重的
+_BADGE_SEVERITY = {"未佩戴": 3, "无法确认": 2, "佩戴": 1, "不适用": 0}
+
+
+def iou(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """一个跟踪目标"""
+
+    __slots__ = ("track_id", "label", "box", "score", "first_seen", "last_seen", "hits",
+                 "zones", "verdict", "verdict_zones", "verdict_at")
+
+    def __init__(self, track_id, detection, now):
+        self.track_id = track_id
+        self.label = detection.label
+        self.box = detection.box
+        self.score = detection.score
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.zones = ()            # 脚底点所在的区域名称
+        self.verdict = None        # 视觉大模型对该目标的结论 {"badge_status", "in_restricted_area"}
+        self.verdict_zones = None  # 得出结论时所在的区域
+        self.verdict_at = 0.0
+
+    def fresh(self, now):
+        """结论未过期且之后没有进出区域"""
+        return (self.verdict is not None and self.zones == self.verdict_zones
+                and now - self.verdict_at <= config.TRACK_VERDICT_TTL)
+
+    def to_dict(self):
+        data = {
+            "track_id": self.track_id,
+            "label": self.label,
+            "box": [round(v, 4) for v in self.box],
+            "zones": list(self.zones),
+            "age": round(self.last_seen - self.first_seen, 1),
+        }
+        if self.verdict is not None:
+            data.update(self.verdict)
+        return data
+
+
+class CameraTracker:
+    """一路摄像头的跟踪目标"""
+
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.last_facts = None     # 上次视觉大模型给出的视觉事实（环境风险等不按目标区分的部分）
+        self.last_vlm_at = 0.0
+        self.last_decision = None  # (人员编号集合, 推理结论)
+        self.running = False       # 是否有后台线程在持续更新
+        self.latest = None         # 后台线程最近一次更新：(检测结果, 本帧目标, 帧时间)
+
+    def update(self, detections, now):
+        """用一帧的检测结果更新目标（按 IoU 从大到小贪心匹配），返回本帧出现的目标"""
+        import roi
+
+        with self._lock:
+            pairs = sorted(
+                ((iou(track.box, detection.box), ti, di)
+                 for ti, track in enumerate(self.tracks)
+                 for di, detection in enumerate(detections) if track.label == detection.label),
+                reverse=True)
+            matched, used, current = set(), set(), []
+            for score, ti, di in pairs:
+                if score < config.TRACK_IOU:
+                    break
+                if ti in matched or di in used:
+                    continue
+                matched.add(ti)
+                used.add(di)
+                track, detection = self.tracks[ti], detections[di]
+                track.box = detection.box
+                track.score = detection.score
+                track.last_seen = max(track.last_seen, now)
+                track.hits += 1
+                current.append(track)
+            for di, detection in enumerate(detections):
+                if di not in used:
+                    track = Track(next(self._ids), detection, now)
+                    self.tracks.append(track)
+                    current.append(track)
+                    metrics.TRACKS_CREATED.inc(camera=self.camera_id)
+
+            self.tracks = [t for t in self.tracks if now - t.last_seen <= config.TRACK_MAX_AGE]
+            for track in current:
+                if track.label == "person":
+                    x0, _, x1, y1 = track.box
+                    track.zones = tuple(region.name for region in roi.zones_at(self.camera_id, (x0 + x1) / 2.0, y1))
+            metrics.TRACKS_ACTIVE.set(len(self.tracks), camera=self.camera_id)
+            current.sort(key=lambda t: t.track_id)
+            return current
+
+    def snapshot(self, now):
+        """后台线程最近一次的检测结果和本帧目标；没有或已超过 TRACK_MAX_AGE 时返回 None"""
+        latest = self.latest
+        if latest is None or abs(now - latest[2]) > config.TRACK_MAX_AGE:
+            return None
+        return latest[0], latest[1]
+
+    def reusable(self, current, now):
+        """本帧的人员都有有效结论、没有其他目标且环境风险的检查未过期时，可以不调用视觉大模型"""
+        persons = [t for t in current if t.label == "person"]
+        if not persons or len(persons) != len(current) or self.last_facts is None:
+            return False
+        if now - self.last_vlm_at > config.DETECTOR_VLM_MAX_SKIP:
+            return False
+        return all(track.fresh(now) for track in persons)
+
+    @staticmethod
+    def prompt_hint(current):
+        """附加在视觉提示词后的人员编号，要求视觉模型按编号逐个回答"""
+        persons = [t for t in current if t.label == "person"]
+        if not persons:
+            return ""
+        return (
+            "\n本地跟踪的人员编号如下：\n"
+            + "\n".join(f"{i}. {describe_position(t.box)}" for i, t in enumerate(persons, 1))
+            + '\n额外输出 "persons" 字段，按编号逐个给出：'
+            '[{"index": 编号, "badge_status": "佩戴" / "未佩戴" / "无法确认", "in_restricted_area": true/false}]\n'
+        )
+
+    def record(self, current, facts, now):
+        """记录视觉大模型的结论：逐人回答记到对应目标，漏答的目标采用整体判断"""
+        answers = {}
+        for item in facts.get("persons") or []:
+            try:
+                answers[int(item.get("index"))] = item
+            except (AttributeError, TypeError, ValueError):
+                continue
+        persons = [t for t in current if t.label == "person"]
+        with self._lock:
+            for index, track in enumerate(persons, 1):
+                answer = answers.get(index) or {}
+                track.verdict = {
+                    "badge_status": answer.get("badge_status") or facts.get("badge_status", "无法确认"),
+                    "in_restricted_area": bool(answer.get("in_restricted_area", facts.get("enter_restricted_area"))),
+                }
+                track.verdict_zones = track.zones
+                track.verdict_at = now
+            self.last_facts = facts
+            self.last_vlm_at = now
+        facts["tracks"] = [t.to_dict() for t in persons]
+        return facts
+
+    def cached_facts(self, current):
+        """
+        用目标缓存的结论组成视觉事实（环境部分沿用上次视觉大模型的结果）
+        配置了禁区时随后由 detector.apply 按人员框几何重新判定
+        """
+        persons = [t for t in current if t.label == "person"]
+        base = self.last_facts
+        badge = max((t.verdict["badge_status"] for t in persons),
+                    key=lambda status: _BADGE_SEVERITY.get(status, 2))
+        facts = {
+            "has_person": True,
+            "badge_status": badge,
+            "enter_restricted_area": any(t.verdict["in_restricted_area"] for t in persons),
+            "has_fire_or_smoke": base.get("has_fire_or_smoke", False),
+            "has_electric_risk": base.get("has_electric_risk", False),
+            "scene_summary": base.get("scene_summary", ""),
+            "object_details": {
+                "person_count": len(persons),
+                "person_positions": [describe_position(t.box) for t in persons],
+                "environment_status": (base.get("object_details") or {}).get("environment_status", ""),
+            },
+            "tracks": [t.to_dict() for t in persons],
+            "source": "tracker",
+        }
+        return facts
+
+    @staticmethod
+    def _key(current):
+        return frozenset(t.track_id for t in current if t.label == "person")
+
+    def remember_decision(self, current, result):
+        self.last_decision = (self._key(current), result)
+
+    def cached_decision(self, current):
+        """人员与上次完整推理时相同时的推理结论，否则为 None"""
+        if self.last_decision is not None and self.last_decision[0] == self._key(current):
+            return self.last_decision[1]
+        return None
+
+
+class Tracker:
+    """各摄像头的跟踪目标"""
+
+    def __init__(self):
+        self.cameras = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return config.TRACKING_ENABLED and detector.enabled
+
+    def get(self, camera_id):
+        camera_id = camera_id or config.DEFAULT_CAMERA
+        with self._lock:
+            if camera_id not in self.cameras:
+                self.cameras[camera_id] = CameraTracker(camera_id)
+            return self.cameras[camera_id]
+
+    def start(self, camera_ids):
+        """为本进程采集的摄像头启动后台跟踪线程"""
+        if config.TRACK_FPS <= 0:
+            return
+        for camera_id in camera_ids:
+            threading.Thread(target=self._run, args=(camera_id,), daemon=True,
+                             name=f"Tracker-{camera_id}").start()
+        log.info("目标跟踪已启动", extra={"cameras": len(camera_ids)})
+
+    def _run(self, camera_id):
+        interval = 1.0 / config.TRACK_FPS
+        camera_tracker = self.get(camera_id)
+        camera_tracker.running = True
+        try:
+            self._loop(camera_tracker, camera_id, interval)
+        finally:
+            camera_tracker.running = False
+            camera_tracker.latest = None
+
+    def _loop(self, camera_tracker, camera_id, interval):
+        last_seq = 0
+        while self.enabled:
+            start = time.time()
+            # 解码器启动后会替换帧缓冲，每次重新获取
+            buffer = config.frame_buffers.get(camera_id)
+            frame = buffer.wait_next(last_seq, timeout=1.0) if buffer is not None else None
+            if frame is None:
+                time.sleep(interval)
+                continue
+            last_seq = frame.seq
+            detections = detector.detect(frame)
+            if detections is not None and frame.valid:
+                current = camera_tracker.update(detections, frame.timestamp)
+                camera_tracker.latest = (detections, current, frame.timestamp)
+            elapsed = time.time() - start
+            if elapsed < interval:
+                time.sleep(interval - elapsed)
+
+
+# 全局跟踪实例
+tracker = Tracker()
@@ -0,0 +1,214 @@
+# ws_manager.py
+import asyncio
+import fnmatch
+import itertools
+import json
+import time
+
+import config
+import metrics
+from incidents import LEVEL_KEYS, LEVEL_ORDER, level_rank
+from logs import get_logger
+from stream import Link
+from ws_video import VideoHub
+
+log = get_logger("ws")
+
+_LEVEL_BY_KEY = {key: level for level, key in LEVEL_KEYS.items()}
+_LEVEL_KEYS_BY_RANK = [LEVEL_KEYS[level] for level in LEVEL_ORDER]
+_TRUE = ("1", "true", "yes", "on")
+
+
+def _split(value):
+    if value is None:
+        return ()
+    if isinstance(value, (list, tuple, set)):
+        return tuple(str(v).strip() for v in value if str(v).strip())
+    return tuple(v.strip() for v in str(value).split(",") if v.strip())
+
+
+class Subscriber:
+    """
+    一个 WebSocket 连接的订阅条件与推送方式
+
+    过滤条件：
+      topics       主题模式（相对 broadcast. 的 "<摄像头>.<等级>"，支持 * 通配），如 "cam01,*.critical"
+      cameras      只接收这些摄像头
+      min_level    最低报警等级（一般/严重/紧急 或 normal/severe/critical）
+      alarms_only  只接收报警及报警事件的状态变化
+    推送方式：
+      batch_ms 为 0 时立即推送；大于 0 时每隔 batch_ms 毫秒合并推送一次，
+      非报警的识别结果按摄像头只保留最新一条，报警消息全部保留
+    画面：
+      video 订阅的摄像头画面以二进制消息在同一连接上推送（见 ws_video.py）
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.topics = ("*.*",)
+        self.cameras = None
+        self.min_level = 0
+        self.alarms_only = False
+        self.batch_ms = 0
+        self.pending = {}  # 合并键 -> 已序列化的消息
+        self.flusher = None
+        self.video = []  # 订阅的画面（VideoView）
+        self.link = Link()  # 本连接的发送吞吐估计，用于选择画面档位
+
+    def configure(self, options):
+        """按连接参数或客户端消息更新订阅（只更新给出的字段）"""
+        if "topics" in options:
+            patterns = _split(options["topics"])
+            # 只写摄像头时匹配其所有等级
+            self.topics = tuple(p if "." in p else p + ".*" for p in patterns) or ("*.*",)
+        if "cameras" in options:
+            self.cameras = set(_split(options["cameras"])) or None
+        if "min_level" in options:
+            level = options["min_level"] or "无"
+            self.min_level = level_rank(_LEVEL_BY_KEY.get(level, level))
+        if "alarms_only" in options:
+            value = options["alarms_only"]
+            self.alarms_only = value is True or str(value).lower() in _TRUE
+        if "mode" in options or "batch_ms" in options:
+            if options.get("mode", "batch") == "immediate":
+                self.batch_ms = 0
+            else:
+                try:
+                    batch_ms = int(options.get("batch_ms") or config.WS_BATCH_MS_DEFAULT)
+                except (TypeError, ValueError):
+                    batch_ms = config.WS_BATCH_MS_DEFAULT
+                self.batch_ms = min(max(batch_ms, config.WS_BATCH_MS_MIN), config.WS_BATCH_MS_MAX)
+
+    def to_dict(self):
+        return {
+            "topics": list(self.topics),
+            "cameras": sorted(self.cameras) if self.cameras else None,
+            "min_level": _LEVEL_KEYS_BY_RANK[self.min_level],
+            "alarms_only": self.alarms_only,
+            "mode": "batch" if self.batch_ms else "immediate",
+            "batch_ms": self.batch_ms,
+            "video": [view.to_dict() for view in self.video],
+        }
+
+    def wants(self, topic, message):
+        camera_id = message.get("camera_id")
+        if self.cameras is not None and camera_id not in self.cameras:
+            return False
+        if self.alarms_only and not _is_alarm_related(message):
+            return False
+        if self.min_level and level_rank(message.get("alarm_level")) < self.min_level:
+            return False
+        if topic is None:
+            return True
+        topic = topic[len("broadcast."):] if topic.startswith("broadcast.") else topic
+        return any(fnmatch.fnmatchcase(topic, pattern) for pattern in self.topics)
+
+
+def _is_alarm_related(message):
+    return message.get("is_alarm") == "是" or bool(message.get("incident_state"))
+
+
+class ConnectionManager:
+    """本 worker 的 WebSocket 连接：按订阅过滤，每条消息只序列化一次"""
+
+    def __init__(self):
+        self.subscribers = {}  # websocket -> Subscriber
+        self._alarm_seq = itertools.count()
+        self.video = VideoHub()
+
+    @property
+    def active_connections(self):
+        return list(self.subscribers)
+
+    async def connect(self, websocket, options=None):
+        await websocket.accept()
+        subscriber = Subscriber(websocket)
+        self.subscribers[websocket] = subscriber
+        self.configure(websocket, options or {})
+        metrics.WS_CLIENTS.set(len(self.subscribers))
+        log.info("客户端连接", extra={"clients": len(self.subscribers)})
+        return subscriber
+
+    def configure(self, websocket, options):
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return None
+        subscriber.configure(options)
+        if "video" in options:
+            spec = options["video"]
+            if isinstance(spec, str):
+                # 查询参数形式：video=cam01,cam02&video_view=grid&video_fps=2&video_format=webp
+                spec = {"cameras": spec, "view": options.get("video_view"), "size": options.get("video_size"),
+                        "fps": options.get("video_fps"), "format": options.get("video_format")}
+            subscriber.video = self.video.configure(subscriber, spec)
+        if subscriber.batch_ms and (subscriber.flusher is None or subscriber.flusher.done()):
+            subscriber.flusher = asyncio.get_running_loop().create_task(self._flush_loop(subscriber))
+        return subscriber
+
+    def disconnect(self, websocket):
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber is not None:
+            self.video.remove(subscriber)
+            if subscriber.flusher is not None:
+                subscriber.flusher.cancel()
+        metrics.WS_CLIENTS.set(len(self.subscribers))
+        log.info("客户端断开", extra={"clients": len(self.subscribers)})
+
+    async def broadcast(self, message: dict, topic=None):
+        disconnected = []
+        start = time.perf_counter()
+        text = None
+        for subscriber in list(self.subscribers.values()):
+            if not subscriber.wants(topic, message):
+                continue
+            if text is None:
+                # 只在至少有一个订阅者需要时序列化，且只序列化一次
+                text = json.dumps(message, ensure_ascii=False)
+            if subscriber.batch_ms:
+                self._enqueue(subscriber, message, text)
+                continue
+            try:
+                await subscriber.websocket.send_text(text)
+            except Exception as e:
+                log.warning("发送失败: %s", e)
+                metrics.WS_SEND_FAILURES.inc()
+                disconnected.append(subscriber.websocket)
+        metrics.WS_BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+        for ws in disconnected:
+            self.disconnect(ws)
+
+    def _enqueue(self, subscriber, message, text):
+        if _is_alarm_related(message):
+            key = ("alarm", next(self._alarm_seq))
+        else:
+            key = ("latest", message.get("camera_id"))
+            if key in subscriber.pending:
+                metrics.WS_MESSAGES_COALESCED.inc()
+                # 移到末尾，保持按到达顺序推送
+                del subscriber.pending[key]
+        subscriber.pending[key] = text
+
+    async def _flush_loop(self, subscriber):
+        while subscriber.batch_ms:
+            await asyncio.sleep(subscriber.batch_ms / 1000.0)
+            if not await self._flush(subscriber):
+                return
+        # 切换为立即推送后发出剩余的合并消息
+        await self._flush(subscriber)
+
+    async def _flush(self, subscriber):
+        if not subscriber.pending:
+            return True
+        texts = list(subscriber.pending.values())
+        subscriber.pending.clear()
+        try:
+            await subscriber.websocket.send_text(
+                '{"type": "batch", "messages": [' + ",".join(texts) + "]}")
+            return True
+        except Exception as e:
+            log.warning("发送失败: %s", e)
+            metrics.WS_SEND_FAILURES.inc()
+            subscriber.flusher = None
+            self.disconnect(subscriber.websocket)
+            return False
@@ -0,0 +1,181 @@
+# ws_video.py
+"""
+WebSocket 视频通道
+
+画面以二进制消息经 /ws 推送，与报警等文本消息共用一个连接。每条二进制消息：
+  2 字节头长度（大端） + UTF-8 JSON 头 {"camera", "seq", "ts", "view", "level", "format"} + 图像字节
+
+订阅（/ws 的 JSON 消息，或查询参数 video=cam01&video_view=full&video_fps=10&video_format=jpeg）：
+  {"video": {"cameras": ["cam01"], "view": "full", "fps": 10, "format": "jpeg"}}
+  {"video": [{"cameras": ["cam01"], "view": "full"},
+             {"cameras": "*", "view": "grid", "fps": 2}]}     主画面 + 全部摄像头缩略图宫格
+  {"video": null}                                            停止推送画面
+view 为 full（主画面）或 grid（缩略图宫格），决定自动选择的档位范围（config.STREAM_VIEW_LEVELS）；
+size 可指定固定档位（config.STREAM_LADDER 中的名称），省略或为 auto 时按连接的实测吞吐自动选择；
+format 为 jpeg 或 webp。
+
+每路摄像头在本 worker 只有一个取帧任务，同一帧同一档位只编码一次，所有客户端共享；
+每个客户端按自己的帧率限速，上一帧还没发完时跳过新帧并降档（慢客户端只会少收帧、收低档画面，不会积压）。
+"""
+import asyncio
+import json
+import struct
+import time
+
+import config
+import metrics
+from logs import get_logger
+from stream import LevelSelector, record_frame_size, stream_fps
+
+log = get_logger("ws")
+
+
+class VideoView:
+    """一个客户端订阅的一路画面"""
+
+    __slots__ = ("subscriber", "camera_id", "view", "selector", "fmt",
+                 "interval", "last_sent", "sending")
+
+    def __init__(self, subscriber, camera_id, view, level, fps, fmt):
+        self.subscriber = subscriber
+        self.camera_id = camera_id
+        self.view = view
+        self.selector = LevelSelector(subscriber.link, fps, view, level, fmt)
+        self.fmt = fmt
+        self.interval = 1.0 / fps
+        self.last_sent = 0.0
+        self.sending = False
+
+    def to_dict(self):
+        return {
+            "camera": self.camera_id,
+            "view": self.view,
+            "size": "auto" if self.selector.auto else self.selector.level,
+            "level": self.selector.level,
+            "fps": round(1.0 / self.interval, 2),
+            "format": self.fmt,
+        }
+
+
+def parse_spec(spec):
+    """订阅参数 -> [(摄像头, 画面类型, 固定档位, 帧率, 格式)]，忽略未知摄像头"""
+    if not spec:
+        return []
+    if isinstance(spec, str):
+        spec = {"cameras": spec}
+    if isinstance(spec, dict):
+        spec = [spec]
+
+    views = {}
+    for item in spec:
+        cameras = item.get("cameras") or config.DEFAULT_CAMERA
+        if isinstance(cameras, str):
+            cameras = [c.strip() for c in cameras.split(",") if c.strip()]
+        if "*" in cameras:
+            cameras = list(config.CAMERAS)
+        level = item.get("size")
+        if level not in config.STREAM_LADDER:
+            level = None
+        view = item.get("view")
+        if view not in config.STREAM_VIEW_LEVELS:
+            view = "grid" if level == "thumb" else "full"
+        fps = stream_fps(item.get("fps"), view)
+        fmt = item.get("format") or "jpeg"
+        if fmt not in config.STREAM_FORMATS:
+            fmt = "jpeg"
+        for camera_id in cameras:
+            if camera_id in config.CAMERAS:
+                # 同一摄像头同一画面类型只保留一个订阅
+                views[(camera_id, view)] = (camera_id, view, level, fps, fmt)
+    return list(views.values())
+
+
+class VideoHub:
+    """本 worker 的画面推送：每路摄像头一个取帧任务，按客户端订阅分发"""
+
+    def __init__(self):
+        self.views = {}  # camera_id -> {(subscriber, 画面类型): VideoView}
+        self.pumps = {}  # camera_id -> 取帧任务
+
+    def configure(self, subscriber, spec):
+        """替换该客户端的画面订阅，返回新的订阅列表"""
+        self.remove(subscriber)
+        views = []
+        for camera_id, kind, level, fps, fmt in parse_spec(spec):
+            view = VideoView(subscriber, camera_id, kind, level, fps, fmt)
+            self.views.setdefault(camera_id, {})[(subscriber, kind)] = view
+            views.append(view)
+            if camera_id not in self.pumps:
+                self.pumps[camera_id] = asyncio.get_running_loop().create_task(self._pump(camera_id))
+        metrics.WS_VIDEO_VIEWS.set(sum(len(v) for v in self.views.values()))
+        return views
+
+    def remove(self, subscriber):
+        subscriber.video = []
+        for camera_id, views in list(self.views.items()):
+            for key in [key for key in views if key[0] is subscriber]:
+                views.pop(key).selector.close()
+            if not views:
+                del self.views[camera_id]
+        metrics.WS_VIDEO_VIEWS.set(sum(len(v) for v in self.views.values()))
+
+    async def _pump(self, camera_id):
+        """取帧任务：在事件循环中轮询最新帧（无锁读取，不占用线程），按各客户端帧率分发"""
+        loop = asyncio.get_running_loop()
+        last_seq = 0
+        try:
+            while self.views.get(camera_id):
+                views = list(self.views[camera_id].values())
+                await asyncio.sleep(min(view.interval for view in views))
+                buffer = config.frame_buffers.get(camera_id)
+                frame = buffer.read() if buffer is not None else None
+                if frame is None or frame.seq == last_seq:
+                    continue
+                last_seq = frame.seq
+                now = time.monotonic()
+                for view in self.views.get(camera_id, {}).values():
+                    if now - view.last_sent < view.interval * 0.9:
+                        continue
+                    if view.sending:
+                        metrics.WS_VIDEO_FRAMES_SKIPPED.inc(reason="busy")
+                        view.selector.congested = True
+                        continue
+                    view.sending = True
+                    view.last_sent = now
+                    loop.create_task(self._send(view, frame))
+        finally:
+            self.pumps.pop(camera_id, None)
+
+    async def _send(self, view, frame):
+        try:
+            # 编码放到线程池，不阻塞事件循环；同档位已编码过时直接取缓存
+            level = view.selector.level
+            size, quality = config.STREAM_LADDER[level]
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, frame.encoded, size, quality, view.fmt)
+            if not frame.valid:
+                # 编码期间槽位已被覆盖，丢弃本帧
+                metrics.FRAMES_DROPPED.inc(camera=view.camera_id, reason="stale")
+                return
+            header = json.dumps({
+                "camera": view.camera_id,
+                "seq": frame.seq,
+                "ts": frame.timestamp,
+                "view": view.view,
+                "level": level,
+                "format": view.fmt,
+            }).encode("utf-8")
+            start = time.monotonic()
+            await view.subscriber.websocket.send_bytes(struct.pack(">H", len(header)) + header + data)
+            now = time.monotonic()
+            view.subscriber.link.observe(len(data), now - start)
+            record_frame_size(level, len(data), view.fmt)
+            view.selector.update(now)
+            metrics.WS_VIDEO_FRAMES.inc(level=level)
+            metrics.WS_VIDEO_BYTES.inc(len(data), level=level)
+        except Exception as e:
+            log.warning("画面发送失败: %s", e, extra={"camera_id": view.camera_id})
+            metrics.WS_SEND_FAILURES.inc()
+            self.remove(view.subscriber)
+        finally:
+            view.sending = False